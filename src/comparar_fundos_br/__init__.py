@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
+from .transporte import *
+from .cache import *
 from .fundosbr import *
+from .assincrono import *
 from .benchmarks import *
 from .comparador import *
+from .metricas import *
 from . import version
 
 __version__ = version.__version__
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Rafael
+"""
+import asyncio
+import time
+import weakref
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+import pandas as pd
+import polars as pl
+from comparar_fundos_br.cache import _baixar_arquivo, _descartar_arquivo
+from comparar_fundos_br.fundosbr import (_agrupar_por_arquivo, _arquivo_fidc, _caminho_informe_estruturado,
+                                         _concatenar_informes,
+                                         _finalizar_informes, _ler_dados_diarios_do_arquivo, _ler_fip_do_arquivo,
+                                         _ler_zip_files, _periodos, _revalidar_dados_diarios, _url_dados_diarios,
+                                         _url_fidc, _url_fip, _verificar_status)
+
+_CONFIG_ASSINCRONO: Dict[str, Union[int, float]] = {
+    "max_concorrencia": 4,
+    "intervalo_minimo": 0.2,
+}
+
+#semáforo e limite por servidor de cada event loop (primitivas do asyncio não podem ser compartilhadas entre loops)
+_controles: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[asyncio.Semaphore, _LimitePorServidor]]" = \
+    weakref.WeakKeyDictionary()
+
+def configurar_assincrono(max_concorrencia: Optional[int] = None,
+                          intervalo_minimo: Optional[float] = None) -> Dict[str, Union[int, float]]:
+    '''Configura os downloads das funções assíncronas (fundosbr_async, get_fidc_async, get_fip_async).
+    Parâmetros:
+    -max_concorrencia (int): número máximo de downloads simultâneos, somando todas as chamadas;
+    -intervalo_minimo (float): intervalo mínimo, em segundos, entre o início de duas requisições ao mesmo servidor.
+    Retorna a configuração vigente.'''
+    if max_concorrencia is not None:
+        _CONFIG_ASSINCRONO["max_concorrencia"] = max(1, int(max_concorrencia))
+    if intervalo_minimo is not None:
+        _CONFIG_ASSINCRONO["intervalo_minimo"] = max(0.0, float(intervalo_minimo))
+    _controles.clear()
+    return dict(_CONFIG_ASSINCRONO)
+
+class _LimitePorServidor:
+    '''Espaça o início das requisições a um mesmo servidor em pelo menos intervalo segundos.'''
+    def __init__(self, intervalo: float):
+        self.intervalo = intervalo
+        self._travas: Dict[str, asyncio.Lock] = {}
+        self._ultimo_inicio: Dict[str, float] = {}
+
+    async def aguardar(self, url: str) -> None:
+        servidor = urlparse(url).netloc
+        trava = self._travas.setdefault(servidor, asyncio.Lock())
+        async with trava:
+            espera = self._ultimo_inicio.get(servidor, float("-inf")) + self.intervalo - time.monotonic()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            self._ultimo_inicio[servidor] = time.monotonic()
+
+def _controles_do_loop() -> Tuple[asyncio.Semaphore, _LimitePorServidor]:
+    loop = asyncio.get_running_loop()
+    if loop not in _controles:
+        _controles[loop] = (asyncio.Semaphore(int(_CONFIG_ASSINCRONO["max_concorrencia"])),
+                            _LimitePorServidor(float(_CONFIG_ASSINCRONO["intervalo_minimo"])))
+    return _controles[loop]
+
+async def _baixar_async(url: str, proxy: Optional[Dict[str, str]] = None,
+                        revalidar: bool = True) -> Tuple[int, Optional[str], bool]:
+    '''Baixa a url para o disco em uma thread, sem bloquear o event loop, respeitando a concorrência máxima
+    e o intervalo mínimo por servidor. Retorna (status, caminho, temporario), como _baixar_arquivo;
+    o arquivo deve ser liberado com _descartar_arquivo.'''
+    semaforo, limite = _controles_do_loop()
+    async with semaforo:
+        await limite.aguardar(url)
+        status, caminho, temporario, _ = await asyncio.to_thread(_baixar_arquivo, url, proxy, revalidar)
+        return status, caminho, temporario
+
+async def _ler_grupo_async(ano: int, meses: List[int], proxy: Optional[Dict[str, str]] = None,
+                           cnpj: Optional[str] = None,
+                           num_minimo_cotistas: Optional[int] = None,
+                           patriminio_liquido_minimo: Optional[int] = None,
+                           compactar: bool = False) -> List[pl.dataframe.frame.DataFrame]:
+    status, caminho, temporario = await _baixar_async(_url_dados_diarios(ano, meses[0]), proxy,
+                                                      revalidar=_revalidar_dados_diarios(ano, meses[0]))
+    try:
+        _verificar_status(status)
+        #a leitura do csv também roda em thread: o polars libera o GIL e o event loop segue atendendo outras tarefas
+        return await asyncio.to_thread(_ler_dados_diarios_do_arquivo, ano, meses, proxy, cnpj, num_minimo_cotistas,
+                                       patriminio_liquido_minimo, caminho, compactar)
+    finally:
+        _descartar_arquivo(caminho, temporario)
+
+async def fundosbr_async(
+            anos: Union[List[int], int],
+            meses: Union[List[int], int],
+            cnpj: Optional[str] = None,
+            num_minimo_cotistas: Optional[int] = None,
+            patriminio_liquido_minimo: Optional[int] = None,
+            proxy: Optional[Dict[str, str]] = None,
+            output_format: str = 'pandas',
+            chave_cnpj: bool = False,
+            compactar: bool = False
+				) -> Union[pd.DataFrame, pl.dataframe.frame.DataFrame]:
+    '''Versão assíncrona de fundosbr, para uso dentro de um event loop (await fundosbr_async(...)).
+    Os arquivos da CVM são baixados em paralelo, gravados em disco aos poucos e lidos em threads, sem bloquear
+    o event loop. A concorrência e o intervalo entre requisições são definidos em configurar_assincrono.
+    O resultado é o mesmo de fundosbr com os mesmos parâmetros.'''
+    start = time.time()
+    grupos = _agrupar_por_arquivo(_periodos(anos, meses))
+    resultados = await asyncio.gather(*[_ler_grupo_async(ano, meses_do_arquivo, proxy, cnpj, num_minimo_cotistas,
+                                                         patriminio_liquido_minimo, compactar)
+                                        for ano, meses_do_arquivo in grupos])
+    informes = [informe for informes_do_arquivo in resultados for informe in informes_do_arquivo]
+    del resultados
+    informe_diario_fundos_historico = _concatenar_informes(informes, compactar)
+    del informes
+    print(f"Dados diários finalizados em {round((time.time()-start)/60,2)} minutos")
+    return _finalizar_informes(informe_diario_fundos_historico, chave_cnpj, output_format)
+
+async def get_fip_async(ano: int,
+                        proxy: Union[Dict[str, str], None] = None) -> pd.DataFrame:
+    '''Versão assíncrona de get_fip.'''
+    status, caminho, temporario = await _baixar_async(_url_fip(ano), proxy)
+    try:
+        return await asyncio.to_thread(_ler_fip_do_arquivo, _caminho_informe_estruturado(status, caminho))
+    finally:
+        _descartar_arquivo(caminho, temporario)
+
+async def get_fidc_async(ano: int,
+                         mes: int,
+                         tabela: str = 'X',
+                         subtabela: int = 3,
+                         proxy: Union[Dict[str, str], None] = None) -> pd.DataFrame:
+    '''Versão assíncrona de get_fidc. Vários meses podem ser buscados em paralelo com asyncio.gather.'''
+    status, caminho, temporario = await _baixar_async(_url_fidc(ano, mes), proxy)
+    try:
+        fidc = await asyncio.to_thread(_ler_zip_files, _caminho_informe_estruturado(status, caminho),
+                                       _arquivo_fidc(ano, mes, tabela, subtabela))
+        return fidc.to_pandas()
+    finally:
+        _descartar_arquivo(caminho, temporario)
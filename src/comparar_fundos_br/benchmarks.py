@@ -3,15 +3,19 @@
 @author: Rafael
 """
 import io
+import json
+import os
+import threading
 import warnings
-from typing import Dict, List, Tuple, Union, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple, Union, Optional
 import requests
-from io import BytesIO
+import numpy as np
 import pandas as pd
 import polars as pl
 import requests
-import yfinance as yf
-import tesouro_direto_br as tesouro_direto
+from comparar_fundos_br.cache import _CONFIG_CACHE, _baixar_arquivo, _descartar_arquivo, _escrita_atomica
+from comparar_fundos_br.transporte import _get
 
 warnings.filterwarnings("ignore")
 
@@ -20,8 +24,137 @@ pd.set_option("display.max_rows", 100)
 pd.set_option("display.max_columns", 10)
 pd.set_option("display.width", 1000)
 
-import seaborn as sns; sns.set()
-import matplotlib.pyplot as plt
+_URL_INDICES_ANBIMA = "https://s3-data-prd-use1-precos.s3.us-east-1.amazonaws.com/arquivos/indices-historico/{}-HISTORICO.xls"
+_ARQUIVOS_ANBIMA = {"imas": "IMAS", "imab": "IMAB", "imab5": "IMAB5", "imab5+": "IMAB5MAIS",
+                    "imab5p2": "IMAB5P2", "irfm": "IRFM", "irfmp2": "IRFMP2", "ihfa": "IHFA"}
+_TICKERS_YAHOO = {"IBOV": "^BVSP", "DIVO11": "DIVO11.SA", "SP500": "^GSPC", "USD": "BRL=X"}
+
+#yf.download guarda o resultado em variáveis globais; chamadas simultâneas se misturam
+_TRAVA_YAHOO = threading.Lock()
+
+def _caminhos_serie_benchmark(nome: str) -> Tuple[str, str]:
+    diretorio = os.path.join(str(_CONFIG_CACHE["diretorio"]), "benchmarks")
+    os.makedirs(diretorio, exist_ok=True)
+    return os.path.join(diretorio, f"{nome}.parquet"), os.path.join(diretorio, f"{nome}.json")
+
+def _ler_serie_benchmark(nome: str) -> Tuple[Optional[pd.DataFrame], Optional[List[pd.Timestamp]]]:
+    caminho_serie, caminho_cobertura = _caminhos_serie_benchmark(nome)
+    if not (os.path.exists(caminho_serie) and os.path.exists(caminho_cobertura)):
+        return None, None
+    with open(caminho_cobertura, "r", encoding="utf-8") as f:
+        cobertura = [pd.Timestamp(x) for x in json.load(f)]
+    return pd.read_parquet(caminho_serie), cobertura
+
+def _trechos_faltantes(cobertura: Optional[List[pd.Timestamp]], inicio: pd.Timestamp,
+                       fim: pd.Timestamp) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+    '''Trechos de [inicio, fim] fora do intervalo já consultado: antes do início ou após a última data disponível.'''
+    if cobertura is None:
+        return [(inicio, fim)]
+    trechos = []
+    if inicio < cobertura[0]:
+        trechos.append((inicio, cobertura[0] - pd.Timedelta(days=1)))
+    if fim > cobertura[1]:
+        trechos.append((cobertura[1] + pd.Timedelta(days=1), fim))
+    return trechos
+
+def _trechos_ajustados(serie: Optional[pd.DataFrame], cobertura: Optional[List[pd.Timestamp]], inicio: pd.Timestamp,
+                       fim: pd.Timestamp) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+    '''Trechos faltantes de séries de preços ajustados por dividendos e desdobramentos. Cada trecho inclui a data do
+    cache vizinha a ele, usada em _mesma_base para conferir se a origem reajustou os preços antigos.'''
+    trechos = _trechos_faltantes(cobertura, inicio, fim)
+    if serie is None or serie.empty or cobertura is None:
+        return trechos
+    return [(i, max(f, serie.index.min())) if f < cobertura[0] else (min(i, serie.index.max()), f)
+            for i, f in trechos]
+
+def _mesma_base(serie: pd.DataFrame, novos: List[pd.DataFrame]) -> bool:
+    '''Confere, nas datas em comum com o cache, se os preços baixados agora estão na mesma base de ajuste.
+    Após um dividendo ou desdobramento a origem reajusta todos os preços anteriores, e o cache deixa de poder
+    ser apenas complementado.'''
+    for novo in novos:
+        if novo.empty:
+            continue
+        novo = novo.set_axis(pd.to_datetime(novo.index), axis=0)
+        comuns = serie.index.intersection(novo.index)
+        colunas = serie.columns.intersection(novo.columns)
+        if comuns.empty or colunas.empty:
+            return False
+        if not np.allclose(serie.loc[comuns, colunas].to_numpy(dtype=np.float64),
+                           novo.loc[comuns, colunas].to_numpy(dtype=np.float64), rtol=1e-6, equal_nan=True):
+            return False
+    return True
+
+def _atualizar_serie_benchmark(nome: str, serie: Optional[pd.DataFrame], cobertura: Optional[List[pd.Timestamp]],
+                               novos: List[pd.DataFrame], inicio: pd.Timestamp) -> Optional[pd.DataFrame]:
+    '''Une os trechos baixados à série do cache e grava o resultado. Retorna None se não houver nenhum dado.'''
+    partes = [x for x in ([] if serie is None else [serie]) + novos if not x.empty]
+    if not partes:
+        return None
+    serie = pd.concat(partes)
+    serie = serie[~serie.index.duplicated(keep="last")].sort_index()
+    #o fim coberto é a última data com dado, assim datas ainda não divulgadas são buscadas na próxima consulta
+    cobertura = [inicio if cobertura is None else min(inicio, cobertura[0]), serie.index.max()]
+    caminho_serie, caminho_cobertura = _caminhos_serie_benchmark(nome)
+    _escrita_atomica(caminho_serie, serie.to_parquet())
+    _escrita_atomica(caminho_cobertura, json.dumps([str(x.date()) for x in cobertura]).encode("utf-8"))
+    return serie
+
+def _serie_benchmark(nome: str, data_inicio: str, data_fim: str,
+                     buscar: Callable[[str, str], pd.DataFrame], ajustada: bool = False) -> pd.DataFrame:
+    '''Retorna a série do benchmark entre data_inicio e data_fim (inclusive) usando o cache local.
+    A série fica salva em parquet com o intervalo de datas já consultado; quando o pedido sai desse intervalo,
+    buscar é chamada apenas para os trechos que faltam.
+    Com ajustada=True (preços ajustados por proventos, como os do Yahoo), se os trechos novos mostrarem que
+    os preços antigos foram reajustados, a série é baixada de novo por inteiro em vez de complementada.'''
+    inicio, fim = pd.Timestamp(data_inicio).normalize(), pd.Timestamp(data_fim).normalize()
+    if not _CONFIG_CACHE["ativo"]:
+        return buscar(inicio.strftime("%Y-%m-%d"), fim.strftime("%Y-%m-%d"))
+    serie, cobertura = _ler_serie_benchmark(nome)
+    trechos = (_trechos_ajustados(serie, cobertura, inicio, fim) if ajustada
+               else _trechos_faltantes(cobertura, inicio, fim))
+    if trechos or serie is None:
+        novos = [buscar(i.strftime("%Y-%m-%d"), f.strftime("%Y-%m-%d")) for i, f in trechos]
+        inicio_cache = inicio
+        if ajustada and serie is not None and cobertura is not None and not _mesma_base(serie, novos):
+            inicio_cache, fim_cache = min(inicio, cobertura[0]), max(fim, cobertura[1])
+            novos = [buscar(inicio_cache.strftime("%Y-%m-%d"), fim_cache.strftime("%Y-%m-%d"))]
+            serie, cobertura = None, None
+        serie = _atualizar_serie_benchmark(nome, serie, cobertura, novos, inicio_cache)
+        if serie is None:
+            return novos[0]
+    return serie[(serie.index >= inicio) & (serie.index <= fim)]
+
+def _serie_vazia(coluna: str, nome_indice: str) -> pd.DataFrame:
+    return pd.DataFrame({coluna: pd.Series(dtype="float64")}, index=pd.DatetimeIndex([], name=nome_indice))
+
+def _baixar_cdi_bacen(inicio: str, fim: str, proxies: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    codigo_bcb = 12
+    anoi, mesi, diai = inicio.split('-')
+    anof, mesf, diaf = fim.split('-')
+    iniciob = '/'.join([diai, mesi, anoi])
+    fimb = '/'.join([diaf, mesf, anof])
+    url = f"https://api.bcb.gov.br/dados/serie/bcdata.sgs.{codigo_bcb}/dados?formato=json&dataInicial={iniciob}&dataFinal={fimb}"
+    resposta = _get(url, proxies)
+    #trecho sem dados (fim de semana, feriado ou data ainda não divulgada)
+    if resposta.status_code == 404 or resposta.text.strip() == "[]":
+        return _serie_vazia("CDI", "data")
+    cdi = pd.read_json(io.StringIO(resposta.text))
+    cdi["data"] = pd.to_datetime(cdi["data"], dayfirst=True)
+    cdi = cdi.set_index("data")
+    cdi = cdi[(cdi.index>=inicio) & (cdi.index<=fim)] / 100
+    cdi.columns = ['CDI']
+    return cdi
+
+def _precos_yahoo(tickers: List[str], inicio: str, fim: str, proxy: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    '''Fonte padrão de preços: fechamento ajustado do Yahoo Finance (datas x tickers) entre inicio e fim, inclusive,
+    com todos os tickers em uma única chamada.'''
+    fim_exclusivo = (pd.Timestamp(fim) + pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+    #yfinance só é importado quando há algo a baixar do Yahoo, para não pesar no import nem nas demais fontes
+    import yfinance as yf
+    with _TRAVA_YAHOO:
+        if proxy: yf.set_config(proxy=proxy)
+        precos = yf.download(tickers, start=inicio, end=fim_exclusivo, interval="1d", auto_adjust=True)["Close"]
+    return precos
 
 def get_cdi(inicio: str, fim: str, metodo_cdi: str ='bacen',  proxies: Optional[Dict[str, str]] = None) -> pd.DataFrame:
     '''Função que provê o retorno do CDI usada como referência especialmente para Renda Fixa.
@@ -31,8 +164,10 @@ def get_cdi(inicio: str, fim: str, metodo_cdi: str ='bacen',  proxies: Optional[
     BACEN = usa-se a série diária do CDI.
     As datas devem ser no formato string '2025-01-02', ou seja, 'ANO-MES-DIA'.
     A saída gera o retorno diário e o acumulado.
-    Os valores resultantes são próximos, mas não iguais. Divergem em função da metodologia.'''
+    Os valores resultantes são próximos, mas não iguais. Divergem em função da metodologia.
+    As séries da ANBIMA e do BACEN ficam no cache local e só os períodos ainda não consultados são baixados.'''
     if metodo_cdi.lower()=='tesouro':
+        import tesouro_direto_br as tesouro_direto
         titulos_ofertados = tesouro_direto.busca_tesouro_direto(tipo="taxa", proxies=proxies, agrupar=True).reset_index()
     
         excluir = ["Juros Semestrais", "Renda+", "Educa+"]
@@ -49,29 +184,11 @@ def get_cdi(inicio: str, fim: str, metodo_cdi: str ='bacen',  proxies: Optional[
         cdi['Retorno CDI'] = cdi["CDI"].pct_change()
         cdi['Retorno Acumulado CDI'] = (1+cdi['Retorno CDI']).cumprod()-1
     elif metodo_cdi.lower()=='anbima':
-        imas = pl.read_excel('https://s3-data-prd-use1-precos.s3.us-east-1.amazonaws.com/arquivos/indices-historico/IMAS-HISTORICO.xls',
-                             engine='calamine', columns=[1,2])
-        imas = imas.filter((pl.col('Data de Referência')>=pd.to_datetime(inicio)) & (pl.col('Data de Referência')<=pd.to_datetime(fim)))
-        imas = imas.rename({'Número Índice': 'CDI'})
-        imas = imas.with_columns(pl.col('CDI').pct_change().alias("Retorno CDI"))
-        imas = imas.with_columns(((pl.col('Retorno CDI')+1).cum_prod()-1).alias("Retorno Acumulado CDI"))
-        cdi = imas.to_pandas().set_index('Data de Referência')
+        cdi = get_indices_anbima(inicio, fim, "imas", proxies).rename(columns={"IMAS": "CDI"})
+        cdi['Retorno CDI'] = cdi["CDI"].pct_change()
+        cdi['Retorno Acumulado CDI'] = (1+cdi['Retorno CDI']).cumprod()-1
     elif metodo_cdi.lower()=="bacen":
-        codigo_bcb = 12
-        anoi, mesi, diai = inicio.split('-')
-        anof, mesf, diaf = fim.split('-')
-        iniciob = '/'.join([diai, mesi, anoi])
-        fimb = '/'.join([diaf, mesf, anof])
-        url = f"https://api.bcb.gov.br/dados/serie/bcdata.sgs.{codigo_bcb}/dados?formato=json&dataInicial={iniciob}&dataFinal={fimb}"
-        if proxies:
-            dados_bacen = requests.get(url, proxies=proxies, verify=False).text
-        else:
-            dados_bacen = requests.get(url).text
-        cdi = pd.read_json(io.StringIO(dados_bacen))
-        cdi["data"] = pd.to_datetime(cdi["data"], dayfirst=True)
-        cdi = cdi.set_index("data")
-        cdi = cdi[(cdi.index>=inicio) & (cdi.index<=fim)] / 100
-        cdi.columns = ['CDI']
+        cdi = _serie_benchmark("CDI_BACEN", inicio, fim, lambda i, f: _baixar_cdi_bacen(i, f, proxies))
         cdi['Retorno CDI'] = cdi["CDI"]
         cdi['Retorno Acumulado CDI'] = (1+cdi['Retorno CDI']).cumprod()-1
     else:
@@ -92,37 +209,42 @@ def get_indices_anbima(data_inicio: str, data_fim: str, benchmark: str = "imas",
     -IHFA (ihfa).
     As datas devem ser no formato string '2025-01-02', ou seja, 'ANO-MES-DIA'.
     Mais informações em https://data.anbima.com.br/indices'''
-    def check_proxy(url, proxy):
-        response = requests.get(url, proxies=proxy, stream=True)
-        response.raise_for_status()
-        file_like_object = BytesIO(response.content)
-        return file_like_object
-    if benchmark.lower()=="imas":
-        file_object = 'https://s3-data-prd-use1-precos.s3.us-east-1.amazonaws.com/arquivos/indices-historico/IMAS-HISTORICO.xls'
-    elif benchmark.lower()=="imab":
-        file_object = 'https://s3-data-prd-use1-precos.s3.us-east-1.amazonaws.com/arquivos/indices-historico/IMAB-HISTORICO.xls'
-    elif benchmark.lower()=="imab5":
-        file_object = 'https://s3-data-prd-use1-precos.s3.us-east-1.amazonaws.com/arquivos/indices-historico/IMAB5-HISTORICO.xls'
-    elif benchmark.lower()=="imab5+":
-        file_object = 'https://s3-data-prd-use1-precos.s3.us-east-1.amazonaws.com/arquivos/indices-historico/IMAB5MAIS-HISTORICO.xls'
-    elif benchmark.lower()=="imab5p2":
-        file_object = 'https://s3-data-prd-use1-precos.s3.us-east-1.amazonaws.com/arquivos/indices-historico/IMAB5P2-HISTORICO.xls'
-    elif benchmark.lower()=="irfm":
-        file_object = 'https://s3-data-prd-use1-precos.s3.us-east-1.amazonaws.com/arquivos/indices-historico/IRFM-HISTORICO.xls'
-    elif benchmark.lower()=="irfmp2":
-        file_object = 'https://s3-data-prd-use1-precos.s3.us-east-1.amazonaws.com/arquivos/indices-historico/IRFMP2-HISTORICO.xls'
-    elif benchmark.lower()=="ihfa":
-        file_object = 'https://s3-data-prd-use1-precos.s3.us-east-1.amazonaws.com/arquivos/indices-historico/IHFA-HISTORICO.xls'
+    if benchmark.lower() not in _ARQUIVOS_ANBIMA:
+        raise ValueError('Benchmark não encontrado.')
+    url = _URL_INDICES_ANBIMA.format(_ARQUIVOS_ANBIMA[benchmark.lower()])
+    def buscar(inicio: str, fim: str) -> pd.DataFrame:
+        status, caminho, temporario, _ = _baixar_arquivo(url, proxy)
+        try:
+            if status != 200 or caminho is None:
+                raise requests.HTTPError(f"{status} Error for url: {url}")
+            with open(caminho, "rb") as arquivo:
+                indice = pl.read_excel(arquivo, engine='calamine', columns=[1,2])
+        finally:
+            _descartar_arquivo(caminho, temporario)
+        indice = indice.filter((pl.col('Data de Referência')>=pd.to_datetime(inicio)) & (pl.col('Data de Referência')<=pd.to_datetime(fim)))
+        indice = indice.rename({'Número Índice': benchmark.upper()})
+        return indice.to_pandas().set_index('Data de Referência')
+    return _serie_benchmark(benchmark.upper(), data_inicio, data_fim, buscar)
+
+def _get_benchmark(data_inicio: str, data_fim: str, benchmark: str = "CDI", metodo_cdi = 'bacen', proxy=None) -> pd.DataFrame:
+    if benchmark.upper()=="CDI":
+        df_benchmark = get_cdi(data_inicio, data_fim, metodo_cdi, proxy)
     else:
-        raise ValueError('Benchmark não encontrado.')                                            
-    if proxy:
-        file_object = check_proxy(file_object, proxy)
-    indice = pl.read_excel(file_object, engine='calamine', columns=[1,2])
-    indice = indice.filter((pl.col('Data de Referência')>=pd.to_datetime(data_inicio)) & (pl.col('Data de Referência')<=pd.to_datetime(data_fim)))
-    indice = indice.rename({'Número Índice': benchmark.upper()})
-    return indice.to_pandas().set_index('Data de Referência')
-
-def get_benchmarks(data_inicio: str, data_fim: str, benchmark: str = "CDI", metodo_cdi = 'bacen', proxy=None) -> pd.DataFrame:
+        if benchmark.upper() in _TICKERS_YAHOO:
+            ticker = _TICKERS_YAHOO[benchmark.upper()]
+            df_benchmark = _serie_benchmark(benchmark.upper(), data_inicio, data_fim,
+                                            lambda i, f: _precos_yahoo([ticker], i, f, proxy).set_axis([benchmark.upper()], axis=1),
+                                            ajustada=True)
+            #o yahoo trata data_fim como exclusiva
+            df_benchmark = df_benchmark[df_benchmark.index < pd.Timestamp(data_fim)]
+        else:
+            df_benchmark = get_indices_anbima(data_inicio, data_fim, benchmark, proxy)
+        df_benchmark[f'Retorno {benchmark.upper()}'] = df_benchmark[benchmark.upper()].pct_change()
+        df_benchmark[f'Retorno Acumulado {benchmark.upper()}'] = (1+df_benchmark[f'Retorno {benchmark.upper()}']).cumprod()-1
+    return df_benchmark
+
+def get_benchmarks(data_inicio: str, data_fim: str, benchmark: Union[str, List[str]] = "CDI", metodo_cdi = 'bacen', proxy=None,
+                   benchmarks: Optional[List[str]] = None, max_workers: Optional[int] = None) -> pd.DataFrame:
     '''Função que provê o retorno de alguns indices ANBIMA, CDI e renda variável: ibov, divo11 (similar ao IDIV) e sp500.
     Esta função implementa os seguintes índices anbima: 
     -IMA-S (imas);
@@ -133,55 +255,89 @@ def get_benchmarks(data_inicio: str, data_fim: str, benchmark: str = "CDI", meto
     -IRFM P2 (irfmp2);
     -IHFA (ihfa).
     As datas devem ser no formato string '2025-01-02', ou seja, 'ANO-MES-DIA'.
-    A saída gera o retorno diário e o acumulado.'''
-    if proxy: yf.set_config(proxy=proxy)
-    if benchmark.upper()=="CDI":
-        df_benchmark = get_cdi(data_inicio, data_fim, metodo_cdi, proxy)
-    else:
-        if benchmark.upper()=="IBOV":
-            df_benchmark = yf.download("^BVSP", start=data_inicio, end=data_fim, interval="1d", auto_adjust=True)["Close"]
-            df_benchmark.columns = ["IBOV"]
-        elif benchmark.upper()=="DIVO11":
-            df_benchmark = yf.download("DIVO11.SA", start=data_inicio, end=data_fim, interval="1d", auto_adjust=True)["Close"]
-            df_benchmark.columns = ["DIVO11"]
-        elif benchmark.upper()=="SP500":
-            df_benchmark = yf.download("^GSPC", start=data_inicio, end=data_fim, interval="1d", auto_adjust=True)["Close"]
-            df_benchmark.columns = ["SP500"]
-        elif benchmark.upper()=="USD":
-            df_benchmark = yf.download("BRL=X", start=data_inicio, end=data_fim, interval="1d", auto_adjust=True)["Close"]
-            df_benchmark.columns = ["USD"]
-        else:
-            df_benchmark = get_indices_anbima(data_inicio, data_fim, benchmark, proxy)
-        df_benchmark[f'Retorno {benchmark.upper()}'] = df_benchmark[benchmark.upper()].pct_change()
-        df_benchmark[f'Retorno Acumulado {benchmark.upper()}'] = (1+df_benchmark[f'Retorno {benchmark.upper()}']).cumprod()-1
-    return df_benchmark
+    A saída gera o retorno diário e o acumulado.
+    Para obter vários benchmarks de uma vez, informe uma lista em benchmark: as fontes são consultadas
+    simultaneamente (até max_workers) e os resultados unidos pelas datas.
+    O parâmetro benchmarks está obsoleto; use benchmark.
+    As séries baixadas ficam no cache local (ver configurar_cache) e são apenas complementadas nas consultas seguintes.'''
+    if benchmarks is not None:
+        warnings.warn("O parâmetro benchmarks está obsoleto e será removido; informe a lista em benchmark.",
+                      DeprecationWarning, stacklevel=2)
+        benchmark = benchmarks
+    lista_benchmarks = benchmark
+    if isinstance(lista_benchmarks, str):
+        return _get_benchmark(data_inicio, data_fim, lista_benchmarks, metodo_cdi, proxy)
+    if not lista_benchmarks:
+        raise ValueError("Informe ao menos um benchmark.")
+    with ThreadPoolExecutor(max_workers=max_workers or len(lista_benchmarks)) as executor:
+        resultados = list(executor.map(lambda x: _get_benchmark(data_inicio, data_fim, x, metodo_cdi, proxy), lista_benchmarks))
+    return pd.concat(resultados, axis=1).sort_index()
+
+def _baixar_por_trecho(fonte_precos: Callable[[List[str], str, str], pd.DataFrame],
+                       trechos: Dict[Tuple[pd.Timestamp, pd.Timestamp], List[str]]) -> Dict[str, List[pd.DataFrame]]:
+    '''Baixa os preços de cada trecho com todos os seus tickers em uma única chamada e separa por ticker.'''
+    novos: Dict[str, List[pd.DataFrame]] = {}
+    for (i, f), grupo in trechos.items():
+        precos = fonte_precos(grupo, i.strftime("%Y-%m-%d"), f.strftime("%Y-%m-%d"))
+        for st in grupo:
+            novos.setdefault(st, []).append(precos[[st]].dropna() if st in precos.columns else precos.iloc[:0, :0])
+    return novos
 
 def get_stocks(
                 acoes: Union[List[str], str],
                 data_inicio: str,
                 data_fim: str,
                 proxy: Union[Dict[str, str], None] = None,
+                fonte_precos: Optional[Callable[[List[str], str, str], pd.DataFrame]] = None,
                 ) -> pd.DataFrame:
     """Função para capturar dados de Ações ou Índices Listados.
+    Todos os tickers são baixados em uma única chamada e os preços ficam no cache local: nas consultas seguintes,
+    só os períodos ainda não consultados são buscados. Como os preços são ajustados por proventos, quando um trecho
+    novo mostra que a fonte reajustou os preços já guardados (dividendo ou desdobramento), o ticker é baixado de novo
+    por inteiro.
+    O parâmetro fonte_precos permite trocar o Yahoo Finance por outra fonte: uma função que recebe a lista de tickers,
+    a data inicial e a final (inclusive, 'ANO-MES-DIA') e retorna os preços de fechamento (datas x tickers).
     """
-    if proxy: yf.set_config(proxy=proxy)
-    df1 = pd.DataFrame()
-    if isinstance(acoes, list):
-        for st in acoes:
-            if not st.endswith(".SA"): st = st+".SA"
-            if proxy:
-                df = yf.download(st, start=data_inicio, end=data_fim, auto_adjust=True)['Close']
-            else:
-                df = yf.download(st, start=data_inicio, end=data_fim)['Close']
-            df1 = pd.concat([df, df1], axis=1)
+    fonte_precos = fonte_precos or (lambda tickers, inicio, fim: _precos_yahoo(tickers, inicio, fim, proxy))
+    tickers = [acoes] if isinstance(acoes, str) else list(acoes)
+    tickers = [st if st.endswith(".SA") else st+".SA" for st in tickers]
+    #data_fim não é incluída, como no yf.download
+    inicio = pd.Timestamp(data_inicio).normalize()
+    fim = pd.Timestamp(data_fim).normalize() - pd.Timedelta(days=1)
+    if _CONFIG_CACHE["ativo"]:
+        cache = {st: _ler_serie_benchmark(st) for st in tickers}
+        inicios = {st: inicio for st in tickers}
+        #tickers com o mesmo trecho faltante são baixados juntos
+        pendentes: Dict[Tuple[pd.Timestamp, pd.Timestamp], List[str]] = {}
+        for st, (serie, cobertura) in cache.items():
+            for trecho in _trechos_ajustados(serie, cobertura, inicio, fim):
+                pendentes.setdefault(trecho, []).append(st)
+        novos = _baixar_por_trecho(fonte_precos, pendentes)
+        #os preços são ajustados por proventos: se a origem reajustou os preços do cache, a série é baixada de novo
+        refazer: Dict[Tuple[pd.Timestamp, pd.Timestamp], List[str]] = {}
+        for st, (serie, cobertura) in cache.items():
+            if st in novos and serie is not None and cobertura is not None and not _mesma_base(serie, novos[st]):
+                intervalo = (min(inicio, cobertura[0]), max(fim, cobertura[1]))
+                refazer.setdefault(intervalo, []).append(st)
+                cache[st], inicios[st] = (None, None), intervalo[0]
+        novos.update(_baixar_por_trecho(fonte_precos, refazer))
+        colunas = []
+        for st, (serie, cobertura) in cache.items():
+            if st in novos:
+                serie = _atualizar_serie_benchmark(st, serie, cobertura, novos[st], inicios[st])
+            if serie is not None:
+                colunas.append(serie[(serie.index >= inicio) & (serie.index <= fim)])
+        df1 = pd.concat(colunas, axis=1) if colunas else pd.DataFrame()
     else:
-        if not acoes.endswith(".SA"): acoes = acoes+".SA"
-        if proxy:
-            df1 = yf.download(acoes, start=data_inicio, end=data_fim, auto_adjust=True)['Close']
-        else:
-            df1 = yf.download(acoes, start=data_inicio, end=data_fim)['Close']
+        df1 = fonte_precos(tickers, inicio.strftime("%Y-%m-%d"), fim.strftime("%Y-%m-%d"))
     df1.index = pd.to_datetime(df1.index)
-    for cols in df1.columns:
-        df1[f'Retorno {cols}'] = df1[cols].pct_change()
-        df1[f'Retorno Acumulado {cols}'] = (1+df1[f'Retorno {cols}']).cumprod()-1
-    return df1
\ No newline at end of file
+    df1 = df1.sort_index()
+    #pct_change com preenchimento das lacunas pelo último preço, para todas as colunas de uma vez
+    precos_preenchidos = df1.ffill()
+    retornos = precos_preenchidos / precos_preenchidos.shift(1) - 1
+    retornos_acumulados = (1 + retornos).cumprod() - 1
+    colunas = df1.columns.tolist()
+    retornos.columns = [f'Retorno {cols}' for cols in colunas]
+    retornos_acumulados.columns = [f'Retorno Acumulado {cols}' for cols in colunas]
+    ordem = colunas + [x for cols in colunas for x in (f'Retorno {cols}', f'Retorno Acumulado {cols}')]
+    return pd.concat([df1, retornos, retornos_acumulados], axis=1)[ordem]
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Rafael
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Tuple, Union
+import requests
+from comparar_fundos_br.transporte import _get
+
+_CONFIG_CACHE: Dict[str, Union[str, int, bool]] = {
+    "diretorio": os.environ.get("COMPARAR_FUNDOS_BR_CACHE",
+                                os.path.join(os.path.expanduser("~"), ".cache", "comparar_fundos_br")),
+    "tamanho_maximo": 5 * 1024**3,
+    "ativo": True,
+}
+
+_TAMANHO_BLOCO_DOWNLOAD = 1024**2
+
+#entradas do cache sendo lidas neste processo (caminho -> número de leitores), que _remover_excedente não remove
+_entradas_em_uso: Dict[str, int] = {}
+_trava_entradas = threading.Lock()
+
+#subpastas do cache com dados já processados (snapshots), removidas junto em limpar_cache
+_SUBPASTAS_CACHE = ["cadastro", "benchmarks"]
+
+def configurar_cache(diretorio: Optional[str] = None,
+                     tamanho_maximo: Optional[int] = None,
+                     ativo: Optional[bool] = None) -> Dict[str, Union[str, int, bool]]:
+    '''Configura o cache local dos arquivos baixados (informes da CVM, cadastro, etc).
+    Parâmetros:
+    -diretorio (str): pasta onde os arquivos serão armazenados. Por padrão ~/.cache/comparar_fundos_br
+    ou o valor da variável de ambiente COMPARAR_FUNDOS_BR_CACHE;
+    -tamanho_maximo (int): tamanho máximo do cache em bytes. Ao ultrapassar, os arquivos menos usados são removidos;
+    -ativo (bool): liga ou desliga o cache.
+    Retorna a configuração vigente.'''
+    if diretorio is not None:
+        _CONFIG_CACHE["diretorio"] = diretorio
+    if tamanho_maximo is not None:
+        _CONFIG_CACHE["tamanho_maximo"] = int(tamanho_maximo)
+    if ativo is not None:
+        _CONFIG_CACHE["ativo"] = bool(ativo)
+    return dict(_CONFIG_CACHE)
+
+def limpar_cache() -> None:
+    '''Remove todos os arquivos armazenados no cache local.'''
+    diretorio = str(_CONFIG_CACHE["diretorio"])
+    if not os.path.isdir(diretorio):
+        return
+    for arquivo in os.listdir(diretorio):
+        if arquivo.endswith(".bin") or arquivo.endswith(".json"):
+            os.remove(os.path.join(diretorio, arquivo))
+        elif arquivo in _SUBPASTAS_CACHE:
+            shutil.rmtree(os.path.join(diretorio, arquivo))
+
+def _caminhos_cache(url: str) -> Tuple[str, str]:
+    chave = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    diretorio = str(_CONFIG_CACHE["diretorio"])
+    return os.path.join(diretorio, f"{chave}.bin"), os.path.join(diretorio, f"{chave}.json")
+
+def _escrita_atomica(caminho: str, conteudo: bytes) -> None:
+    fd, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(conteudo)
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+def _ler_cache(url: str) -> Optional[Dict[str, str]]:
+    caminho_dados, caminho_metadados = _caminhos_cache(url)
+    if not (os.path.exists(caminho_dados) and os.path.exists(caminho_metadados)):
+        return None
+    try:
+        with open(caminho_metadados, "r", encoding="utf-8") as f:
+            metadados = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return metadados
+
+def _salvar_metadados(url: str, resposta: requests.Response) -> None:
+    _, caminho_metadados = _caminhos_cache(url)
+    metadados = {"url": url,
+                 "ETag": resposta.headers.get("ETag"),
+                 "Last-Modified": resposta.headers.get("Last-Modified"),
+                 "baixado_em": time.time()}
+    _escrita_atomica(caminho_metadados, json.dumps(metadados).encode("utf-8"))
+
+def _gravar_resposta(resposta: requests.Response, caminho: str) -> None:
+    '''Grava o corpo da resposta em disco aos poucos, sem mantê-lo inteiro em memória.'''
+    fd, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho) or None, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if resposta.raw is None:
+                #respostas montadas em memória (ex.: backend de testes em configurar_transporte)
+                f.write(resposta.content)
+            else:
+                for bloco in resposta.iter_content(chunk_size=_TAMANHO_BLOCO_DOWNLOAD):
+                    f.write(bloco)
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+    finally:
+        _fechar(resposta)
+
+def _fechar(resposta: requests.Response) -> None:
+    #respostas montadas em memória (backend de configurar_transporte) não têm conexão para fechar
+    if resposta.raw is not None:
+        resposta.close()
+
+def _reservar(caminho: str) -> None:
+    with _trava_entradas:
+        _entradas_em_uso[caminho] = _entradas_em_uso.get(caminho, 0) + 1
+
+def _liberar(caminho: str) -> None:
+    with _trava_entradas:
+        leitores = _entradas_em_uso.get(caminho, 0) - 1
+        if leitores > 0:
+            _entradas_em_uso[caminho] = leitores
+        else:
+            _entradas_em_uso.pop(caminho, None)
+
+def _descartar_arquivo(caminho: Optional[str], temporario: bool) -> None:
+    '''Encerra o uso do arquivo retornado por _baixar_arquivo: remove o temporário ou libera a entrada do cache.'''
+    if caminho is None:
+        return
+    if temporario:
+        if os.path.exists(caminho):
+            os.remove(caminho)
+    else:
+        _liberar(caminho)
+
+def _remover_excedente() -> None:
+    '''Remove os arquivos menos usados recentemente até o cache caber em tamanho_maximo.
+    As entradas em uso por outra leitura deste processo (ver _baixar_arquivo) nunca são removidas.'''
+    diretorio = str(_CONFIG_CACHE["diretorio"])
+    with _trava_entradas:
+        arquivos = []
+        for nome in os.listdir(diretorio):
+            if nome.endswith(".bin"):
+                caminho = os.path.join(diretorio, nome)
+                try:
+                    estado = os.stat(caminho)
+                except FileNotFoundError:
+                    continue
+                arquivos.append((estado.st_mtime, estado.st_size, caminho))
+        total = sum(tamanho for _, tamanho, _ in arquivos)
+        for _, tamanho, caminho in sorted(arquivos):
+            if total <= int(_CONFIG_CACHE["tamanho_maximo"]):
+                break
+            if caminho in _entradas_em_uso:
+                continue
+            for arquivo in (caminho, caminho[:-4] + ".json"):
+                try:
+                    os.remove(arquivo)
+                except FileNotFoundError:
+                    pass
+            total -= tamanho
+
+def _cabecalhos_condicionais(metadados: Optional[Dict[str, str]]) -> Dict[str, str]:
+    cabecalhos = {}
+    if metadados is not None:
+        if metadados.get("ETag"):
+            cabecalhos["If-None-Match"] = metadados["ETag"]
+        if metadados.get("Last-Modified"):
+            cabecalhos["If-Modified-Since"] = metadados["Last-Modified"]
+    return cabecalhos
+
+def _versao(origem: Union[requests.Response, Dict[str, str], None]) -> Dict[str, Optional[str]]:
+    cabecalhos = origem.headers if isinstance(origem, requests.Response) else (origem or {})
+    return {"ETag": cabecalhos.get("ETag"), "Last-Modified": cabecalhos.get("Last-Modified")}
+
+def _baixar_arquivo(url: str, proxy: Optional[Dict[str, str]] = None,
+                    revalidar: bool = True) -> Tuple[int, Optional[str], bool, Dict[str, Optional[str]]]:
+    '''Busca a url usando o cache local. Se houver cópia local, a requisição é condicional (ETag/Last-Modified)
+    e o conteúdo só é baixado novamente se tiver sido alterado na origem; com revalidar=False, a cópia local é usada
+    sem consultar a origem. O corpo da resposta é gravado em disco aos poucos (stream), sem ficar em memória.
+    Retorna (status, caminho, temporario, versao): caminho é None quando o status não é 200. Com o cache ativo,
+    o arquivo é a própria cópia do cache, reservada para que outras threads não a removam ao liberar espaço;
+    com o cache desligado, é um arquivo temporário (temporario=True). Em ambos os casos, quem chamou deve
+    encerrar o uso com _descartar_arquivo. versao traz o ETag e o Last-Modified do arquivo.'''
+    if not _CONFIG_CACHE["ativo"]:
+        resposta = _get(url, proxy, stream=True)
+        if resposta.status_code != 200:
+            _fechar(resposta)
+            return resposta.status_code, None, False, _versao(None)
+        fd, caminho = tempfile.mkstemp(suffix=".bin")
+        os.close(fd)
+        try:
+            _gravar_resposta(resposta, caminho)
+        except BaseException:
+            os.remove(caminho)
+            raise
+        return 200, caminho, True, _versao(resposta)
+    caminho_dados, _ = _caminhos_cache(url)
+    _reservar(caminho_dados)
+    try:
+        status, versao = _atualizar_entrada(url, caminho_dados, proxy, revalidar)
+    except BaseException:
+        _liberar(caminho_dados)
+        raise
+    if status != 200:
+        _liberar(caminho_dados)
+        return status, None, False, versao
+    return status, caminho_dados, False, versao
+
+def _atualizar_entrada(url: str, caminho_dados: str, proxy: Optional[Dict[str, str]] = None,
+                       revalidar: bool = True) -> Tuple[int, Dict[str, Optional[str]]]:
+    '''Garante a entrada do cache da url em caminho_dados (já reservada), baixando-a se necessário.'''
+    metadados = _ler_cache(url)
+    if metadados is not None and not revalidar:
+        os.utime(caminho_dados)
+        return 200, _versao(metadados)
+    try:
+        resposta = _get(url, proxy, _cabecalhos_condicionais(metadados), stream=True)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        if metadados is None:
+            raise
+        return 200, _versao(metadados)
+    if resposta.status_code == 304 and metadados is not None:
+        _fechar(resposta)
+        os.utime(caminho_dados)
+        return 200, _versao(metadados)
+    if resposta.status_code != 200:
+        _fechar(resposta)
+        return resposta.status_code, _versao(None)
+    os.makedirs(os.path.dirname(caminho_dados), exist_ok=True)
+    _gravar_resposta(resposta, caminho_dados)
+    _salvar_metadados(url, resposta)
+    _remover_excedente()
+    return 200, _versao(resposta)
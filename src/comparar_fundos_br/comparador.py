@@ -3,11 +3,13 @@
 @author: Rafael
 """
 from comparar_fundos_br.benchmarks import *
+from comparar_fundos_br.fundosbr import _linhas_da_classe
+from comparar_fundos_br.metricas import _TAMANHO_BLOCO_FUNDOS
 import warnings
-from typing import Any, List, Tuple, Union, Optional
-from tqdm import tqdm
+from typing import Any, Dict, List, Tuple, Union, Optional
 import numpy as np
 import pandas as pd
+import polars as pl
 
 warnings.filterwarnings("ignore")
 
@@ -16,20 +18,34 @@ pd.set_option("display.max_rows", 100)
 pd.set_option("display.max_columns", 10)
 pd.set_option("display.width", 1000)
 
-import matplotlib.pyplot as plt
-from matplotlib.colors import LinearSegmentedColormap, rgb_to_hsv
-
-def _get_valores_iniciais(df: pd.DataFrame) -> List[float]:
-    if isinstance(df, pd.DataFrame):
-        return [df[df[col].notnull()][col].iloc[0] for col in df.columns]
-    else:
-        return [value for value in df.values if np.isnan(value)==False][0]
+_TEMA_GRAFICOS = {"aplicado": False}
+
+def _graficos() -> Tuple[Any, Any]:
+    '''Importa matplotlib e seaborn apenas no primeiro gráfico, para que importar a biblioteca não carregue
+    a pilha de gráficos. O tema do seaborn é aplicado nesse momento.'''
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    if not _TEMA_GRAFICOS["aplicado"]:
+        sns.set()
+        _TEMA_GRAFICOS["aplicado"] = True
+    return plt, sns
+
+def _valores_validos(df: Union[pd.DataFrame, pd.Series], ultimo: bool = False) -> Union[np.ndarray, float]:
+    '''Primeiro (ou último) valor não nulo de cada coluna; nulo se a coluna não tiver valores.'''
+    valores = df.to_numpy(dtype=np.float64)
+    matriz = valores.reshape(len(valores), -1)
+    validos = ~np.isnan(matriz)
+    if ultimo:
+        matriz, validos = matriz[::-1], validos[::-1]
+    posicao = validos.argmax(axis=0)
+    resultado = np.where(validos.any(axis=0), matriz[posicao, np.arange(matriz.shape[1])], np.nan)
+    return resultado if valores.ndim == 2 else resultado[0]
+
+def _get_valores_iniciais(df: Union[pd.DataFrame, pd.Series]) -> Union[np.ndarray, float]:
+    return _valores_validos(df)
     
-def _get_valores_finais(df: pd.DataFrame) -> List[float]:
-    if isinstance(df, pd.DataFrame):
-        return [df[df[col].notnull()][col].iloc[-1] for col in df.columns]
-    else:
-        return [value for value in df.values if np.isnan(value)==False][-1]
+def _get_valores_finais(df: Union[pd.DataFrame, pd.Series]) -> Union[np.ndarray, float]:
+    return _valores_validos(df, ultimo=True)
 
 def _get_cotas_normalizadas(df: pd.DataFrame) -> pd.DataFrame:
     valor_inicial = _get_valores_iniciais(df)
@@ -49,43 +65,108 @@ def calcula_retorno_janelas_moveis(cotas_diarias: pd.DataFrame, HP: int, dados_d
     retorno_janelas_moveis = cotas_normalizadas.dropna().pct_change(HP)
     return retorno_janelas_moveis.sort_index().dropna()
    
+_SAIDAS_RISCO_RETORNO = ["risco_retorno", "rentabilidade_fundos_diaria", "cotas_normalizadas",
+                         "rentabilidade_fundos_acumulada", "rentabilidade_acumulada_por_ano"]
+
+def _risco_retorno_formato_longo(dados: Union[pl.DataFrame, pl.LazyFrame], saidas: List[str],
+                                 coluna_fundo: str) -> Dict[str, Union[pd.DataFrame, pl.DataFrame]]:
+    '''Versão de calcula_risco_retorno_fundos para o formato longo (DT_COMPTC, fundo, VL_QUOTA) de fundosbr,
+    calculada por fundo no polars, sem pivotar. Os retornos diários são calculados entre observações consecutivas de cada fundo,
+    o que equivale ao formato largo com as lacunas preenchidas pelo último valor: as datas do calendário (todas as datas
+    dos dados) sem cota do fundo contam como retorno zero na volatilidade.'''
+    fundos = (_linhas_da_classe(dados.lazy())
+                   .select(["DT_COMPTC", coluna_fundo, pl.col("VL_QUOTA").cast(pl.Float64)])
+                   .with_columns(pl.col("DT_COMPTC").rank("dense").alias("posicao"))
+                   .filter(pl.col("VL_QUOTA").is_not_null() & pl.col("VL_QUOTA").is_not_nan())
+                   .sort([coluna_fundo, "DT_COMPTC"])
+                   .with_columns((pl.col("VL_QUOTA")/pl.col("VL_QUOTA").first().over(coluna_fundo)).alias("cotas_normalizadas"))
+                   .with_columns(pl.col("cotas_normalizadas").pct_change().over(coluna_fundo).alias("rentabilidade_fundos_diaria"))
+                   .with_columns(((1 + pl.col("rentabilidade_fundos_diaria")).cum_prod().over(coluna_fundo) - 1)
+                                 .alias("rentabilidade_fundos_acumulada"))
+                   .collect())
+    T = _linhas_da_classe(dados.lazy()).select(pl.col("DT_COMPTC").n_unique()).collect().item()
+    resultado = {}
+    for saida in ["cotas_normalizadas", "rentabilidade_fundos_diaria", "rentabilidade_fundos_acumulada"]:
+        if saida in saidas:
+            resultado[saida] = fundos.select(["DT_COMPTC", coluna_fundo, saida])
+    if "risco_retorno" in saidas:
+        #retornos do primeiro dia seguinte à primeira cota até o fim do calendário, incluindo os zeros das lacunas
+        retornos = pl.col("rentabilidade_fundos_diaria").drop_nulls()
+        n = T - pl.col("posicao").first()
+        media = retornos.sum() / n
+        desvio = ((((retornos - media)**2).sum() + (n - retornos.len()) * media**2) / (n - 1)).sqrt()
+        risco_retorno = (fundos.group_by(coluna_fundo, maintain_order=True)
+                               .agg(pl.when(n > 1).then(desvio * np.sqrt(252)).alias("volatilidade"),
+                                    ((pl.col("VL_QUOTA").last()/pl.col("VL_QUOTA").first())**(252/T) - 1).alias("rentabilidade"))
+                               .to_pandas().set_index(coluna_fundo))
+        risco_retorno.index.name = None
+        resultado["risco_retorno"] = risco_retorno.dropna().sort_values("rentabilidade", ascending=False)
+    if "rentabilidade_acumulada_por_ano" in saidas:
+        anos = (_linhas_da_classe(dados.lazy()).select(pl.col("DT_COMPTC").dt.year().unique().sort().cast(pl.String))
+                                               .collect().to_series().to_list())
+        por_ano = (fundos.drop_nulls("rentabilidade_fundos_acumulada")
+                         .group_by([coluna_fundo, pl.col("DT_COMPTC").dt.year().cast(pl.String).alias("ano")], maintain_order=True)
+                         .agg(pl.col("rentabilidade_fundos_acumulada").last())
+                         .sort("ano")
+                         .pivot(on="ano", index=coluna_fundo, values="rentabilidade_fundos_acumulada")
+                         .to_pandas().set_index(coluna_fundo))
+        #como no formato largo, o ano sem cota do fundo (encerrado ou com lacuna) repete a rentabilidade acumulada anterior
+        por_ano = por_ano.reindex(columns=anos).ffill(axis=1)
+        por_ano.index.name = None
+        resultado["rentabilidade_acumulada_por_ano"] = por_ano
+    return resultado
+
 def calcula_risco_retorno_fundos(
-                                dados_fundos_cvm: pd.DataFrame,
-                                ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+                                dados_fundos_cvm: Union[pd.DataFrame, pl.DataFrame, pl.LazyFrame],
+                                saidas: Optional[List[str]] = None,
+                                coluna_fundo: str = "CNPJ_FUNDO",
+                                ) -> Tuple[Union[pd.DataFrame, pl.DataFrame], ...]:
     '''Função que extrai diversas informações de retorno e risco para uma primeira análise dos fundos.
     Parâmetros:
     -dados_fundos_cvm (dataframe): série temporal contendo as cotas diarias dos fundos. Cada coluna deve ser a cota de um fundo e índice as datas.
+    Também aceita o dataframe polars em formato longo de fundosbr(output_format='polars'), com as colunas DT_COMPTC, VL_QUOTA e coluna_fundo;
+    nesse caso as saídas diárias também são retornadas em formato longo (polars);
+    -saidas (list): nomes das saídas desejadas, na ordem em que serão retornadas. Por padrão, todas. Apenas as solicitadas são calculadas;
+    -coluna_fundo (str): coluna que identifica o fundo no formato longo.
     Retorno:
     -risco_retorno (dataframe): contém volatilidade anualizada e retorno de todo o periodo também anualizado;
     -rentabilidade_fundos_diaria (dataframe): retorno diário dos fundos;
     -cotas_normalizadas (dataframe): valor das cotas diárias normalizada começando com valor unitário;
     -rentabilidade_fundos_acumulada (dataframe): rentabilidade acumulada de todo o período;
-    -rentabilidade_acumulada_por_ano (dataframe): rentabilidade acumulada por cada ano;
-    -rentabilidade_fundos_total (dataframe): rentabilidade total de todo o periodo'''
-    serie_fundos = dados_fundos_cvm.copy()
-    cotas_normalizadas = _get_cotas_normalizadas(serie_fundos)
-    rentabilidade_fundos_diaria = cotas_normalizadas.pct_change()
-    rentabilidade_fundos_acumulada = (1 + rentabilidade_fundos_diaria).cumprod() - 1
-
-    T = serie_fundos.shape[0]
-    valores_finais_nao_nulos = pd.DataFrame(_get_valores_finais(cotas_normalizadas), index=cotas_normalizadas.columns).T
-    retorno_periodo_anualizado = (((valores_finais_nao_nulos/ _get_valores_iniciais(cotas_normalizadas))** (252 / T)- 1)).T
-    retorno_periodo_anualizado.columns = ["rentabilidade"]
-
-    rentabilidade_acumulada_por_ano = rentabilidade_fundos_acumulada.groupby(pd.Grouper(freq="Y")).last(1).T
-    rentabilidade_acumulada_por_ano.columns = [str(x)[:4] for x in rentabilidade_acumulada_por_ano.columns]
-
-    volatilidade_fundos = rentabilidade_fundos_diaria.std().to_frame() * np.sqrt(252)
-    volatilidade_fundos.columns = ["volatilidade"]
-
-    risco_retorno = pd.concat([volatilidade_fundos, retorno_periodo_anualizado], axis=1)
-    return (
-            risco_retorno.dropna().sort_values("rentabilidade", ascending=False),
-            rentabilidade_fundos_diaria,
-            cotas_normalizadas,
-            rentabilidade_fundos_acumulada,
-            rentabilidade_acumulada_por_ano
-            )
+    -rentabilidade_acumulada_por_ano (dataframe): rentabilidade acumulada por cada ano'''
+    saidas = _SAIDAS_RISCO_RETORNO if saidas is None else saidas
+    invalidas = [x for x in saidas if x not in _SAIDAS_RISCO_RETORNO]
+    if invalidas:
+        raise ValueError(f"Saídas não encontradas {invalidas}. Opções: {_SAIDAS_RISCO_RETORNO}")
+    if isinstance(dados_fundos_cvm, (pl.DataFrame, pl.LazyFrame)):
+        resultado = _risco_retorno_formato_longo(dados_fundos_cvm, saidas, coluna_fundo)
+        return tuple(resultado[saida] for saida in saidas)
+
+    resultado = {}
+    cotas_normalizadas = _get_cotas_normalizadas(dados_fundos_cvm)
+    #equivalente a pct_change() com preenchimento das lacunas pelo último valor
+    cotas_preenchidas = cotas_normalizadas.ffill()
+    rentabilidade_fundos_diaria = cotas_preenchidas / cotas_preenchidas.shift(1) - 1
+    resultado["cotas_normalizadas"] = cotas_normalizadas
+    resultado["rentabilidade_fundos_diaria"] = rentabilidade_fundos_diaria
+
+    if "risco_retorno" in saidas:
+        T = dados_fundos_cvm.shape[0]
+        retorno_periodo_anualizado = ((_get_valores_finais(cotas_normalizadas) / _get_valores_iniciais(cotas_normalizadas))**(252 / T) - 1)
+        volatilidade_fundos = rentabilidade_fundos_diaria.std() * np.sqrt(252)
+        risco_retorno = pd.DataFrame({"volatilidade": volatilidade_fundos.to_numpy(),
+                                      "rentabilidade": retorno_periodo_anualizado},
+                                     index=cotas_normalizadas.columns)
+        resultado["risco_retorno"] = risco_retorno.dropna().sort_values("rentabilidade", ascending=False)
+
+    if "rentabilidade_fundos_acumulada" in saidas or "rentabilidade_acumulada_por_ano" in saidas:
+        rentabilidade_fundos_acumulada = (1 + rentabilidade_fundos_diaria).cumprod() - 1
+        resultado["rentabilidade_fundos_acumulada"] = rentabilidade_fundos_acumulada
+        if "rentabilidade_acumulada_por_ano" in saidas:
+            rentabilidade_acumulada_por_ano = rentabilidade_fundos_acumulada.groupby(pd.Grouper(freq="Y")).last(1).T
+            rentabilidade_acumulada_por_ano.columns = [str(x)[:4] for x in rentabilidade_acumulada_por_ano.columns]
+            resultado["rentabilidade_acumulada_por_ano"] = rentabilidade_acumulada_por_ano
+    return tuple(resultado[saida] for saida in saidas)
 
 def remove_outliers(df: pd.DataFrame, q: float = 0.05) -> pd.DataFrame:
     '''Remove outliers ao informar usando método do range interquartil, ou seja, retira os dados 
@@ -106,6 +187,7 @@ def plotar_comparacao_risco_retorno(
                                     nome_benchmark: Union[str, None] = None,
                                     **opcionais: Any
                                     ) -> None:
+    plt, sns = _graficos()
     if risco_retorno_carteira:
         risco_carteira, retorno_carteira = risco_retorno_carteira
     if risco_retorno_benchmark:
@@ -153,6 +235,7 @@ def plotar_comparacao_risco_retorno(
 def plotar_evolucao(
                     df: pd.DataFrame, lista_fundos: List[str], **opcionais: Any
                     ) -> Union[pd.DataFrame, None]:
+    plt, _ = _graficos()
 
     lista_fundos = [x.upper() for x in lista_fundos]
     cnpj = [x for x in df.columns.tolist() if x.split(" // ")[0] in lista_fundos]
@@ -239,6 +322,7 @@ def plotar_evolucao(
         return None
 
 def plotar_rentabilidade_janela_movel(df: pd.DataFrame, HP: int, benchmarks: pd.DataFrame) -> None:
+    plt, _ = _graficos()
     for fundo in df.columns:
         retorno = calcula_retorno_janelas_moveis(df[[fundo]], HP, benchmarks)
 
@@ -264,6 +348,7 @@ def plotar_comparacao_risco_retorno(
                                     nome_benchmark: Union[str, None] = None,
                                     **opcionais: Any
                                     ) -> None:
+    plt, sns = _graficos()
     if risco_retorno_carteira:
         risco_carteira, retorno_carteira = risco_retorno_carteira
     if risco_retorno_benchmark:
@@ -306,25 +391,110 @@ def plotar_comparacao_risco_retorno(
             arrowprops=dict(arrowstyle="->", color="r", connectionstyle="arc3,rad=-0.1"),
         )
 
+def _ordem_validos(validos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''Ordem que leva, em cada coluna, as linhas válidas para o topo preservando a ordem das datas,
+    e o número de linhas válidas por coluna.'''
+    return np.argsort(~validos, axis=0, kind="stable"), validos.sum(axis=0)
+
+def calcula_retorno_multiplas_janelas(cotas_diarias: pd.DataFrame, HPs: List[int],
+                                      dados_diarios_benchmark: Optional[pd.DataFrame] = None) -> Dict[int, pd.DataFrame]:
+    '''Função que calcula o retorno em janelas móveis de vários periodos HP (holding period) de uma só vez.
+    Diferente de calcula_retorno_janelas_moveis, cada coluna usa o seu próprio histórico: as datas sem valor
+    de um fundo ou benchmark são ignoradas apenas para ele, sem truncar os demais ao histórico comum.
+    Parâmetros:
+    -cotas_diarias (dataframe): com valor das cotas;
+    -HPs (list): periodos das janelas móveis, em dias com valor de cada série;
+    -dados_diarios_benchmark (dataframe): índice diário dos benchmarks (opcional)
+    Retorno:
+    -retornos (dict): para cada HP, dataframe com o retorno na janela móvel HP'''
+    if dados_diarios_benchmark is not None:
+        dados = pd.concat([cotas_diarias, dados_diarios_benchmark], axis=1).sort_index()
+    else:
+        dados = cotas_diarias.sort_index()
+    valores = dados.to_numpy(dtype=np.float64)
+    ordem, num_validos = _ordem_validos(~np.isnan(valores))
+    cotas = np.take_along_axis(valores, ordem, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cotas = cotas / cotas[:1]
+    T = cotas.shape[0]
+    fora_do_historico = np.arange(T)[:, None] >= num_validos
+    retornos = {}
+    for HP in HPs:
+        retorno = np.full(cotas.shape, np.nan)
+        if HP < T:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                retorno[HP:] = cotas[HP:] / cotas[:T - HP] - 1
+        retorno[fora_do_historico] = np.nan
+        retorno_por_data = np.empty_like(retorno)
+        np.put_along_axis(retorno_por_data, ordem, retorno, axis=0)
+        retornos[HP] = pd.DataFrame(retorno_por_data, index=dados.index, columns=dados.columns).dropna(how="all")
+    return retornos
+
+def _estatisticas_janela_movel(cotas: np.ndarray, bench: np.ndarray, HP: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    '''Calcula, para cada coluna de cotas, as mesmas estatísticas de calcula_retorno_janelas_moveis contra um benchmark.
+    As datas em que fundo ou benchmark não têm valor são descartadas por coluna: os valores válidos são compactados
+    para o topo da matriz (ordenação estável da máscara), o que equivale ao dropna do par fundo x benchmark.
+    Retorna número de janelas, janelas acima do benchmark, janelas abaixo (ou iguais) e retornos médios de fundo e benchmark.'''
+    validos = ~np.isnan(cotas) & ~np.isnan(bench)[:, None]
+    ordem, num_validos = _ordem_validos(validos)
+    cotas = np.take_along_axis(cotas, ordem, axis=0)
+    bench = bench[ordem]
+    T = cotas.shape[0]
+    L = max(T - HP, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cotas = cotas / cotas[:1]
+        bench = bench / bench[:1]
+        retorno_fundos = cotas[HP:HP + L] / cotas[:L] - 1
+        retorno_bench = bench[HP:HP + L] / bench[:L] - 1
+        janelas = ((np.arange(HP, HP + L)[:, None] < num_validos)
+                   & ~np.isnan(retorno_fundos) & ~np.isnan(retorno_bench))
+        eventos = retorno_fundos - retorno_bench
+        num_janelas = janelas.sum(axis=0)
+        acima = (janelas & (eventos > 0)).sum(axis=0)
+        abaixo = (janelas & (eventos <= 0)).sum(axis=0)
+        media_fundos = np.where(janelas, retorno_fundos, 0).sum(axis=0) / num_janelas
+        media_bench = np.where(janelas, retorno_bench, 0).sum(axis=0) / num_janelas
+    return num_janelas, acima, abaixo, media_fundos, media_bench
+
+def _matriz_janelas_moveis(dados: pd.DataFrame, benchmarks: pd.DataFrame, HP: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    '''Alinha fundos e benchmarks uma única vez e devolve as estatísticas das janelas móveis de HP dias
+    como matrizes fundos x benchmarks. Os fundos são processados em blocos para limitar o uso de memória.'''
+    alinhados = pd.concat([dados, benchmarks], axis=1)
+    num_fundos = dados.shape[1]
+    cotas = alinhados.iloc[:, :num_fundos].to_numpy(dtype=np.float64)
+    benchs = alinhados.iloc[:, num_fundos:].to_numpy(dtype=np.float64)
+    resultado = [np.empty((num_fundos, benchs.shape[1])) for _ in range(5)]
+    for inicio in range(0, num_fundos, _TAMANHO_BLOCO_FUNDOS):
+        bloco = slice(inicio, inicio + _TAMANHO_BLOCO_FUNDOS)
+        for j in range(benchs.shape[1]):
+            for matriz, valores in zip(resultado, _estatisticas_janela_movel(cotas[:, bloco], benchs[:, j], HP)):
+                matriz[bloco, j] = valores
+    num_janelas, acima, abaixo, media_fundos, media_bench = resultado
+    return num_janelas, acima, abaixo, media_fundos, media_bench
+
+def _benchmarks_avaliados(num_janelas: np.ndarray) -> np.ndarray:
+    '''Um fundo sem nenhuma janela contra um benchmark não é avaliado contra ele nem contra os benchmarks seguintes.'''
+    return np.logical_and.accumulate(num_janelas > 0, axis=1)
+
 def supera_benchmark(dados: pd.DataFrame, benchmarks: pd.DataFrame, HP: int,
                      limit: float = 0.6, janela_analise: int = 252) -> pd.DataFrame:
     '''Função que indica a porcentagem de vezes em que o fundo supera o benchmark no periodo selecionado.
     O corte é dado pelo parâmetro limit.'''
-    percentuais = pd.DataFrame()
     lista_benchmarks = [x for x in benchmarks.columns if 'Retorno' not in x]
-    for i, fundo in enumerate(tqdm(dados.columns.tolist())):
-        df1 = pd.DataFrame()
-        for bench in lista_benchmarks:
-            retorno = calcula_retorno_janelas_moveis(dados[[fundo]], HP, benchmarks[[bench]])
-            retorno = retorno.sort_index().dropna()
-            if retorno.empty: break
-            elif retorno.shape[0] < janela_analise: continue
-            eventos = (retorno[fundo] - retorno[bench])
-            percentual_sobre_bench = len(eventos[eventos>0])/len(eventos)
-            if percentual_sobre_bench >= limit:
-                df = pd.DataFrame([fundo, percentual_sobre_bench*100], index=["Fundo", f"Supera {bench} (%)"]).T.set_index("Fundo")
-                df1 = pd.concat([df1, df], axis=1)
-        percentuais = pd.concat([percentuais, df1], axis=0)
+    num_janelas, acima, _, _, _ = _matriz_janelas_moveis(dados, benchmarks[lista_benchmarks], HP)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percentual_sobre_bench = acima / num_janelas
+    supera = (_benchmarks_avaliados(num_janelas) & (num_janelas >= janela_analise)
+              & (percentual_sobre_bench >= limit))
+    linhas = np.flatnonzero(supera.any(axis=1))
+    #colunas na ordem em que aparecem ao percorrer fundo a fundo
+    primeiro_fundo = supera.argmax(axis=0)
+    colunas = sorted(np.flatnonzero(supera.any(axis=0)), key=lambda j: (primeiro_fundo[j], j))
+    percentuais = pd.DataFrame(np.where(supera, percentual_sobre_bench*100, np.nan)[np.ix_(linhas, colunas)],
+                               index=pd.Index(dados.columns[linhas], name="Fundo"),
+                               columns=[f"Supera {lista_benchmarks[j]} (%)" for j in colunas])
+    if percentuais.empty:
+        return pd.DataFrame()
     return percentuais[(percentuais>=limit*100)].dropna().sort_values(percentuais.columns.tolist(), ascending=False)
 
 def qto_supera_benchmark(dados: pd.DataFrame, benchmarks: pd.DataFrame, HP: int, corte_bench: float=100, bench_corte='CDI') -> pd.DataFrame:
@@ -333,23 +503,19 @@ def qto_supera_benchmark(dados: pd.DataFrame, benchmarks: pd.DataFrame, HP: int,
     ficam abaixo do benchmark, em média.
     Os fundos são ranqueados por % do benchmark. O parâmetro corte_bench filtra os fundos que performam,
     pelo menos, o mesmo que o fundo.'''
-    percentuais = pd.DataFrame()
     lista_benchmarks = [x for x in benchmarks.columns if 'Retorno' not in x]
-    for i, fundo in enumerate(tqdm(dados.columns.tolist())):
-        df1 = pd.DataFrame()
-        for bench in lista_benchmarks:
-            retorno = calcula_retorno_janelas_moveis(dados[[fundo]], HP, benchmarks[[bench]])
-            retorno = retorno.sort_index().dropna()
-            if retorno.empty: break
-            eventos = (retorno[fundo] - retorno[bench])
-            eventos_sup = len(eventos[eventos>0])/len(eventos)
-            eventos_inf = len(eventos[eventos<=0])/len(eventos)
-            em_rel_cdi = retorno[fundo].mean()/retorno[bench].mean()
-            df = pd.DataFrame([fundo, eventos_sup, eventos_inf, em_rel_cdi], index=["Fundo", f"% de vezes acima {bench} (%)",
-                                                                        f"% de vezes abaixo {bench} (%)",
-                                                                        f'% do {bench}, em média']).T.set_index("Fundo")
-            df1 = pd.concat([df1, df], axis=1)
-        percentuais = pd.concat([percentuais, df1], axis=0)
+    num_janelas, acima, abaixo, media_fundos, media_bench = _matriz_janelas_moveis(dados, benchmarks[lista_benchmarks], HP)
+    avaliados = _benchmarks_avaliados(num_janelas)
+    linhas = np.flatnonzero(avaliados[:, 0]) if avaliados.size else np.array([], dtype=int)
+    colunas = np.flatnonzero(avaliados.any(axis=0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        estatisticas = [acima / num_janelas, abaixo / num_janelas, media_fundos / media_bench]
+    percentuais = pd.DataFrame(index=pd.Index(dados.columns[linhas], name="Fundo"))
+    for j in colunas:
+        bench = lista_benchmarks[j]
+        for nome, valores in zip([f"% de vezes acima {bench} (%)", f"% de vezes abaixo {bench} (%)", f'% do {bench}, em média'],
+                                 estatisticas):
+            percentuais[nome] = np.where(avaliados[:, j], valores[:, j], np.nan)[linhas]
     cols1 = [x for x in percentuais.columns if 'acima' not in x and 'abaixo' not in x]
     percentuais = (percentuais.sort_values(cols1, ascending=False)*100).fillna(0)
     if not bench_corte:
@@ -372,22 +538,24 @@ def _traduz_frequencia(frequencia: str) -> List[str]:
         freq = [frequencia]
     return freq
 
+def _fim_periodo(indice: pd.DatetimeIndex, freq: str) -> pd.DatetimeIndex:
+    '''Data de fim do período (mês, trimestre, semestre ou ano) a que pertence cada data do índice.'''
+    if freq.lower()=="sem":
+        meses = np.where(indice.month <= 6, 6, 12)
+        return pd.to_datetime({"year": indice.year, "month": meses, "day": 1}) + pd.offsets.MonthEnd(0)
+    return indice.to_period(freq).to_timestamp(how="end").normalize()
+
 def calcula_rentabilidade_periodo(dados_diarios: pd.DataFrame, freq: str = "M") -> pd.DataFrame:
+    '''Rentabilidade de cada coluna dentro de cada período (M, Q, sem ou Y): variação entre o primeiro
+    e o último valor válido do período. Se o único valor válido for o da última data do período, o resultado é nulo.'''
+    fim_periodo = pd.DatetimeIndex(_fim_periodo(dados_diarios.index, freq))
+    grupos = dados_diarios.groupby(fim_periodo)
+    validos = dados_diarios.notna().groupby(fim_periodo)
+    tem_retorno = (validos.sum() - validos.last()) > 0
+    rentabilidade_periodo_total = (grupos.last()/grupos.first() - 1).where(tem_retorno)
+    rentabilidade_periodo_total.index.name = None
     if freq.lower()=="sem":
         freq = "Q"
-        inicio = dados_diarios.resample(f"{freq}S").first()
-        fim = dados_diarios.resample(f"{freq}E").last()
-        inicio = inicio[inicio.index.month.isin([1,7])]
-        fim = fim[fim.index.month.isin([6,12])]
-    else:
-        inicio = dados_diarios.resample(f"{freq}S").first()
-        fim = dados_diarios.resample(f"{freq}E").last()
-    rentabilidade_periodo_total = pd.DataFrame()
-    for (init, end) in zip(inicio.index, fim.index):
-        df = dados_diarios[(dados_diarios.index>=init) & (dados_diarios.index<=end)].ffill().pct_change()
-        rentabilidade_periodo = ((1 + df).cumprod() - 1).tail(1)
-        rentabilidade_periodo.index = [end]
-        rentabilidade_periodo_total = pd.concat([rentabilidade_periodo_total, rentabilidade_periodo])
     return rentabilidade_periodo_total.asfreq(f"{freq}E")
 
 def _retorno_heatmap(dados_diarios: pd.DataFrame, period: str, nome: str) -> Union[pd.DataFrame, List[str]]:
@@ -408,6 +576,8 @@ def plotar_heatmap_rentabilidade(dados_diarios: pd.DataFrame, period: str = 'M')
     -anual (Y)
     Como entrada de dados, a função precisa do dataframe do retorno diário do fundo ou do benchmark.
     '''
+    plt, sns = _graficos()
+    from matplotlib.colors import LinearSegmentedColormap
     cmap = LinearSegmentedColormap.from_list(name='t',
         colors=["red", "white", 'green']
     )
@@ -484,6 +654,8 @@ def plotar_heatmap_comparar_benchmark(dados_diarios_fundos: pd.DataFrame,
     superou = 100 * num_vezes_que_superou_no_periodo/total_de_periodos
     As cores do gráfico auxiliam na indicação dos periodos em que houve superação.
     '''
+    plt, sns = _graficos()
+    from matplotlib.colors import LinearSegmentedColormap, rgb_to_hsv
     bench = dados_diarios_benchmarks.columns[0]
     nome = dados_diarios_fundos.columns[0]
     returns1, freq = _retorno_heatmap(dados_diarios_fundos, period, nome)
@@ -2,15 +2,21 @@
 """
 @author: Rafael
 """
-import io
+import codecs
+import json
+import os
+import tempfile
 import time
 import warnings
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Union, Dict, Optional
+from typing import Callable, Iterator, List, Union, Dict, Optional, Tuple, Type, TypeVar
 import polars as pl
 import pandas as pd
-import requests
+from polars.io.plugins import register_io_source
+from comparar_fundos_br.cache import _CONFIG_CACHE, _TAMANHO_BLOCO_DOWNLOAD, _baixar_arquivo, _descartar_arquivo
 
 warnings.filterwarnings("ignore")
 
@@ -19,6 +25,41 @@ pd.set_option("display.max_rows", 100)
 pd.set_option("display.max_columns", 10)
 pd.set_option("display.width", 1000)
 
+#tipos do polars podem ser informados pela classe (pl.Float32) ou pela instância (pl.Datetime("us"))
+_TipoPolars = Union[Type[pl.DataType], pl.DataType]
+
+_Quadro = TypeVar("_Quadro", pl.LazyFrame, pl.DataFrame)
+
+_TIPOS_INFORME_DIARIO: Dict[str, _TipoPolars] = {
+    "DT_COMPTC": pl.Datetime("us"),
+    "NR_COTST": pl.Int32,
+    "VL_PATRIM_LIQ": pl.Float64,
+    "VL_TOTAL": pl.Float64,
+    "CAPTC_DIA": pl.Float64,
+    "RESG_DIA": pl.Float64,
+    "VL_QUOTA": pl.Float32,
+}
+
+#esquema compacto (compactar=True): data sem hora, CNPJ categórico e valores em float32. Desde o polars 1.32 as
+#categorias são globais: os meses lidos separadamente e o cadastro de mesclar_bases são concatenados e cruzados
+#sem recodificação nem pl.StringCache
+_TIPOS_INFORME_COMPACTO: Dict[str, _TipoPolars] = {
+    "DT_COMPTC": pl.Date,
+    "CNPJ_FUNDO": pl.Categorical,
+    "VL_PATRIM_LIQ": pl.Float32,
+    "VL_TOTAL": pl.Float32,
+    "CAPTC_DIA": pl.Float32,
+    "RESG_DIA": pl.Float32,
+}
+
+#chave do informe diário: desde a Resolução CVM 175 uma classe (CNPJ_FUNDO) pode ter várias subclasses com cotas
+#próprias na mesma data; ID_SUBCLASSE é nulo na linha da classe e nos arquivos anteriores. Se a CVM republicar
+#a mesma chave, fica a última linha do arquivo
+_CHAVE_INFORME_DIARIO = ['DT_COMPTC', 'CNPJ_FUNDO', 'ID_SUBCLASSE']
+
+_COLUNAS_INFORME_DIARIO = ['DT_COMPTC', 'CNPJ_FUNDO', 'ID_SUBCLASSE', 'NR_COTST', 'VL_PATRIM_LIQ', 'VL_QUOTA',
+                           'VL_TOTAL', 'CAPTC_DIA', 'RESG_DIA']
+
 def get_classes() -> List[str]:
     '''Lista as classes disponíveis para filtro.'''
     return ['Renda Fixa', 'Ações', 'Multimercado', 'Cambial', 'Curto Prazo', 'Referenciado']
@@ -31,47 +72,161 @@ def pontua_cnpj(cnpj: str) -> str:
     p1, p2, p3, p4, p5 = cnpj[:2], cnpj[2:5], cnpj[5:8], cnpj[8:12], cnpj[12:]
     return f"{p1}.{p2}.{p3}/{p4}-{p5}"
 
-def _get_response(url: str, proxy: Optional[Dict[str, str]] = None):
-    if proxy:
-        resposta = requests.get(url, proxies=proxy, verify=False)
-    else:
-        resposta = requests.get(url)
-    return resposta
+def _digitos_cnpj(coluna: Union[str, pl.Expr]) -> pl.Expr:
+    expr = pl.col(coluna) if isinstance(coluna, str) else coluna
+    return expr.cast(pl.String).str.replace_all(r"\D", "").str.zfill(14)
 
-def _ler_zip_files(resposta, arquivo: str) -> pl.dataframe.frame.DataFrame:
-    if str(resposta) != "<Response [200]>" and str(resposta) != '<Response [407]>':
-        raise ValueError("Não foi possível baixar os dados solicitados")
-    elif str(resposta) == '<Response [407]>':
+def expr_pontua_cnpj(coluna: Union[str, pl.Expr]) -> pl.Expr:
+    '''Versão vetorizada de pontua_cnpj, como expressão polars. Exemplo:
+    df.with_columns(expr_pontua_cnpj("CNPJ_FUNDO"))'''
+    digitos = _digitos_cnpj(coluna)
+    return pl.concat_str([digitos.str.slice(0, 2), pl.lit("."), digitos.str.slice(2, 3), pl.lit("."),
+                          digitos.str.slice(5, 3), pl.lit("/"), digitos.str.slice(8, 4), pl.lit("-"),
+                          digitos.str.slice(12)])
+
+def expr_cnpj_valido(coluna: Union[str, pl.Expr]) -> pl.Expr:
+    '''Expressão polars que indica se o CNPJ, pontuado ou não, tem 14 dígitos e dígitos verificadores corretos.'''
+    digitos = _digitos_cnpj(coluna)
+    numeros = [digitos.str.slice(i, 1).cast(pl.Int32, strict=False) for i in range(14)]
+    def _verificador(pesos: List[int], valores: List[pl.Expr]) -> pl.Expr:
+        resto = sum(peso * valor for peso, valor in zip(pesos, valores)) % 11
+        return pl.when(resto < 2).then(0).otherwise(11 - resto)
+    dv1 = _verificador([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2], numeros[:12])
+    dv2 = _verificador([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2], numeros[:13])
+    return ((digitos.str.len_chars() == 14) & (digitos != "0" * 14) &
+            (dv1 == numeros[12]) & (dv2 == numeros[13])).fill_null(False)
+
+def expr_chave_cnpj(coluna: Union[str, pl.Expr]) -> pl.Expr:
+    '''Expressão polars que converte o CNPJ, pontuado ou não, em inteiro de 64 bits,
+    mais compacto e rápido que o texto de 18 caracteres para cruzamentos (joins).'''
+    return _digitos_cnpj(coluna).cast(pl.Int64, strict=False)
+
+def _ordenar_por(df: pl.dataframe.frame.DataFrame, coluna: str) -> pl.dataframe.frame.DataFrame:
+    '''Ordena por coluna apenas se ainda não estiver ordenado.'''
+    if df[coluna].is_sorted():
+        return df
+    return df.sort(coluna, maintain_order=True)
+
+def _formata_saida(df: pl.dataframe.frame.DataFrame, output_format: str = 'polars',
+                   indice: Optional[str] = None):
+    '''Converte o resultado para o formato pedido:
+    -pandas: pd.DataFrame com tipos do numpy (cópia dos dados);
+    -pandas_arrow: pd.DataFrame com tipos do Arrow (pd.ArrowDtype), sem copiar os dados;
+    -arrow: pyarrow.Table, sem copiar os dados;
+    -polars (ou qualquer outro valor): o próprio pl.DataFrame.
+    Com indice, os dados são ordenados pela coluna (se ainda não estiverem), que vira o índice no pandas.'''
+    if indice is not None:
+        df = _ordenar_por(df, indice)
+    formato = output_format.lower()
+    if formato in ('pandas', 'pandas_arrow'):
+        df_pandas = df.to_pandas(use_pyarrow_extension_array=formato == 'pandas_arrow')
+        return df_pandas.set_index(indice) if indice is not None else df_pandas
+    elif formato == 'arrow':
+        return df.to_arrow()
+    return df
+
+def _mes_fechado(ano: int, mes: int) -> bool:
+    '''A CVM reprocessa os informes dos últimos 12 meses; meses anteriores a isso não mudam mais.'''
+    hoje = datetime.now()
+    return (hoje.year - ano) * 12 + (hoje.month - mes) > 12
+
+def _verificar_status(status_code: int) -> None:
+    if status_code == 407:
         raise ValueError("Necessário informar proxy correta. Response [407]")
-    zf = zipfile.ZipFile(io.BytesIO(resposta.content))
-    zf = zf.open(arquivo)
-    lines = zf.readlines()
-    lines = [i.strip().decode("ISO-8859-1").split(";") for i in lines]
-    fundos = pl.DataFrame(lines[1:], schema=lines[0])
-    return fundos
+    elif status_code != 200:
+        raise ValueError("Não foi possível baixar os dados solicitados")
 
-def get_cadastro_fundos(
-    classe: Optional[Union[List[str], str]] = None, 
-    proxy: Optional[Dict[str, str]] = None,
-    output_format: str = 'pandas') -> Union[pd.DataFrame, pl.dataframe.frame.DataFrame]:
-    '''Busca o cadastro dos fundos em funcionamento normal, dos tipos de classe FIF e FIDC cuja classificação seja não nula
-    e busca sua respectiva classe.'''
-    classes_disponiveis = get_classes()
-    start = time.time()
-    url1 = "http://dados.cvm.gov.br/dados/FI/CAD/DADOS/cad_fi_hist.zip"
-    resposta1 = _get_response(url1, proxy=proxy)
-    url2 = "http://dados.cvm.gov.br/dados/FI/CAD/DADOS/registro_fundo_classe.zip"
-    resposta2 = _get_response(url2, proxy=proxy)
-    resposta3 = _get_response(url2, proxy=proxy)
+@contextmanager
+def _arquivo_baixado(url: str, proxy: Optional[Dict[str, str]] = None,
+                     revalidar: bool = True,
+                     erro_proxy: bool = False) -> Iterator[Tuple[int, Optional[str], Dict[str, Optional[str]]]]:
+    '''Baixa a url direto para o disco (ou usa a cópia do cache) e retorna (status, caminho, versao).
+    Ao sair do bloco, o arquivo temporário criado com o cache desligado é removido e a entrada do cache é liberada.
+    Com erro_proxy, falhas de atributo na requisição (proxy mal informada) viram ValueError, como em get_fip e get_fidc.'''
+    try:
+        status, caminho, temporario, versao = _baixar_arquivo(url, proxy, revalidar)
+    except AttributeError:
+        if not erro_proxy:
+            raise
+        raise ValueError("Necessário informar proxy correta.")
+    try:
+        yield status, caminho, versao
+    finally:
+        _descartar_arquivo(caminho, temporario)
+
+def _caminho_baixado(status: int, caminho: Optional[str]) -> str:
+    '''Caminho do arquivo baixado; erro se o download não retornou o arquivo.'''
+    _verificar_status(status)
+    if caminho is None:
+        raise ValueError("Não foi possível baixar os dados solicitados")
+    return caminho
+
+def _caminho_informe_estruturado(status: int, caminho: Optional[str]) -> str:
+    '''Caminho do informe de FIP ou FIDC baixado; o 404 da CVM indica que não há dados para a data.'''
+    if status == 404:
+        raise ValueError("Não há dados para esta data. Response [404]")
+    return _caminho_baixado(status, caminho)
+
+@contextmanager
+def _membro_zip_em_disco(caminho_zip: str, arquivo: str, encoding: Optional[str] = None) -> Iterator[str]:
+    '''Descompacta o arquivo do zip em blocos para um csv temporário, que o polars lê direto do disco.
+    Assim nem o zip nem o csv descompactado ficam inteiros em memória. Com encoding, o texto é convertido
+    para utf-8 durante a cópia.'''
+    fd, caminho = tempfile.mkstemp(suffix=".csv")
+    try:
+        with os.fdopen(fd, "wb") as destino, zipfile.ZipFile(caminho_zip) as zf, zf.open(arquivo) as origem:
+            decodificador = codecs.getincrementaldecoder(encoding)() if encoding else None
+            while True:
+                bloco = origem.read(_TAMANHO_BLOCO_DOWNLOAD)
+                if not bloco:
+                    break
+                destino.write(decodificador.decode(bloco).encode("utf-8") if decodificador else bloco)
+            if decodificador:
+                #bytes de um caractere multibyte incompleto no fim do arquivo
+                destino.write(decodificador.decode(b"", final=True).encode("utf-8"))
+        yield caminho
+    finally:
+        os.remove(caminho)
+
+def _colunas_csv(conteudo: Union[bytes, str], encoding: str = "ISO-8859-1") -> List[str]:
+    '''Colunas do cabeçalho do csv, a partir do conteúdo ou do caminho do arquivo.'''
+    if isinstance(conteudo, str):
+        with open(conteudo, "rb") as f:
+            conteudo = f.readline()
+    return conteudo.split(b"\n", 1)[0].decode(encoding).strip().split(";")
 
+def _ler_zip_files(caminho_zip: str, arquivo: str,
+                   tipos: Optional[Dict[str, _TipoPolars]] = None,
+                   encoding: str = "ISO-8859-1") -> pl.dataframe.frame.DataFrame:
+    '''Lê o csv do zip direto no leitor de csv do polars. As colunas informadas em tipos já são lidas
+    com o tipo final (valores inválidos viram nulos) e as demais permanecem como texto.
+    O csv é descompactado para o disco em blocos, de forma que só o resultado tipado fica em memória.'''
+    with _membro_zip_em_disco(caminho_zip, arquivo, encoding) as csv:
+        colunas = _colunas_csv(csv, "utf-8")
+        tipos = {coluna: tipo for coluna, tipo in (tipos or {}).items() if coluna in colunas}
+        fundos = pl.read_csv(csv, separator=";", quote_char=None, infer_schema=False,
+                             schema_overrides=tipos, ignore_errors=True)
+    #campos de texto vazios permanecem como texto vazio, e não nulos
+    return fundos.with_columns(pl.col(pl.String).fill_null(""))
+
+def _montar_cadastro(proxy: Optional[Dict[str, str]] = None) -> pl.dataframe.frame.DataFrame:
+    url1 = "http://dados.cvm.gov.br/dados/FI/CAD/DADOS/cad_fi_hist.zip"
+    url2 = "http://dados.cvm.gov.br/dados/FI/CAD/DADOS/registro_fundo_classe.zip" #contém registro_classe.csv e registro_fundo.csv
     arquivo1, arquivo2, arquivo3 = "cad_fi_hist_classe.csv", "registro_classe.csv", "registro_fundo.csv"
-    classes_dos_fundos = _ler_zip_files(resposta1, arquivo1)
+    with _arquivo_baixado(url1, proxy=proxy) as (status, caminho, _):
+        classes_dos_fundos = _ler_zip_files(_caminho_baixado(status, caminho), arquivo1)
+    with _arquivo_baixado(url2, proxy=proxy) as (status, caminho, _):
+        caminho_registro = _caminho_baixado(status, caminho)
+        nome_dos_fundos = _ler_zip_files(caminho_registro, arquivo2)
+        mais_info_dos_fundos = _ler_zip_files(caminho_registro, arquivo3)
+
     classes_dos_fundos = classes_dos_fundos.filter(pl.col('DT_FIM_CLASSE')!='') #classes atuais
+    classes_dos_fundos = classes_dos_fundos.with_columns(expr_chave_cnpj('CNPJ_FUNDO').alias('CHAVE_CNPJ'))
 
-    nome_dos_fundos = _ler_zip_files(resposta2, arquivo2)
-    nome_dos_fundos = nome_dos_fundos.with_columns(pl.col(["CNPJ_Classe"]).map_elements(pontua_cnpj))
+    nome_dos_fundos = nome_dos_fundos.with_columns(expr_chave_cnpj('CNPJ_Classe').alias('CHAVE_CNPJ'),
+                                                   expr_pontua_cnpj('CNPJ_Classe'))
 
-    fundos_filtrado = classes_dos_fundos.join(nome_dos_fundos, right_on='CNPJ_Classe', left_on='CNPJ_FUNDO', how='outer')
+    fundos_filtrado = classes_dos_fundos.join(nome_dos_fundos, on='CHAVE_CNPJ', how='full', coalesce=True)
     fundos_filtrado = fundos_filtrado.with_columns(
                                         pl.when(pl.col('CNPJ_FUNDO').is_null())
                                           .then(pl.col('CNPJ_Classe'))
@@ -79,11 +234,12 @@ def get_cadastro_fundos(
                                           .alias('CNPJ')
                                             )
     fundos_filtrado = fundos_filtrado.drop('CNPJ_FUNDO').rename({'CNPJ': 'CNPJ_FUNDO'})
-    mais_info_dos_fundos = _ler_zip_files(resposta3, arquivo3)
     mais_info_dos_fundos = mais_info_dos_fundos.select(['CNPJ_Fundo', 'Tipo_Fundo', 'Denominacao_Social', 'Situacao', 'Data_Adaptacao_RCVM175'])
     mais_info_dos_fundos = mais_info_dos_fundos.rename({'CNPJ_Fundo': 'CNPJ_FUNDO'})
-    mais_info_dos_fundos = mais_info_dos_fundos.with_columns(pl.col(["CNPJ_FUNDO"]).map_elements(pontua_cnpj))
-    fundos_filtrado = fundos_filtrado.join(mais_info_dos_fundos, on=['CNPJ_FUNDO', 'Denominacao_Social', 'Situacao'], how='right')
+    mais_info_dos_fundos = mais_info_dos_fundos.with_columns(expr_chave_cnpj('CNPJ_FUNDO').alias('CHAVE_CNPJ'),
+                                                             expr_pontua_cnpj('CNPJ_FUNDO'))
+    fundos_filtrado = fundos_filtrado.drop('CNPJ_FUNDO').join(mais_info_dos_fundos, on=['CHAVE_CNPJ', 'Denominacao_Social', 'Situacao'],
+                                                              how='right')
     fundos_filtrado = fundos_filtrado.filter( (pl.col('Situacao')=="Em Funcionamento Normal") &
                                               (pl.col('Tipo_Fundo').is_in(['FIDC', 'FI', 'FIF']) )).drop(['CNPJ_Classe',
                                                                                                           'DT_REG',
@@ -91,69 +247,358 @@ def get_cadastro_fundos(
                                                                                                         'DT_FIM_CLASSE',
                                                                                                         'ID_Registro_Fundo',
                                                                                                         'ID_Registro_Classe'])
+    return fundos_filtrado.with_columns(pl.col('Denominacao_Social').str.to_uppercase())
+
+def _snapshot_cadastro(validade_cadastro: float) -> Optional[str]:
+    '''Retorna o snapshot mais recente do cadastro, se tiver sido gravado há menos de validade_cadastro horas.'''
+    diretorio = _diretorio_snapshots_cadastro()
+    if validade_cadastro <= 0 or not os.path.isdir(diretorio):
+        return None
+    snapshots = sorted(x for x in os.listdir(diretorio) if x.startswith("cadastro_") and x.endswith(".parquet"))
+    if not snapshots:
+        return None
+    caminho = os.path.join(diretorio, snapshots[-1])
+    if time.time() - os.path.getmtime(caminho) > validade_cadastro * 3600:
+        return None
+    return caminho
+
+def _diretorio_snapshots_cadastro() -> str:
+    return os.path.join(str(_CONFIG_CACHE["diretorio"]), "cadastro")
+
+def _gravar_snapshot_cadastro(fundos: pl.dataframe.frame.DataFrame) -> None:
+    '''Grava o snapshot do dia e remove os anteriores, que não seriam mais lidos: a pasta guarda um único cadastro,
+    já que os snapshots ficam fora do limite de tamanho_maximo do cache.'''
+    diretorio = _diretorio_snapshots_cadastro()
+    nome = f"cadastro_{datetime.now():%Y%m%d}.parquet"
+    caminho = os.path.join(diretorio, nome)
+    os.makedirs(diretorio, exist_ok=True)
+    fundos.write_parquet(caminho + ".tmp")
+    os.replace(caminho + ".tmp", caminho)
+    for antigo in os.listdir(diretorio):
+        if antigo.startswith("cadastro_") and antigo.endswith(".parquet") and antigo != nome:
+            try:
+                os.remove(os.path.join(diretorio, antigo))
+            except OSError:
+                pass #ainda aberto por outra leitura; é removido na próxima gravação
+
+def get_cadastro_fundos(
+    classe: Optional[Union[List[str], str]] = None, 
+    proxy: Optional[Dict[str, str]] = None,
+    output_format: str = 'pandas',
+    chave_cnpj: bool = False,
+    validade_cadastro: float = 24) -> Union[pd.DataFrame, pl.dataframe.frame.DataFrame]:
+    '''Busca o cadastro dos fundos em funcionamento normal, dos tipos de classe FIF e FIDC cuja classificação seja não nula
+    e busca sua respectiva classe.
+    Com chave_cnpj=True mantém a coluna CHAVE_CNPJ, o CNPJ como inteiro, usada por mesclar_bases no cruzamento.
+    O cadastro montado é gravado em parquet na pasta do cache (cadastro/cadastro_AAAAMMDD.parquet) e reaproveitado
+    por validade_cadastro horas; só o mais recente é mantido. Use validade_cadastro=0 para forçar uma nova montagem.'''
+    classes_disponiveis = get_classes()
+    start = time.time()
     if classe:
         if not isinstance(classe, list):
             classe = [classe]
         check_classes = [x for x in classe if x not in classes_disponiveis]
         if check_classes:
             raise ValueError(f"Classe não encontrada {check_classes}")
+    snapshot = _snapshot_cadastro(validade_cadastro) if _CONFIG_CACHE["ativo"] else None
+    if snapshot:
+        fundos_filtrado = pl.read_parquet(snapshot)
+    else:
+        fundos_filtrado = _montar_cadastro(proxy)
+        if _CONFIG_CACHE["ativo"]:
+            _gravar_snapshot_cadastro(fundos_filtrado)
+    if classe:
         fundos_filtrado = fundos_filtrado.filter((pl.col('CLASSE').is_in(classe)) | (pl.col('CLASSE').is_null()) |
                                                  (pl.col('CLASSE')==''))
-    fundos_filtrado = fundos_filtrado.with_columns(pl.col('Denominacao_Social').str.to_uppercase())
-    if output_format.lower() == 'pandas':
-        fundos_filtrado = fundos_filtrado.to_pandas()
+    if not chave_cnpj:
+        fundos_filtrado = fundos_filtrado.drop('CHAVE_CNPJ')
     print(f"Cadastro finalizado em {round((time.time()-start)/60,2)} minutos")
-    return fundos_filtrado
+    return _formata_saida(fundos_filtrado, output_format)
+
+def _dimensao_cadastro(cadastro_fundos: pl.LazyFrame, tipo_cnpj: pl.DataType, por_chave: bool) -> pl.LazyFrame:
+    '''Prepara o cadastro como tabela de dimensão: o rótulo CNPJ - Nome é montado uma vez por fundo, como categórico,
+    e a chave do cruzamento fica no mesmo tipo do informe.'''
+    cadastro_fundos = cadastro_fundos.with_columns(
+        (pl.col('CNPJ_FUNDO').cast(pl.String) + ' // ' + pl.col('Denominacao_Social')).cast(pl.Categorical).alias('CNPJ - Nome'))
+    if por_chave:
+        return cadastro_fundos.drop('CNPJ_FUNDO')
+    return cadastro_fundos.with_columns(pl.col('CNPJ_FUNDO').cast(tipo_cnpj))
 
-def mesclar_bases(cadastro_fundos: pl.dataframe.frame.DataFrame, informe_diario_fundos: pl.dataframe.frame.DataFrame,
-                  output_format: str = 'pandas') -> pl.dataframe.frame.DataFrame:
+def mesclar_bases(cadastro_fundos: Union[pd.DataFrame, pl.dataframe.frame.DataFrame, pl.LazyFrame],
+                  informe_diario_fundos: Union[pd.DataFrame, pl.dataframe.frame.DataFrame, pl.LazyFrame],
+                  output_format: str = 'pandas',
+                  lazy: bool = False) -> Union[pd.DataFrame, pl.dataframe.frame.DataFrame, pl.LazyFrame]:
     '''Função para obter dados adicionais dos Fundos que estão em seu cadastro.
-    Basta informar o dataframe do cadastro com o dataframe do informe diario para obter as informações.'''
+    Basta informar o dataframe do cadastro com o dataframe do informe diario para obter as informações.
+    O cadastro é tratado como tabela de dimensão: a coluna CNPJ - Nome é montada uma vez por fundo (categórica)
+    e levada ao informe pelo cruzamento, que mantém a ordem por data do informe.
+    Se ambos tiverem a coluna CHAVE_CNPJ (chave_cnpj=True), o cruzamento é feito pelo CNPJ inteiro; com o informe
+    compactado (compactar=True), pelo CNPJ categórico.
+    Com lazy=True retorna um pl.LazyFrame e nada é executado até o .collect(); nesse caso output_format é ignorado.'''
     if isinstance(cadastro_fundos, pd.DataFrame):
         cadastro_fundos = pl.from_pandas(cadastro_fundos)
     if isinstance(informe_diario_fundos, pd.DataFrame):
         if 'DT_COMPTC' not in informe_diario_fundos.columns:
             informe_diario_fundos = informe_diario_fundos.reset_index()
         informe_diario_fundos = pl.from_pandas(informe_diario_fundos)
-    dados_completos_filtrados = informe_diario_fundos.join(cadastro_fundos, on=['CNPJ_FUNDO'], how="inner")
-    dados_completos_filtrados = dados_completos_filtrados.with_columns(((pl.col('CNPJ_FUNDO')) + ' // ' + (pl.col('Denominacao_Social'))).alias('CNPJ - Nome'))
-    if output_format.lower() == 'pandas':
-        return dados_completos_filtrados.to_pandas().set_index('DT_COMPTC').sort_index()
-    else:
-        return dados_completos_filtrados.sort('DT_COMPTC')
+    cadastro_fundos, informe_diario_fundos = cadastro_fundos.lazy(), informe_diario_fundos.lazy()
+    esquema_informe = informe_diario_fundos.collect_schema()
+    por_chave = 'CHAVE_CNPJ' in cadastro_fundos.collect_schema() and 'CHAVE_CNPJ' in esquema_informe
+    dimensao = _dimensao_cadastro(cadastro_fundos, esquema_informe['CNPJ_FUNDO'], por_chave)
+    dados_completos_filtrados = informe_diario_fundos.join(dimensao, on='CHAVE_CNPJ' if por_chave else 'CNPJ_FUNDO',
+                                                           how="inner", maintain_order='left')
+    if lazy:
+        return dados_completos_filtrados
+    return _formata_saida(dados_completos_filtrados.collect(), output_format, indice='DT_COMPTC')
 
-def _ler_dados_diarios(ano: int, mes: int, proxy: Optional[Dict[str, str]] = None,
-                       cnpj: Optional[str] = None,
-                       num_minimo_cotistas: Optional[int] = None, 
-                       patriminio_liquido_minimo: Optional[int] = None) -> pl.dataframe.frame.DataFrame:
-    arquivo = "inf_diario_fi_{:02d}{:02d}.csv".format(ano, mes) if ano> 2004 else "inf_diario_fi_{:02d}.csv".format(ano)
-    url = "http://dados.cvm.gov.br/dados/FI/DOC/INF_DIARIO/DADOS/inf_diario_fi_{:02d}{:02d}.zip".format(ano, mes) if ano>= 2021 else \
+def _linhas_da_classe(fundos: pl.LazyFrame) -> pl.LazyFrame:
+    '''Uma cota por fundo e data: descarta as linhas das subclasses (ID_SUBCLASSE preenchido), quando houver.'''
+    if 'ID_SUBCLASSE' in fundos.collect_schema():
+        return fundos.filter(pl.col('ID_SUBCLASSE').is_null())
+    return fundos
+
+def _pivotar_serie_temporal(fundos: pl.LazyFrame, valores: str, colunas: str, dtype: _TipoPolars,
+                            output_format: str) -> Union[pd.DataFrame, pl.DataFrame]:
+    serie = (fundos.collect()
+                   .pivot(on=colunas, index='DT_COMPTC', values=valores, aggregate_function='first', sort_columns=True))
+    serie = serie.with_columns(pl.exclude('DT_COMPTC').cast(dtype))
+    return _formata_saida(serie, output_format, indice='DT_COMPTC')
+
+def monta_serie_temporal(informe_diario_fundos: Union[pd.DataFrame, pl.DataFrame, pl.LazyFrame],
+                         valores: str = 'VL_QUOTA',
+                         colunas: str = 'CNPJ - Nome',
+                         historico_minimo: Optional[int] = None,
+                         dtype: _TipoPolars = pl.Float32,
+                         output_format: str = 'pandas',
+                         tamanho_bloco: Optional[int] = None,
+                         ) -> Union[pd.DataFrame, pl.DataFrame, Iterator[Union[pd.DataFrame, pl.DataFrame]]]:
+    '''Monta a série temporal (datas x fundos) usada pelas funções do comparador a partir do formato longo
+    de fundosbr ou mesclar_bases. O pivot é feito no polars e os valores são convertidos para dtype (float32 por padrão).
+    Só as linhas da classe entram na série: as das subclasses (ID_SUBCLASSE preenchido) são descartadas.
+    Parâmetros:
+    -valores (str): coluna com os valores, por padrão VL_QUOTA;
+    -colunas (str): coluna que identifica os fundos, por padrão CNPJ - Nome (use CNPJ_FUNDO para a saída de fundosbr);
+    -historico_minimo (int): descarta os fundos com menos dias com valor do que o informado;
+    -dtype: tipo dos valores na saída;
+    -output_format (str): pandas, pandas_arrow, polars ou arrow (ver _formata_saida);
+    -tamanho_bloco (int): se informado, retorna um iterador de séries temporais com até tamanho_bloco fundos cada,
+    evitando montar a matriz completa de uma vez.'''
+    if isinstance(informe_diario_fundos, pd.DataFrame):
+        if 'DT_COMPTC' not in informe_diario_fundos.columns:
+            informe_diario_fundos = informe_diario_fundos.reset_index()
+        informe_diario_fundos = pl.from_pandas(informe_diario_fundos)
+    fundos = (_linhas_da_classe(informe_diario_fundos.lazy())
+                                   .select(['DT_COMPTC', colunas, valores])
+                                   .drop_nulls(valores))
+    if historico_minimo:
+        fundos = fundos.filter(pl.col(valores).count().over(colunas) >= historico_minimo)
+    if tamanho_bloco is None:
+        return _pivotar_serie_temporal(fundos, valores, colunas, dtype, output_format)
+    fundos = fundos.collect().lazy()
+    nomes = fundos.select(pl.col(colunas).unique().sort()).collect().to_series().to_list()
+    return (_pivotar_serie_temporal(fundos.filter(pl.col(colunas).is_in(nomes[i:i + tamanho_bloco])),
+                                    valores, colunas, dtype, output_format)
+            for i in range(0, len(nomes), tamanho_bloco))
+
+def _url_dados_diarios(ano: int, mes: int) -> str:
+    '''Até 2020 a CVM publica um único zip por ano (pasta HIST); a partir de 2021, um zip por mês.'''
+    return "http://dados.cvm.gov.br/dados/FI/DOC/INF_DIARIO/DADOS/inf_diario_fi_{:02d}{:02d}.zip".format(ano, mes) if ano>= 2021 else \
            "http://dados.cvm.gov.br/dados/FI/DOC/INF_DIARIO/DADOS/HIST/inf_diario_fi_{:02d}.zip".format(ano)
-    resposta = _get_response(url, proxy=proxy)
-    fundos = _ler_zip_files(resposta, arquivo)
-    cols1 = [x for x in fundos.columns if "TP_FUNDO" in x]
+
+def _revalidar_dados_diarios(ano: int, mes: int) -> bool:
+    return not _mes_fechado(ano, 12 if ano < 2021 else mes)
+
+def _arquivo_dados_diarios(ano: int, mes: int) -> str:
+    return "inf_diario_fi_{:02d}{:02d}.csv".format(ano, mes) if ano> 2004 else "inf_diario_fi_{:02d}.csv".format(ano)
+
+def _consulta_dados_diarios(ano: int, csv: str,
+                            cnpj: Optional[str] = None,
+                            num_minimo_cotistas: Optional[int] = None,
+                            patriminio_liquido_minimo: Optional[int] = None,
+                            compactar: bool = False) -> pl.LazyFrame:
+    '''Monta a consulta lazy sobre o csv do informe diário descompactado em disco.'''
+    colunas = _colunas_csv(csv)
+    tipos = {coluna: tipo for coluna, tipo in _TIPOS_INFORME_DIARIO.items() if coluna in colunas}
+    #o informe diário só tem texto ASCII, então dispensa a decodificação ISO-8859-1
+    fundos = pl.scan_csv(csv, separator=";", encoding="utf8-lossy", quote_char=None, infer_schema=False,
+                         schema_overrides=tipos, ignore_errors=True)
+    cols1 = [x for x in colunas if "TP_FUNDO" in x]
     if cols1 and int(ano)>=2004:
         fundos = fundos.rename({cols1[0]: 'TP_FUNDO'})
         fundos = fundos.filter(pl.col("TP_FUNDO").is_in(['FI','FIF','CLASSES - FIF']))
-    cols2 = [x for x in fundos.columns if "CNPJ_FUNDO" in x][0]
+    cols2 = [x for x in colunas if "CNPJ_FUNDO" in x][0]
     fundos = fundos.rename({cols2: 'CNPJ_FUNDO'})
-    fundos = fundos.with_columns(pl.col("NR_COTST").cast(pl.Int32, strict=False))
-    fundos = fundos.with_columns(pl.col("VL_PATRIM_LIQ").cast(pl.Float64, strict=False))
-    fundos = fundos.with_columns(pl.col("VL_TOTAL").cast(pl.Float64, strict=False))
-    fundos = fundos.with_columns(pl.col("CAPTC_DIA").cast(pl.Float64, strict=False))
-    fundos = fundos.with_columns(pl.col("RESG_DIA").cast(pl.Float64, strict=False))
-    fundos = fundos.with_columns(pl.col("VL_QUOTA").cast(pl.Float32, strict=False))
-    fundos = fundos.with_columns(pl.col("DT_COMPTC").str.to_datetime("%Y-%m-%d"))
+    if 'ID_SUBCLASSE' not in colunas:
+        fundos = fundos.with_columns(pl.lit(None, dtype=pl.String).alias('ID_SUBCLASSE'))
+    fundos = _filtrar_dados_diarios(fundos, cnpj, num_minimo_cotistas, patriminio_liquido_minimo)
+    fundos = fundos.select(_COLUNAS_INFORME_DIARIO)
+    return _compactar_informes(fundos) if compactar else fundos
+
+def _compactar_informes(fundos: _Quadro) -> _Quadro:
+    return fundos.with_columns([pl.col(coluna).cast(tipo) for coluna, tipo in _TIPOS_INFORME_COMPACTO.items()])
+
+def _remover_duplicados(fundos: pl.LazyFrame) -> pl.LazyFrame:
+    '''Mantém uma linha por fundo, subclasse e data (a última do arquivo) e ordena por data.'''
+    return (fundos.unique(subset=_CHAVE_INFORME_DIARIO, keep='last', maintain_order=True)
+                  .sort('DT_COMPTC', maintain_order=True))
+
+def _filtrar_dados_diarios(fundos: pl.LazyFrame, cnpj: Optional[str] = None,
+                           num_minimo_cotistas: Optional[int] = None,
+                           patriminio_liquido_minimo: Optional[int] = None) -> pl.LazyFrame:
     if num_minimo_cotistas:
         fundos = fundos.filter(pl.col("NR_COTST") >= num_minimo_cotistas)
     if patriminio_liquido_minimo:
         fundos = fundos.filter(pl.col("VL_PATRIM_LIQ") >= patriminio_liquido_minimo)
     if cnpj:
         if isinstance(cnpj, str): cnpj = [cnpj]
-        lista_cnpj = [pontua_cnpj(x) for x in cnpj]
+        lista_cnpj = pl.select(expr_pontua_cnpj(pl.lit(pl.Series(cnpj, dtype=pl.String)))).to_series()
         fundos = fundos.filter(pl.col("CNPJ_FUNDO").is_in(lista_cnpj))
-    return fundos.select(['DT_COMPTC', 'CNPJ_FUNDO', 'NR_COTST', 'VL_PATRIM_LIQ', 'VL_QUOTA',
-                          'VL_TOTAL', 'CAPTC_DIA', 'RESG_DIA']).unique().sort('DT_COMPTC')
+    return fundos
+
+def _ler_dados_diarios(ano: int, mes: int, proxy: Optional[Dict[str, str]] = None,
+                       cnpj: Optional[str] = None,
+                       num_minimo_cotistas: Optional[int] = None, 
+                       patriminio_liquido_minimo: Optional[int] = None,
+                       arquivo_zip: Optional[str] = None,
+                       compactar: bool = False,
+                       selecao: Optional[Callable[[pl.LazyFrame], pl.LazyFrame]] = None) -> pl.dataframe.frame.DataFrame:
+    '''Lê o informe diário do mês. O zip e o csv descompactado ficam em disco e o polars lê direto do arquivo,
+    de forma que só o resultado tipado e filtrado fica em memória. selecao, se informada, é aplicada à consulta
+    sobre o csv (filtros e colunas de uma consulta lazy) antes da leitura.'''
+    if arquivo_zip is None:
+        with _arquivo_baixado(_url_dados_diarios(ano, mes), proxy, _revalidar_dados_diarios(ano, mes)) as (status, caminho, _):
+            _verificar_status(status)
+            return _ler_dados_diarios(ano, mes, proxy, cnpj, num_minimo_cotistas, patriminio_liquido_minimo, arquivo_zip=caminho,
+                                      compactar=compactar, selecao=selecao)
+    with _membro_zip_em_disco(arquivo_zip, _arquivo_dados_diarios(ano, mes)) as csv:
+        fundos = _remover_duplicados(_consulta_dados_diarios(ano, csv, cnpj, num_minimo_cotistas, patriminio_liquido_minimo, compactar))
+        #o motor streaming lê o csv em lotes e não depende de threads livres no pool do polars, que podem estar
+        #todas ocupadas quando a leitura é feita de dentro de outra consulta (fundosbr com lazy=True)
+        return (selecao(fundos) if selecao else fundos).collect(engine="streaming")
+
+def _periodos(anos: Union[List[int], int], meses: Union[List[int], int]) -> List[Tuple[int, int]]:
+    if isinstance(anos, int): anos = [anos]
+    else: anos = list(anos)
+    if isinstance(meses, int): meses = [meses]
+    else: meses = list(meses)
+    hoje = datetime.now()
+    return [(ano, mes) for ano in anos for mes in meses
+            if ano < hoje.year or (ano == hoje.year and mes <= hoje.month)]
+
+def _agrupar_por_arquivo(periodos: List[Tuple[int, int]]) -> List[Tuple[int, List[int]]]:
+    '''Agrupa os meses que estão no mesmo zip da CVM, para que cada arquivo seja baixado uma única vez.'''
+    grupos: List[Tuple[int, List[int]]] = []
+    for ano, mes in periodos:
+        if ano < 2021 and grupos and grupos[-1][0] == ano:
+            grupos[-1][1].append(mes)
+        else:
+            grupos.append((ano, [mes]))
+    return grupos
+
+def _ler_dados_diarios_do_arquivo(ano: int, meses: List[int], proxy: Optional[Dict[str, str]] = None,
+                                  cnpj: Optional[str] = None,
+                                  num_minimo_cotistas: Optional[int] = None,
+                                  patriminio_liquido_minimo: Optional[int] = None,
+                                  arquivo_zip: Optional[str] = None,
+                                  compactar: bool = False,
+                                  selecao: Optional[Callable[[pl.LazyFrame], pl.LazyFrame]] = None) -> List[pl.dataframe.frame.DataFrame]:
+    '''Lê os meses de um mesmo zip a partir de um único download. Até 2004 o zip contém um único csv anual,
+    que é lido uma vez e separado por mês. Sem arquivo_zip (o zip já baixado), o zip é baixado direto para o disco.'''
+    if arquivo_zip is None:
+        with _arquivo_baixado(_url_dados_diarios(ano, meses[0]), proxy,
+                              _revalidar_dados_diarios(ano, meses[0])) as (status, caminho, _):
+            _verificar_status(status)
+            return _ler_dados_diarios_do_arquivo(ano, meses, proxy, cnpj, num_minimo_cotistas, patriminio_liquido_minimo,
+                                                 arquivo_zip=caminho, compactar=compactar, selecao=selecao)
+    if ano > 2004:
+        return [_ler_dados_diarios(ano, mes, proxy, cnpj, num_minimo_cotistas, patriminio_liquido_minimo, arquivo_zip=arquivo_zip,
+                                   compactar=compactar, selecao=selecao)
+                for mes in meses]
+    def _meses_do_ano(fundos: pl.LazyFrame) -> pl.LazyFrame:
+        #só os meses pedidos do csv anual ficam em memória
+        fundos = fundos.filter(pl.col("DT_COMPTC").dt.month().is_in(meses))
+        return selecao(fundos) if selecao else fundos
+    informe_anual = _ler_dados_diarios(ano, meses[0], proxy, cnpj, num_minimo_cotistas, patriminio_liquido_minimo, arquivo_zip=arquivo_zip,
+                                       compactar=compactar, selecao=_meses_do_ano)
+    return [informe_anual.filter(pl.col("DT_COMPTC").dt.month() == mes) for mes in meses]
+
+def _concatenar_informes(informes: List[pl.dataframe.frame.DataFrame], compactar: bool = False) -> pl.dataframe.frame.DataFrame:
+    '''Junta os meses em uma única cópia contígua. Cada mês já vem ordenado por data, então a ordenação final
+    só é feita quando os meses não foram pedidos em ordem cronológica.'''
+    if not informes:
+        vazio = pl.DataFrame(schema={coluna: _TIPOS_INFORME_DIARIO.get(coluna, pl.String) for coluna in _COLUNAS_INFORME_DIARIO})
+        return _compactar_informes(vazio) if compactar else vazio
+    informe_diario_fundos_historico = pl.concat(informes, rechunk=True)
+    if informe_diario_fundos_historico['DT_COMPTC'].is_sorted():
+        return informe_diario_fundos_historico.set_sorted('DT_COMPTC')
+    return informe_diario_fundos_historico.sort('DT_COMPTC', maintain_order=True)
+
+def _consulta_informes_cvm(periodos: List[Tuple[int, int]], proxy: Optional[Dict[str, str]] = None,
+                           cnpj: Optional[str] = None,
+                           num_minimo_cotistas: Optional[int] = None,
+                           patriminio_liquido_minimo: Optional[int] = None,
+                           max_workers: int = 1,
+                           compactar: bool = False) -> pl.LazyFrame:
+    '''Consulta lazy dos informes diários da CVM: nada é baixado nem lido até o .collect(). Na execução, cada zip é
+    baixado (ou lido do cache) e o csv de cada mês é descompactado em disco e lido com pl.scan_csv já com as colunas e
+    o filtro da consulta (projection e predicate pushdown), de forma que só as linhas selecionadas ficam em memória.
+    Os csv existem apenas durante a leitura do seu mês. Os meses saem em ordem cronológica, como em fundosbr.'''
+    esquema = _concatenar_informes([], compactar).schema
+    def _ler(colunas: Optional[List[str]], filtro: Optional[pl.Expr], num_linhas: Optional[int],
+             _tamanho_lote: Optional[int]) -> Iterator[pl.DataFrame]:
+        #DT_COMPTC é sempre lida: até 2004 o csv anual é separado por mês por ela
+        lidas = list(esquema) if colunas is None else list(dict.fromkeys(['DT_COMPTC'] + colunas))
+        def _selecao(fundos: pl.LazyFrame) -> pl.LazyFrame:
+            if filtro is not None:
+                fundos = fundos.filter(filtro)
+            if num_linhas is not None:
+                fundos = fundos.head(num_linhas)
+            return fundos.select(lidas)
+        def _baixar(ano: int, mes: int) -> Tuple[int, Optional[str], bool]:
+            status, caminho, temporario, _ = _baixar_arquivo(_url_dados_diarios(ano, mes), proxy,
+                                                             _revalidar_dados_diarios(ano, mes))
+            return status, caminho, temporario
+        grupos = _agrupar_por_arquivo(sorted(periodos))
+        restantes = num_linhas
+        #só os downloads vão para as threads; a leitura fica na thread da consulta, pois um collect em outra thread
+        #pode ficar esperando pelo pool do polars que a própria consulta ocupa (join ou concat com outras consultas)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            downloads = [executor.submit(_baixar, ano, meses_do_arquivo[0]) for ano, meses_do_arquivo in grupos]
+            try:
+                for ano, meses_do_arquivo in grupos:
+                    status, caminho, temporario = downloads.pop(0).result()
+                    try:
+                        _verificar_status(status)
+                        informes = _ler_dados_diarios_do_arquivo(ano, meses_do_arquivo, proxy, cnpj, num_minimo_cotistas,
+                                                                 patriminio_liquido_minimo, arquivo_zip=caminho,
+                                                                 compactar=compactar, selecao=_selecao)
+                    finally:
+                        _descartar_arquivo(caminho, temporario)
+                    for informe in informes:
+                        if restantes is not None:
+                            informe = informe.head(restantes)
+                            restantes -= informe.height
+                        yield informe if colunas is None else informe.select(colunas)
+                        if restantes == 0:
+                            return
+            finally:
+                #consulta interrompida (head ou erro): libera os arquivos dos downloads que não foram lidos
+                for download in downloads:
+                    if not download.cancel() and download.exception() is None:
+                        _descartar_arquivo(*download.result()[1:])
+    return register_io_source(_ler, schema=esquema)
+
+def _incluir_chave_cnpj(fundos: _Quadro, chave_cnpj: bool) -> _Quadro:
+    if chave_cnpj:
+        return fundos.with_columns(expr_chave_cnpj('CNPJ_FUNDO').alias('CHAVE_CNPJ'))
+    return fundos
+
+def _finalizar_informes(informe_diario_fundos_historico: Union[pl.dataframe.frame.DataFrame, pl.LazyFrame],
+                        chave_cnpj: bool = False,
+                        output_format: str = 'polars') -> Union[pd.DataFrame, pl.dataframe.frame.DataFrame, pl.LazyFrame]:
+    if isinstance(informe_diario_fundos_historico, pl.LazyFrame):
+        return _incluir_chave_cnpj(informe_diario_fundos_historico, chave_cnpj)
+    return _formata_saida(_incluir_chave_cnpj(informe_diario_fundos_historico, chave_cnpj), output_format, indice='DT_COMPTC')
 
 def fundosbr(
             anos: Union[List[int], int],
@@ -162,45 +607,210 @@ def fundosbr(
             num_minimo_cotistas: Optional[int] = None,
             patriminio_liquido_minimo: Optional[int] = None,
             proxy: Optional[Dict[str, str]] = None,
-            output_format: str = 'pandas'
-				) -> Union[pd.DataFrame, pl.dataframe.frame.DataFrame]:
+            output_format: str = 'pandas',
+            max_workers: int = 1,
+            lazy: bool = False,
+            diretorio_base: Optional[str] = None,
+            chave_cnpj: bool = False,
+            compactar: bool = False
+				) -> Union[pd.DataFrame, pl.dataframe.frame.DataFrame, pl.LazyFrame]:
+    '''Busca os informes diários dos fundos nos anos e meses informados.
+    Com max_workers > 1 os meses são baixados e lidos em paralelo, mantendo a ordem de anos e meses no resultado.
+    Até 2020 os meses de um mesmo ano estão em um único zip, que é baixado apenas uma vez.
+    Com lazy=True retorna um pl.LazyFrame e nada é baixado nem lido até o .collect() (erros de download também só
+    aparecem nele). Os filtros informados e os filtros e colunas da consulta montada sobre o resultado (ex.:
+    .filter(...).select(...) ou mesclar_bases(..., lazy=True)) são levados ao leitor de csv de cada mês, de forma que
+    só as linhas selecionadas ficam em memória, nunca os csv inteiros. Nesse caso output_format é ignorado.
+    Com diretorio_base os dados são lidos da base local em parquet mantida por atualizar_base, sem acessar a CVM.
+    Com chave_cnpj=True inclui a coluna CHAVE_CNPJ, o CNPJ como inteiro, usada por mesclar_bases no cruzamento.
+    output_format pode ser pandas (padrão, indexado por DT_COMPTC), pandas_arrow (pandas com tipos do Arrow, sem cópia),
+    arrow (pyarrow.Table, sem cópia) ou polars.
+    A coluna ID_SUBCLASSE identifica as cotas das subclasses (Resolução CVM 175) e é nula na linha da própria classe;
+    para uma única cota por fundo, filtre ID_SUBCLASSE nulo. Quando a CVM publica mais de uma linha para o mesmo fundo,
+    subclasse e data (DT_COMPTC, CNPJ_FUNDO, ID_SUBCLASSE), fica a última do arquivo.
+    Com compactar=True os dados usam menos da metade da memória: DT_COMPTC como data (pl.Date), CNPJ_FUNDO categórico e
+    VL_PATRIM_LIQ, VL_TOTAL, CAPTC_DIA e RESG_DIA em float32 (cerca de 7 dígitos significativos, como VL_QUOTA).'''
     start = time.time()
-    if isinstance(anos, int): anos = [anos]
-    else: anos = list(anos)
-    if isinstance(meses, int): meses = [meses]
-    else: anos = list(anos)
-    informe_diario_fundos_historico = pl.DataFrame()
-    for ano in anos:
-        for mes in meses:
-            if ano == datetime.now().year and mes <= datetime.now().month:
-                informe_diario_fundos_filtrado = _ler_dados_diarios(ano, mes, proxy, cnpj, num_minimo_cotistas, patriminio_liquido_minimo)
-                informe_diario_fundos_historico = pl.concat([informe_diario_fundos_historico, informe_diario_fundos_filtrado])
-            elif ano < datetime.now().year:
-                informe_diario_fundos_filtrado = _ler_dados_diarios(ano, mes, proxy, cnpj, num_minimo_cotistas, patriminio_liquido_minimo)
-                informe_diario_fundos_historico = pl.concat([informe_diario_fundos_historico, informe_diario_fundos_filtrado])
-    print(f"Dados diários finalizados em {round((time.time()-start)/60,2)} minutos")
-    if output_format.lower() == 'pandas':
-        return informe_diario_fundos_historico.to_pandas().set_index('DT_COMPTC').sort_index()
+    periodos = _periodos(anos, meses)
+    if diretorio_base:
+        consulta = _scan_base_local(diretorio_base, periodos, cnpj, num_minimo_cotistas, patriminio_liquido_minimo, compactar)
+        if lazy:
+            return _finalizar_informes(consulta, chave_cnpj)
+        informe_diario_fundos_historico = consulta.collect()
     else:
-        return informe_diario_fundos_historico.sort('DT_COMPTC')
+        if lazy:
+            consulta = _consulta_informes_cvm(periodos, proxy, cnpj, num_minimo_cotistas, patriminio_liquido_minimo,
+                                              max_workers, compactar)
+            return _finalizar_informes(consulta, chave_cnpj)
+        def _ler_grupo(grupo):
+            ano, meses_do_arquivo = grupo
+            return _ler_dados_diarios_do_arquivo(ano, meses_do_arquivo, proxy, cnpj, num_minimo_cotistas, patriminio_liquido_minimo,
+                                                 compactar=compactar)
+        informes = []
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            for informes_do_arquivo in executor.map(_ler_grupo, _agrupar_por_arquivo(periodos)):
+                informes.extend(informes_do_arquivo)
+        informe_diario_fundos_historico = _concatenar_informes(informes, compactar)
+        del informes
+    print(f"Dados diários finalizados em {round((time.time()-start)/60,2)} minutos")
+    return _finalizar_informes(informe_diario_fundos_historico, chave_cnpj, output_format)
+
+def iter_informes(
+            anos: Union[List[int], int],
+            meses: Union[List[int], int],
+            cnpj: Optional[str] = None,
+            num_minimo_cotistas: Optional[int] = None,
+            patriminio_liquido_minimo: Optional[int] = None,
+            proxy: Optional[Dict[str, str]] = None,
+            diretorio_base: Optional[str] = None,
+            chave_cnpj: bool = False,
+            compactar: bool = False
+				) -> Iterator[pl.dataframe.frame.DataFrame]:
+    '''Gera os informes diários mês a mês, na ordem de anos e meses informada, cada um como pl.DataFrame já filtrado,
+    tipado e ordenado por data, assim que é lido. Diferente de fundosbr, só um mês fica em memória por vez:
+    o consumidor pode agregar, gravar em outro destino ou interromper a leitura a qualquer momento.
+    Os zips anuais (até 2020) são baixados uma única vez para o disco e lidos mês a mês; até 2004 o csv é anual
+    e é lido de uma vez antes de ser separado por mês.
+    Os parâmetros têm o mesmo significado que em fundosbr. Exemplo:
+    for informe in iter_informes(anos=range(2005, 2025), meses=range(1, 13)):
+        informe.write_parquet(...)'''
+    periodos = _periodos(anos, meses)
+    if diretorio_base:
+        _scan_base_local(diretorio_base, periodos) #falha logo se faltar algum mês na base local
+        for periodo in periodos:
+            informe = _scan_base_local(diretorio_base, [periodo], cnpj, num_minimo_cotistas, patriminio_liquido_minimo,
+                                       compactar).collect()
+            yield _ordenar_por(_incluir_chave_cnpj(informe, chave_cnpj), 'DT_COMPTC')
+        return
+    for ano, meses_do_arquivo in _agrupar_por_arquivo(periodos):
+        with _arquivo_baixado(_url_dados_diarios(ano, meses_do_arquivo[0]), proxy,
+                              _revalidar_dados_diarios(ano, meses_do_arquivo[0])) as (status, caminho, _):
+            _verificar_status(status)
+            if ano > 2004:
+                for mes in meses_do_arquivo:
+                    informe = _ler_dados_diarios(ano, mes, proxy, cnpj, num_minimo_cotistas, patriminio_liquido_minimo,
+                                                 arquivo_zip=caminho, compactar=compactar)
+                    yield _ordenar_por(_incluir_chave_cnpj(informe, chave_cnpj), 'DT_COMPTC')
+            else:
+                informes = _ler_dados_diarios_do_arquivo(ano, meses_do_arquivo, proxy, cnpj, num_minimo_cotistas,
+                                                         patriminio_liquido_minimo, arquivo_zip=caminho, compactar=compactar)
+                while informes:
+                    yield _ordenar_por(_incluir_chave_cnpj(informes.pop(0), chave_cnpj), 'DT_COMPTC')
+
+def _caminho_particao(diretorio: str, ano: int, mes: int) -> str:
+    return os.path.join(diretorio, f"ano={ano}", f"mes={mes:02d}", "informe_diario.parquet")
+
+def _ler_sincronizacao(diretorio: str) -> Dict[str, Dict[str, Optional[str]]]:
+    caminho = os.path.join(diretorio, "sincronizacao.json")
+    if not os.path.exists(caminho):
+        return {}
+    with open(caminho, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _salvar_sincronizacao(diretorio: str, sincronizacao: Dict[str, Dict[str, Optional[str]]]) -> None:
+    caminho = os.path.join(diretorio, "sincronizacao.json")
+    with open(caminho + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(sincronizacao, f, indent=1, sort_keys=True)
+    os.replace(caminho + ".tmp", caminho)
+
+def _particao_sem_subclasse(caminho: str) -> bool:
+    '''Partições gravadas antes da coluna ID_SUBCLASSE, sem as linhas das subclasses.'''
+    return 'ID_SUBCLASSE' not in pl.read_parquet_schema(caminho)
+
+def _scan_particao(caminho: str) -> pl.LazyFrame:
+    fundos = pl.scan_parquet(caminho)
+    if _particao_sem_subclasse(caminho):
+        fundos = fundos.with_columns(pl.lit(None, dtype=pl.String).alias('ID_SUBCLASSE'))
+    return fundos.select(_COLUNAS_INFORME_DIARIO)
+
+def _scan_base_local(diretorio: str, periodos: List[Tuple[int, int]],
+                     cnpj: Optional[str] = None,
+                     num_minimo_cotistas: Optional[int] = None,
+                     patriminio_liquido_minimo: Optional[int] = None,
+                     compactar: bool = False) -> pl.LazyFrame:
+    caminhos = [_caminho_particao(diretorio, ano, mes) for ano, mes in periodos]
+    faltantes = [f"{ano}-{mes:02d}" for (ano, mes), caminho in zip(periodos, caminhos) if not os.path.exists(caminho)]
+    if faltantes:
+        raise ValueError(f"Meses não encontrados na base local {faltantes}. Execute atualizar_base.")
+    fundos = pl.concat([_scan_particao(caminho) for caminho in caminhos])
+    fundos = _filtrar_dados_diarios(fundos, cnpj, num_minimo_cotistas, patriminio_liquido_minimo)
+    if compactar:
+        fundos = _compactar_informes(fundos)
+    return fundos.sort('DT_COMPTC', maintain_order=True)
+
+def atualizar_base(anos: Union[List[int], int],
+                   meses: Union[List[int], int],
+                   diretorio: str,
+                   proxy: Optional[Dict[str, str]] = None,
+                   max_workers: int = 1) -> List[Tuple[int, int]]:
+    '''Mantém uma base local dos informes diários em parquet, particionada por ano e mês
+    (diretorio/ano=2021/mes=01/informe_diario.parquet), que pode ser lida com fundosbr(..., diretorio_base=diretorio).
+    Só são baixados e gravados os meses que ainda não estão na base ou que foram alterados na CVM desde a última
+    sincronização (ETag/Last-Modified), além das partições gravadas sem a coluna ID_SUBCLASSE. Meses fora da janela
+    de 12 meses reprocessada pela CVM não são consultados novamente.
+    Retorna a lista de (ano, mês) gravados.'''
+    start = time.time()
+    os.makedirs(diretorio, exist_ok=True)
+    sincronizacao = _ler_sincronizacao(diretorio)
+    def _sincronizar_grupo(grupo):
+        ano, meses_do_arquivo = grupo
+        def _atualizada(mes):
+            caminho = _caminho_particao(diretorio, ano, mes)
+            return os.path.exists(caminho) and not _particao_sem_subclasse(caminho)
+        pendentes = [mes for mes in meses_do_arquivo if not (_atualizada(mes) and _mes_fechado(ano, 12 if ano < 2021 else mes))]
+        if not pendentes:
+            return []
+        with _arquivo_baixado(_url_dados_diarios(ano, pendentes[0]), proxy,
+                              _revalidar_dados_diarios(ano, pendentes[0])) as (status, arquivo_zip, versao):
+            _verificar_status(status)
+            alterados = [mes for mes in pendentes if not _atualizada(mes) or not any(versao.values()) or sincronizacao.get(f"{ano}-{mes:02d}") != versao]
+            if not alterados:
+                return []
+            informes = _ler_dados_diarios_do_arquivo(ano, alterados, proxy, arquivo_zip=arquivo_zip)
+        for mes, informe in zip(alterados, informes):
+            caminho = _caminho_particao(diretorio, ano, mes)
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            informe.write_parquet(caminho + ".tmp")
+            os.replace(caminho + ".tmp", caminho)
+        return [(ano, mes, versao) for mes in alterados]
+    atualizados = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for gravados in executor.map(_sincronizar_grupo, _agrupar_por_arquivo(_periodos(anos, meses))):
+            for ano, mes, versao in gravados:
+                sincronizacao[f"{ano}-{mes:02d}"] = versao
+                atualizados.append((ano, mes))
+    _salvar_sincronizacao(diretorio, sincronizacao)
+    print(f"Base local atualizada em {round((time.time()-start)/60,2)} minutos ({len(atualizados)} meses gravados)")
+    return atualizados
+
+def _url_fip(ano: int) -> str:
+    return "http://dados.cvm.gov.br/dados/FIP/DOC/INF_TRIMESTRAL/DADOS/inf_trimestral_fip_{:02d}.csv".format(ano)
+
+def _ler_fip(texto: str) -> pd.DataFrame:
+    lines = [i.strip().split(";") for i in texto.split("\n")]
+    return pd.DataFrame(lines[1:], columns=lines[0])
+
+def _ler_fip_do_arquivo(caminho: str) -> pd.DataFrame:
+    with open(caminho, "r", encoding="ISO-8859-1", newline="") as f:
+        return _ler_fip(f.read())
+
+def _url_fidc(ano: int, mes: int) -> str:
+    return "http://dados.cvm.gov.br/dados/FIDC/DOC/INF_MENSAL/DADOS/inf_mensal_fidc_{:02d}{:02d}.zip".format(ano, mes)
+
+def _arquivo_fidc(ano: int, mes: int, tabela: str = 'X', subtabela: int = 3) -> str:
+    if tabela.upper()=='X':
+        return f"inf_mensal_fidc_tab_{tabela}_{subtabela}_{ano:02d}{mes:02d}.csv"
+    return f"inf_mensal_fidc_tab_{tabela}_{ano:02d}{mes:02d}.csv"
 
 def get_fip(ano: int, 
             proxy: Union[Dict[str, str], None] = None) -> pd.DataFrame:
     start = time.time()
-    url = "http://dados.cvm.gov.br/dados/FIP/DOC/INF_TRIMESTRAL/DADOS/inf_trimestral_fip_{:02d}.csv".format(ano)
-    if proxy:
-        try:
-            dados_cvm = requests.get(url, proxies=proxy, verify=False)
-        except AttributeError:
-            raise ValueError("Necessário informar proxy correta.")
-    else:
-        dados_cvm = requests.get(url)
-    if str(dados_cvm) == '<Response [404]>':
-        raise ValueError("Não há dados para esta data. Response [404]")
-    lines = [i.strip().split(";") for i in dados_cvm.text.split("\n")]
+    url = _url_fip(ano)
+    with _arquivo_baixado(url, proxy=proxy, erro_proxy=True) as (status, caminho, _):
+        fip = _ler_fip_do_arquivo(_caminho_informe_estruturado(status, caminho))
     end = time.time()
     print(f"Finalizado em {round((end-start)/60,2)} minutos")
-    return pd.DataFrame(lines[1:], columns=lines[0])
+    return fip
 
 def get_fidc(ano: int, 
              mes: int,
@@ -215,24 +825,9 @@ def get_fidc(ano: int,
     Para demais tabelas, consultar site da CVM.
     '''
     start = time.time()
-    url = "http://dados.cvm.gov.br/dados/FIDC/DOC/INF_MENSAL/DADOS/inf_mensal_fidc_{:02d}{:02d}.zip".format(ano, mes)
-    if proxy:
-        try:
-            dados_cvm = requests.get(url, proxies=proxy, verify=False)
-        except AttributeError:
-            raise ValueError("Necessário informar proxy correta.")
-    else:
-        dados_cvm = requests.get(url)
-    if str(dados_cvm) == '<Response [404]>':
-        raise ValueError("Não há dados para esta data. Response [404]")
-    if tabela.upper()=='X':
-        arquivo = f"inf_mensal_fidc_tab_{tabela}_{subtabela}_{ano:02d}{mes:02d}.csv"
-    else:
-        arquivo = f"inf_mensal_fidc_tab_{tabela}_{ano:02d}{mes:02d}.csv"
-    zf = zipfile.ZipFile(io.BytesIO(dados_cvm.content))
-    zf = zf.open(arquivo)
-    lines = zf.readlines()
-    lines = [i.strip().decode("ISO-8859-1").split(";") for i in lines]
+    url = _url_fidc(ano, mes)
+    with _arquivo_baixado(url, proxy=proxy, erro_proxy=True) as (status, caminho, _):
+        fidc = _ler_zip_files(_caminho_informe_estruturado(status, caminho), _arquivo_fidc(ano, mes, tabela, subtabela))
     end = time.time()
     print(f"Finalizado em {round((end-start)/60,2)} minutos")
-    return pd.DataFrame(lines[1:], columns=lines[0])
\ No newline at end of file
+    return fidc.to_pandas()
\ No newline at end of file
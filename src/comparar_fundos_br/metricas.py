@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Rafael
+"""
+from typing import Dict, Optional, Tuple, Union
+import numpy as np
+import pandas as pd
+import polars as pl
+from comparar_fundos_br.fundosbr import monta_serie_temporal
+
+_DIAS_UTEIS_ANO = 252
+
+#fundos processados por vez, para limitar as matrizes intermediárias (datas x fundos) em memória
+_TAMANHO_BLOCO_FUNDOS = 512
+
+_ChaveMetrica = Union[str, Tuple[str, int]]
+
+def _cotas_por_data(cotas_diarias: Union[pd.DataFrame, pl.DataFrame, pl.LazyFrame],
+                    coluna_fundo: str) -> pd.DataFrame:
+    '''Cotas em formato largo (datas x fundos). O formato longo de fundosbr é pivotado uma única vez.'''
+    if isinstance(cotas_diarias, (pl.DataFrame, pl.LazyFrame)):
+        return monta_serie_temporal(cotas_diarias, colunas=coluna_fundo, valores="VL_QUOTA",
+                                    output_format="pandas", dtype=pl.Float64)
+    return cotas_diarias.sort_index()
+
+def _cotas_preenchidas(cotas: pd.DataFrame) -> np.ndarray:
+    '''Matriz de cotas com as lacunas preenchidas pelo último valor, apenas dentro do histórico de cada fundo:
+    as datas após a última cota de um fundo (ex.: fundo encerrado) continuam nulas.'''
+    valores = cotas.to_numpy(dtype=np.float64)
+    fim = valores.shape[0] - (~np.isnan(valores))[::-1].argmax(axis=0)
+    preenchidas = cotas.ffill().to_numpy(dtype=np.float64)
+    preenchidas[np.arange(valores.shape[0])[:, None] >= fim] = np.nan
+    return preenchidas
+
+def _retornos_referencia(referencia: Union[pd.DataFrame, pd.Series], indice: pd.Index) -> pd.DataFrame:
+    '''Retornos diários de CDI/benchmarks nas datas dos fundos. Aceita a saída de get_cdi ou get_benchmarks
+    (colunas "Retorno <nome>") ou séries de retornos diários. Os retornos são acumulados em um índice,
+    levado às datas dos fundos pelo último valor conhecido, para que calendários diferentes (ex.: SP500)
+    não percam os retornos dos dias sem pregão em comum.'''
+    if isinstance(referencia, pd.Series):
+        referencia = referencia.to_frame()
+    colunas = [x for x in referencia.columns
+               if str(x).startswith('Retorno ') and not str(x).startswith('Retorno Acumulado ')]
+    if colunas:
+        retornos = referencia[colunas].rename(columns=lambda x: x[len('Retorno '):])
+    else:
+        retornos = referencia
+    retornos = retornos.sort_index().astype(np.float64)
+    #o índice começa em 1 na data anterior ao primeiro retorno (o nulo inicial de pct_change)
+    com_retorno = retornos.notna().cummax()
+    indices = (1 + retornos.fillna(0)).cumprod().where(com_retorno | com_retorno.shift(-1, fill_value=False))
+    indices = indices.reindex(indices.index.union(indice)).ffill().reindex(indice)
+    return indices / indices.shift(1) - 1
+
+def _media_desvio(x: np.ndarray, validos: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''Número de observações, média e desvio padrão amostral de cada coluna considerando apenas as linhas válidas.'''
+    n = validos.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        media = np.where(validos, x, 0).sum(axis=0) / n
+        desvio = np.where(n > 1, np.sqrt(np.where(validos, (x - media)**2, 0).sum(axis=0) / np.maximum(n - 1, 1)), np.nan)
+    return n, media, desvio
+
+def _duracao_maxima(abaixo: np.ndarray) -> np.ndarray:
+    '''Maior sequência de linhas consecutivas verdadeiras em cada coluna.'''
+    linhas = np.arange(abaixo.shape[0])[:, None]
+    ultimo_topo = np.maximum.accumulate(np.where(abaixo, -1, linhas), axis=0)
+    return np.where(abaixo, linhas - ultimo_topo, 0).max(axis=0, initial=0)
+
+def _drawdown(cotas: np.ndarray) -> np.ndarray:
+    '''Queda de cada cota em relação ao maior valor anterior; nulo antes do início da série.
+    As cotas devem vir de _cotas_preenchidas.'''
+    with np.errstate(invalid="ignore"):
+        return cotas / np.fmax.accumulate(cotas, axis=0) - 1
+
+def _metricas_bloco(cotas: np.ndarray, cdi: Optional[np.ndarray],
+                    benchs: np.ndarray) -> Dict[_ChaveMetrica, np.ndarray]:
+    '''Métricas de um bloco de fundos (colunas de _cotas_preenchidas) em uma passada vetorizada.
+    Cada coluna usa apenas o seu próprio histórico; nas métricas contra CDI e benchmarks, apenas as datas em que
+    fundo e referência têm retorno.'''
+    fator_anual = np.sqrt(_DIAS_UTEIS_ANO)
+    com_valor = ~np.isnan(cotas)
+    inicio = com_valor.argmax(axis=0)
+    T = com_valor.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        retornos = np.full(cotas.shape, np.nan)
+        retornos[1:] = cotas[1:] / cotas[:-1] - 1
+        primeira = cotas[inicio, np.arange(cotas.shape[1])]
+        ultima = cotas[inicio + T - 1, np.arange(cotas.shape[1])]
+        resultado: Dict[_ChaveMetrica, np.ndarray] = {"rentabilidade": (ultima / primeira)**(_DIAS_UTEIS_ANO / T) - 1}
+    validos = ~np.isnan(retornos)
+    _, _, desvio = _media_desvio(retornos, validos)
+    resultado["volatilidade"] = desvio * fator_anual
+    drawdown = _drawdown(cotas)
+    with np.errstate(invalid="ignore"):
+        resultado["max_drawdown"] = np.where(T > 0, np.fmin.reduce(drawdown, axis=0), np.nan)
+        resultado["duracao_max_drawdown"] = _duracao_maxima(drawdown < 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        resultado["calmar"] = resultado["rentabilidade"] / -resultado["max_drawdown"]
+
+    excesso = retornos
+    if cdi is not None:
+        validos_cdi = validos & ~np.isnan(cdi)[:, None]
+        excesso = retornos - cdi[:, None]
+        n, media, desvio = _media_desvio(excesso, validos_cdi)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            resultado["sharpe"] = media / desvio * fator_anual
+            desvio_negativo = np.sqrt(np.where(validos_cdi, np.minimum(excesso, 0)**2, 0).sum(axis=0) / n)
+            resultado["sortino"] = media / desvio_negativo * fator_anual
+
+    for j in range(benchs.shape[1]):
+        bench = benchs[:, j]
+        validos_bench = validos & ~np.isnan(bench)[:, None]
+        if cdi is not None:
+            validos_bench &= ~np.isnan(cdi)[:, None]
+            excesso_bench = bench - cdi
+        else:
+            excesso_bench = bench
+        n, media_fundo, _ = _media_desvio(excesso, validos_bench)
+        _, media_bench, desvio_bench = _media_desvio(np.broadcast_to(excesso_bench[:, None], excesso.shape), validos_bench)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            covariancia = (np.where(validos_bench, (excesso - media_fundo) * (excesso_bench[:, None] - media_bench), 0)
+                           .sum(axis=0) / (n - 1))
+            beta = covariancia / desvio_bench**2
+        _, media_ativo, desvio_ativo = _media_desvio(retornos - bench[:, None], validos & ~np.isnan(bench)[:, None])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            resultado[("beta", j)] = beta
+            resultado[("alfa", j)] = (media_fundo - beta * media_bench) * _DIAS_UTEIS_ANO
+            resultado[("tracking_error", j)] = desvio_ativo * fator_anual
+            resultado[("information_ratio", j)] = media_ativo * _DIAS_UTEIS_ANO / (desvio_ativo * fator_anual)
+    return resultado
+
+def calcula_drawdown(cotas_diarias: Union[pd.DataFrame, pl.DataFrame, pl.LazyFrame],
+                     coluna_fundo: str = "CNPJ_FUNDO") -> pd.DataFrame:
+    '''Função que calcula o drawdown diário dos fundos, ou seja, a queda da cota em relação ao maior valor anterior.
+    Parâmetros:
+    -cotas_diarias (dataframe): cotas diárias, com uma coluna por fundo e as datas no índice. Também aceita
+    o formato longo de fundosbr(output_format='polars'), com as colunas DT_COMPTC, VL_QUOTA e coluna_fundo;
+    -coluna_fundo (str): coluna que identifica o fundo no formato longo.
+    Retorno:
+    -drawdown (dataframe): drawdown diário de cada fundo, nulo antes do início da sua série'''
+    cotas = _cotas_por_data(cotas_diarias, coluna_fundo)
+    return pd.DataFrame(_drawdown(_cotas_preenchidas(cotas)), index=cotas.index, columns=cotas.columns)
+
+def calcula_metricas_desempenho(
+                                cotas_diarias: Union[pd.DataFrame, pl.DataFrame, pl.LazyFrame],
+                                cdi: Optional[Union[pd.DataFrame, pd.Series]] = None,
+                                benchmarks: Optional[Union[pd.DataFrame, pd.Series]] = None,
+                                coluna_fundo: str = "CNPJ_FUNDO",
+                                ) -> pd.DataFrame:
+    '''Função que calcula as métricas de desempenho de muitos fundos de uma só vez, sem laços por fundo.
+    Cada fundo usa apenas o seu próprio histórico: as datas anteriores ao início (ou sem valor) de um fundo não afetam os demais.
+    Os retornos diários são calculados como em calcula_risco_retorno_fundos (lacunas preenchidas pelo último valor)
+    e anualizados com 252 dias úteis.
+    Parâmetros:
+    -cotas_diarias (dataframe): cotas diárias, com uma coluna por fundo e as datas no índice. Também aceita
+    o formato longo de fundosbr(output_format='polars'), com as colunas DT_COMPTC, VL_QUOTA e coluna_fundo;
+    -cdi (dataframe): saída de get_cdi (ou série de retornos diários), usada como taxa livre de risco no Sharpe,
+    no Sortino e no alfa (opcional);
+    -benchmarks (dataframe): saída de get_benchmarks com um ou mais benchmarks (ou séries de retornos diários) (opcional);
+    -coluna_fundo (str): coluna que identifica o fundo no formato longo.
+    Retorno:
+    -metricas (dataframe): uma linha por fundo com as colunas
+        rentabilidade e volatilidade anualizadas;
+        max_drawdown: maior queda em relação ao topo anterior;
+        duracao_max_drawdown: maior período, em dias com cota, abaixo do topo anterior;
+        calmar: rentabilidade anualizada dividida pelo max_drawdown;
+        sharpe e sortino: retorno em excesso ao CDI sobre o desvio padrão (total e negativo), anualizados, se informado o cdi;
+        para cada benchmark: beta, alfa anualizado (em excesso ao CDI, se informado), tracking_error e information_ratio,
+        com o nome do benchmark (ex.: "beta IBOV")'''
+    cotas = _cotas_por_data(cotas_diarias, coluna_fundo)
+    valores = _cotas_preenchidas(cotas)
+    retornos_cdi = None
+    if cdi is not None:
+        retornos_cdi = _retornos_referencia(cdi, cotas.index).iloc[:, 0].to_numpy(dtype=np.float64)
+    if benchmarks is not None:
+        retornos_benchs = _retornos_referencia(benchmarks, cotas.index)
+        nomes_benchs = [str(x) for x in retornos_benchs.columns]
+        retornos_benchs = retornos_benchs.to_numpy(dtype=np.float64)
+    else:
+        nomes_benchs = []
+        retornos_benchs = np.empty((len(cotas.index), 0))
+
+    colunas: Dict[_ChaveMetrica, np.ndarray] = {}
+    for inicio in range(0, valores.shape[1], _TAMANHO_BLOCO_FUNDOS):
+        bloco = slice(inicio, inicio + _TAMANHO_BLOCO_FUNDOS)
+        for chave, metrica in _metricas_bloco(valores[:, bloco], retornos_cdi, retornos_benchs).items():
+            colunas.setdefault(chave, np.empty(valores.shape[1]))[bloco] = metrica
+
+    metricas = pd.DataFrame({(f"{chave[0]} {nomes_benchs[chave[1]]}" if isinstance(chave, tuple) else chave): valores_metrica
+                             for chave, valores_metrica in colunas.items()},
+                            index=cotas.columns)
+    if "duracao_max_drawdown" in metricas:
+        metricas["duracao_max_drawdown"] = metricas["duracao_max_drawdown"].astype(np.int64)
+    metricas.index.name = None
+    return metricas.sort_values("rentabilidade", ascending=False)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Rafael
+"""
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+#os valores têm tipos diferentes por chave: inteiros, fator em segundos, timeout (float ou tupla) e backend (função)
+_CONFIG_TRANSPORTE: Dict[str, Any] = {
+    "tentativas": 3,
+    "fator_espera": 0.5,
+    "timeout": (10, 120),
+    "conexoes": 32,
+    "backend": None,
+}
+
+_STATUS_REPETIR = (429, 500, 502, 503, 504)
+
+_sessao_compartilhada: Optional[requests.Session] = None
+_trava_sessao = threading.Lock()
+
+def configurar_transporte(tentativas: Optional[int] = None,
+                          fator_espera: Optional[float] = None,
+                          timeout: Optional[Union[float, Tuple[float, float]]] = None,
+                          conexoes: Optional[int] = None,
+                          backend: Union[Callable[..., requests.Response], bool, None] = None,
+                          ) -> Dict[str, Any]:
+    '''Configura as requisições HTTP feitas pela biblioteca (CVM, ANBIMA, BACEN).
+    Parâmetros:
+    -tentativas (int): número de novas tentativas em falhas de conexão e respostas 429/5xx;
+    -fator_espera (float): fator da espera exponencial entre tentativas, em segundos;
+    -timeout (float ou tupla): tempo máximo de conexão e de leitura, em segundos;
+    -conexoes (int): conexões mantidas abertas por servidor;
+    -backend (função): substitui a sessão HTTP. Recebe (url, proxy, cabecalhos, timeout, stream) e retorna um
+    requests.Response; útil para testes com um servidor falso. Informe False para voltar à sessão padrão.
+    Retorna a configuração vigente.'''
+    global _sessao_compartilhada
+    for chave, valor in (("tentativas", tentativas), ("fator_espera", fator_espera),
+                         ("timeout", timeout), ("conexoes", conexoes)):
+        if valor is not None:
+            _CONFIG_TRANSPORTE[chave] = valor
+    if backend is not None:
+        _CONFIG_TRANSPORTE["backend"] = backend or None
+    with _trava_sessao:
+        _sessao_compartilhada = None
+    return dict(_CONFIG_TRANSPORTE)
+
+def _criar_sessao() -> requests.Session:
+    repetir = Retry(total=int(_CONFIG_TRANSPORTE["tentativas"]),
+                    backoff_factor=float(_CONFIG_TRANSPORTE["fator_espera"]),
+                    status_forcelist=_STATUS_REPETIR,
+                    allowed_methods=["GET"],
+                    raise_on_status=False)
+    adaptador = HTTPAdapter(max_retries=repetir,
+                            pool_connections=int(_CONFIG_TRANSPORTE["conexoes"]),
+                            pool_maxsize=int(_CONFIG_TRANSPORTE["conexoes"]))
+    sessao = requests.Session()
+    sessao.mount("http://", adaptador)
+    sessao.mount("https://", adaptador)
+    return sessao
+
+def _sessao() -> requests.Session:
+    global _sessao_compartilhada
+    with _trava_sessao:
+        if _sessao_compartilhada is None:
+            _sessao_compartilhada = _criar_sessao()
+        return _sessao_compartilhada
+
+def _get_sessao(url: str, proxy: Optional[Dict[str, str]] = None,
+                cabecalhos: Optional[Dict[str, str]] = None,
+                timeout: Optional[Union[float, Tuple[float, float]]] = None,
+                stream: bool = False) -> requests.Response:
+    if proxy:
+        return _sessao().get(url, proxies=proxy, verify=False, headers=cabecalhos, timeout=timeout, stream=stream)
+    return _sessao().get(url, headers=cabecalhos, timeout=timeout, stream=stream)
+
+def _get(url: str, proxy: Optional[Dict[str, str]] = None,
+         cabecalhos: Optional[Dict[str, str]] = None,
+         stream: bool = False) -> requests.Response:
+    '''GET usado por todos os módulos: sessão compartilhada (keep-alive), novas tentativas com espera exponencial
+    e timeout. Com proxy, a verificação do certificado é desativada, como nas versões anteriores.'''
+    backend = _CONFIG_TRANSPORTE["backend"] or _get_sessao
+    return backend(url, proxy, cabecalhos, _CONFIG_TRANSPORTE["timeout"], stream)
@@ -0,0 +1,121 @@
+import io
+import os
+import sys
+import zipfile
+from datetime import date, timedelta
+
+import pytest
+import requests
+
+#permite rodar os testes sem instalar o pacote (equivalente a PYTHONPATH=src)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from comparar_fundos_br.cache import configurar_cache
+from comparar_fundos_br.transporte import configurar_transporte
+
+URL_CVM = "http://dados.cvm.gov.br/dados/"
+
+COLUNAS_INFORME = "TP_FUNDO_CLASSE;CNPJ_FUNDO_CLASSE;ID_SUBCLASSE;DT_COMPTC;VL_TOTAL;VL_QUOTA;VL_PATRIM_LIQ;CAPTC_DIA;RESG_DIA;NR_COTST"
+COLUNAS_INFORME_ANTIGO = "TP_FUNDO;CNPJ_FUNDO;DT_COMPTC;VL_TOTAL;VL_QUOTA;VL_PATRIM_LIQ;CAPTC_DIA;RESG_DIA;NR_COTST"
+
+def cnpj_teste(i):
+    return f"{i:02d}.{i:03d}.{i:03d}/0001-{i:02d}"
+
+def linhas_informe(ano, mes, num_fundos=3, novo=True):
+    '''Linhas do informe diário de um mês: uma por fundo em cada dia útil, com cota crescente.'''
+    linhas = []
+    dia = date(ano, mes, 1)
+    while dia.month == mes:
+        if dia.weekday() < 5:
+            for i in range(1, num_fundos + 1):
+                cota = 1 + (dia - date(2000, 1, 1)).days * 0.0003 * i
+                valores = ["FI", cnpj_teste(i)] + ([""] if novo else []) + \
+                          [dia.isoformat(), "1000.00", f"{cota:.12f}", f"{1e6 * i:.2f}", "0.00", "0.00", str(10 * i)]
+                linhas.append(";".join(valores))
+        dia += timedelta(days=1)
+    return linhas
+
+def csv_texto(cabecalho, linhas):
+    return ("\r\n".join([cabecalho] + linhas) + "\r\n").encode("latin1")
+
+def zip_arquivos(membros):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for nome, conteudo in membros.items():
+            zf.writestr(nome, conteudo)
+    return buffer.getvalue()
+
+class CVMFalsa:
+    '''Servidor falso para configurar_transporte(backend=...). Responde aos arquivos registrados (nome do arquivo
+    na url -> conteúdo), com 304 quando o ETag enviado confere e com 404 para os demais. Guarda as urls pedidas
+    em chamadas e os status devolvidos em respostas.'''
+    def __init__(self):
+        self.arquivos = {}
+        self.etags = {}
+        self.chamadas = []
+        self.respostas = []
+
+    def registrar(self, nome, conteudo, etag='"v1"'):
+        self.arquivos[nome] = conteudo
+        self.etags[nome] = etag
+
+    def registrar_informe(self, ano, mes, num_fundos=3, etag='"v1"'):
+        '''Informe diário mensal (a partir de 2021) no formato atual da CVM.'''
+        nome = f"inf_diario_fi_{ano}{mes:02d}"
+        self.registrar(nome + ".zip", zip_arquivos({nome + ".csv": csv_texto(COLUNAS_INFORME,
+                                                                             linhas_informe(ano, mes, num_fundos))}), etag)
+
+    def registrar_informe_anual(self, ano, num_fundos=3, etag='"v1"'):
+        '''Zip anual da pasta HIST: até 2004 um único csv com o ano todo, depois um csv por mês.'''
+        if ano <= 2004:
+            linhas = [x for mes in range(1, 13) for x in linhas_informe(ano, mes, num_fundos, novo=False)]
+            membros = {f"inf_diario_fi_{ano}.csv": csv_texto(COLUNAS_INFORME_ANTIGO, linhas)}
+        else:
+            membros = {f"inf_diario_fi_{ano}{mes:02d}.csv": csv_texto(COLUNAS_INFORME_ANTIGO,
+                                                                      linhas_informe(ano, mes, num_fundos, novo=False))
+                       for mes in range(1, 13)}
+        self.registrar(f"inf_diario_fi_{ano}.zip", zip_arquivos(membros), etag)
+
+    def registrar_cadastro(self, num_fundos=3, etag='"v1"'):
+        '''Zips do cadastro (cad_fi_hist e registro_fundo_classe) com num_fundos fundos em funcionamento normal.'''
+        fundos = range(1, num_fundos + 1)
+        classes = csv_texto("CNPJ_FUNDO;DT_REG;DT_INI_CLASSE;DT_FIM_CLASSE;CLASSE",
+                            [f"{cnpj_teste(i)};2020-01-01;2020-01-01;2024-01-01;Ações" for i in fundos])
+        registro_classe = csv_texto("ID_Registro_Fundo;ID_Registro_Classe;CNPJ_Classe;Denominacao_Social;Situacao",
+                                    [f"{i};{i};{cnpj_teste(i)};Fundo {i};Em Funcionamento Normal" for i in fundos])
+        registro_fundo = csv_texto("ID_Registro_Fundo;CNPJ_Fundo;Tipo_Fundo;Denominacao_Social;Situacao;Data_Adaptacao_RCVM175",
+                                   [f"{i};{cnpj_teste(i)};FIF;Fundo {i};Em Funcionamento Normal;2024-01-01" for i in fundos])
+        self.registrar("cad_fi_hist.zip", zip_arquivos({"cad_fi_hist_classe.csv": classes}), etag)
+        self.registrar("registro_fundo_classe.zip", zip_arquivos({"registro_classe.csv": registro_classe,
+                                                                  "registro_fundo.csv": registro_fundo}), etag)
+
+    def __call__(self, url, proxy, cabecalhos, timeout, stream):
+        self.chamadas.append(url)
+        nome = url.rsplit("/", 1)[-1]
+        resposta = requests.Response()
+        resposta.url = url
+        resposta._content = b""
+        if nome not in self.arquivos:
+            resposta.status_code = 404
+        elif (cabecalhos or {}).get("If-None-Match") == self.etags[nome]:
+            resposta.status_code = 304
+        else:
+            resposta.status_code = 200
+            resposta.headers["ETag"] = self.etags[nome]
+            resposta._content = self.arquivos[nome]
+        self.respostas.append(resposta.status_code)
+        return resposta
+
+@pytest.fixture
+def cache_temporario(tmp_path):
+    anterior = configurar_cache()
+    configurar_cache(diretorio=str(tmp_path / "cache"), ativo=True)
+    yield tmp_path / "cache"
+    configurar_cache(diretorio=anterior["diretorio"], tamanho_maximo=anterior["tamanho_maximo"], ativo=anterior["ativo"])
+
+@pytest.fixture
+def cvm(cache_temporario):
+    servidor = CVMFalsa()
+    configurar_transporte(backend=servidor)
+    yield servidor
+    configurar_transporte(backend=False)
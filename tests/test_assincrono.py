@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+
+import pandas as pd
+import pytest
+from polars.testing import assert_frame_equal
+from comparar_fundos_br.assincrono import (_LimitePorServidor, configurar_assincrono, fundosbr_async, get_fidc_async,
+                                           get_fip_async)
+from comparar_fundos_br.fundosbr import fundosbr, get_fidc, get_fip
+from comparar_fundos_br.transporte import configurar_transporte
+from conftest import cnpj_teste, csv_texto, zip_arquivos
+
+@pytest.fixture
+def assincrono():
+    anterior = configurar_assincrono()
+    yield
+    configurar_assincrono(**anterior)
+
+def test_fundosbr_async_igual_ao_sincrono(cvm, assincrono):
+    configurar_assincrono(intervalo_minimo=0)
+    cvm.registrar_informe_anual(2003)
+    for mes in (1, 2, 3):
+        cvm.registrar_informe(2021, mes)
+    for parametros in ({}, {"cnpj": [cnpj_teste(2)], "chave_cnpj": True}, {"compactar": True}):
+        esperado = fundosbr([2003, 2021], [1, 2, 3], output_format='polars', **parametros)
+        obtido = asyncio.run(fundosbr_async([2003, 2021], [1, 2, 3], output_format='polars', **parametros))
+        assert_frame_equal(obtido, esperado)
+
+def test_fip_e_fidc_async_iguais_aos_sincronos(cvm, assincrono):
+    configurar_assincrono(intervalo_minimo=0)
+    cvm.registrar("inf_trimestral_fip_2022.csv", csv_texto("CNPJ_FUNDO;DENOM_SOCIAL", [f"{cnpj_teste(1)};FIP Ação"]))
+    for mes in (1, 2):
+        csv = csv_texto("CNPJ_FUNDO_CLASSE;TAB_X_CLASSE_SERIE;TAB_X_VL_RENTAB_MES",
+                        [f"{cnpj_teste(i)};Sênior;{i * mes / 10}" for i in (1, 2)])
+        cvm.registrar(f"inf_mensal_fidc_2022{mes:02d}.zip", zip_arquivos({f"inf_mensal_fidc_tab_X_3_2022{mes:02d}.csv": csv}))
+    pd.testing.assert_frame_equal(asyncio.run(get_fip_async(2022)), get_fip(2022))
+
+    async def meses():
+        return await asyncio.gather(get_fidc_async(2022, 1), get_fidc_async(2022, 2))
+
+    for obtido, mes in zip(asyncio.run(meses()), (1, 2)):
+        pd.testing.assert_frame_equal(obtido, get_fidc(2022, mes))
+
+def test_concorrencia_maxima(cvm, assincrono):
+    configurar_assincrono(max_concorrencia=2, intervalo_minimo=0)
+    for mes in range(1, 7):
+        cvm.registrar_informe(2021, mes, num_fundos=1)
+    trava = threading.Lock()
+    simultaneos = [0, 0]
+
+    def servidor_lento(*args):
+        with trava:
+            simultaneos[0] += 1
+            simultaneos[1] = max(simultaneos)
+        time.sleep(0.05)
+        with trava:
+            simultaneos[0] -= 1
+        return cvm(*args)
+
+    configurar_transporte(backend=servidor_lento)
+    informe = asyncio.run(fundosbr_async(2021, range(1, 7), output_format='polars'))
+    assert informe["DT_COMPTC"].dt.month().n_unique() == 6
+    assert simultaneos[1] == 2
+
+def test_intervalo_minimo_por_servidor():
+    async def inicios():
+        limite = _LimitePorServidor(0.05)
+        urls = ["http://dados.cvm.gov.br/a", "http://dados.cvm.gov.br/b", "http://dados.cvm.gov.br/c",
+                "https://www.anbima.com.br/d"]
+
+        async def inicio(url):
+            await limite.aguardar(url)
+            return time.monotonic()
+
+        comeco = time.monotonic()
+        return comeco, await asyncio.gather(*[inicio(url) for url in urls])
+
+    comeco, (a, b, c, outro_servidor) = asyncio.run(inicios())
+    assert b - a >= 0.045 and c - b >= 0.045
+    #outro servidor não espera a fila da CVM
+    assert outro_servidor - comeco < 0.045
+
+def test_erros_sao_propagados(cvm, assincrono):
+    configurar_assincrono(intervalo_minimo=0)
+    cvm.registrar_informe(2021, 1)
+    with pytest.raises(ValueError, match="Não foi possível baixar"):
+        asyncio.run(fundosbr_async(2021, [1, 2]))
+    with pytest.raises(ValueError, match="Não há dados para esta data"):
+        asyncio.run(get_fidc_async(2022, 6))
+    with pytest.raises(ValueError, match="Não há dados para esta data"):
+        asyncio.run(get_fip_async(2022))
@@ -0,0 +1,91 @@
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+from comparar_fundos_br.benchmarks import _serie_benchmark, get_benchmarks, get_indices_anbima, get_stocks
+
+DATAS = pd.bdate_range("2024-01-01", "2024-03-29")
+#preço bruto constante e um dividendo de 5% com data ex em 2024-03-01
+DATA_EX = pd.Timestamp("2024-03-01")
+
+def _fechamento_ajustado(data_ex_divulgada):
+    '''Preços como os da origem ajustada: os preços anteriores à data ex são reduzidos pelo dividendo,
+    mas só depois que a data ex já aconteceu.'''
+    precos = pd.Series(100.0, index=DATAS)
+    if data_ex_divulgada:
+        precos[precos.index < DATA_EX] *= 0.95
+        precos[precos.index >= DATA_EX] = 95.0
+    return precos
+
+def _fonte(data_ex_divulgada, chamadas):
+    def buscar(inicio, fim):
+        chamadas.append((inicio, fim))
+        precos = _fechamento_ajustado(data_ex_divulgada)
+        return precos[inicio:fim].to_frame("DIVO11")
+    return buscar
+
+def test_serie_ajustada_baixada_de_novo_apos_provento(cache_temporario):
+    chamadas = []
+    _serie_benchmark("DIVO11", "2024-01-01", "2024-02-15", _fonte(False, chamadas), ajustada=True)
+    serie = _serie_benchmark("DIVO11", "2024-01-01", "2024-03-29", _fonte(True, chamadas), ajustada=True)
+    #o trecho novo inclui a última data do cache; como o preço dela mudou, a série inteira é baixada de novo
+    assert chamadas[-1] == ("2024-01-01", "2024-03-29")
+    retornos = serie["DIVO11"].pct_change().dropna()
+    assert np.allclose(retornos, 0)
+
+def test_serie_ajustada_complementada_sem_provento(cache_temporario):
+    chamadas = []
+    _serie_benchmark("DIVO11", "2024-01-01", "2024-02-15", _fonte(True, chamadas), ajustada=True)
+    serie = _serie_benchmark("DIVO11", "2024-01-01", "2024-03-29", _fonte(True, chamadas), ajustada=True)
+    assert chamadas == [("2024-01-01", "2024-02-15"), ("2024-02-15", "2024-03-29")]
+    pd.testing.assert_series_equal(serie["DIVO11"], _fechamento_ajustado(True).rename("DIVO11"), check_freq=False)
+
+def test_get_stocks_com_fonte_substituta(cache_temporario):
+    chamadas = []
+    def fonte(tickers, inicio, fim):
+        chamadas.append((tuple(tickers), inicio, fim))
+        precos = {"VALE3.SA": _fechamento_ajustado(pd.Timestamp(fim) >= DATA_EX),
+                  "PETR4.SA": pd.Series(np.linspace(30, 40, len(DATAS)), index=DATAS)}
+        return pd.DataFrame({st: precos[st] for st in tickers})[inicio:fim]
+    get_stocks(["VALE3", "PETR4"], "2024-01-01", "2024-02-16", fonte_precos=fonte)
+    assert chamadas == [(("VALE3.SA", "PETR4.SA"), "2024-01-01", "2024-02-15")]
+    acoes = get_stocks(["VALE3", "PETR4"], "2024-01-01", "2024-03-30", fonte_precos=fonte)
+    #os dois tickers dividem o trecho novo; só VALE3, que teve provento, é baixada de novo por inteiro
+    assert chamadas[1:] == [(("VALE3.SA", "PETR4.SA"), "2024-02-15", "2024-03-29"),
+                            (("VALE3.SA",), "2024-01-01", "2024-03-29")]
+    assert list(acoes.columns[:2]) == ["VALE3.SA", "PETR4.SA"]
+    assert np.allclose(acoes["Retorno VALE3.SA"].dropna(), 0)
+    esperado = pd.Series(np.linspace(30, 40, len(DATAS)), index=DATAS)
+    assert np.allclose(acoes["Retorno Acumulado PETR4.SA"].iloc[-1], esperado.iloc[-1] / esperado.iloc[0] - 1)
+    #consulta dentro do intervalo já guardado não chama a fonte
+    get_stocks(["VALE3", "PETR4"], "2024-01-10", "2024-03-01", fonte_precos=fonte)
+    assert len(chamadas) == 3
+
+def test_indice_anbima_indisponivel(cvm):
+    with pytest.raises(requests.HTTPError):
+        get_indices_anbima("2024-01-01", "2024-02-01", "imas")
+    assert cvm.respostas == [404]
+
+def _guardar_no_cache(*nomes):
+    for i, nome in enumerate(nomes):
+        precos = pd.Series(np.linspace(100, 110 + i, len(DATAS)), index=DATAS).to_frame(nome)
+        _serie_benchmark(nome, "2024-01-01", "2024-03-29", lambda inicio, fim: precos[inicio:fim], ajustada=True)
+
+def test_get_benchmarks_em_cache_nao_importa_yfinance(cache_temporario, monkeypatch):
+    _guardar_no_cache("IBOV")
+    #com None em sys.modules, qualquer import de yfinance falha
+    monkeypatch.setitem(sys.modules, "yfinance", None)
+    ibov = get_benchmarks("2024-01-01", "2024-03-29", "ibov", proxy={"https": "http://proxy:3128"})
+    assert ibov.index[-1] == pd.Timestamp("2024-03-28")
+    assert np.isclose(ibov["Retorno Acumulado IBOV"].iloc[-1], ibov["IBOV"].iloc[-1] / 100 - 1)
+
+def test_get_benchmarks_parametro_obsoleto(cache_temporario):
+    _guardar_no_cache("IBOV", "DIVO11")
+    esperado = get_benchmarks("2024-01-01", "2024-03-29", ["ibov", "divo11"])
+    with pytest.warns(DeprecationWarning, match="benchmarks"):
+        obtido = get_benchmarks("2024-01-01", "2024-03-29", benchmarks=["ibov", "divo11"])
+    pd.testing.assert_frame_equal(obtido, esperado)
+    assert list(esperado.columns) == ["IBOV", "Retorno IBOV", "Retorno Acumulado IBOV",
+                                      "DIVO11", "Retorno DIVO11", "Retorno Acumulado DIVO11"]
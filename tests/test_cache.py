@@ -0,0 +1,89 @@
+import os
+import time
+from datetime import date
+
+import pytest
+from polars.testing import assert_frame_equal
+from comparar_fundos_br.cache import _baixar_arquivo, _descartar_arquivo, configurar_cache
+from comparar_fundos_br.fundosbr import fundosbr, get_cadastro_fundos, get_fidc, get_fip
+
+URL_ZIP = "http://dados.cvm.gov.br/dados/FI/DOC/INF_DIARIO/DADOS/inf_diario_fi_{}.zip"
+
+def test_entrada_em_uso_nao_e_removida(cvm):
+    for mes in (1, 2, 3):
+        cvm.registrar_informe(2025, mes)
+    configurar_cache(tamanho_maximo=1)
+    status, caminho, temporario, _ = _baixar_arquivo(URL_ZIP.format("202501"))
+    assert status == 200 and not temporario
+    #o segundo download estoura o tamanho máximo, mas o primeiro arquivo ainda está em uso
+    _, outro, _, _ = _baixar_arquivo(URL_ZIP.format("202502"))
+    assert os.path.exists(caminho)
+    _descartar_arquivo(outro, False)
+    _descartar_arquivo(caminho, False)
+    _, outro, _, _ = _baixar_arquivo(URL_ZIP.format("202503"))
+    _descartar_arquivo(outro, False)
+    assert not os.path.exists(caminho)
+
+def test_leituras_paralelas_com_cache_pequeno(cvm):
+    for mes in range(1, 13):
+        cvm.registrar_informe(2025, mes)
+    configurar_cache(tamanho_maximo=1)
+    for _ in range(5):
+        informe = fundosbr(2025, range(1, 13), max_workers=8, output_format='polars')
+        assert informe["DT_COMPTC"].dt.month().n_unique() == 12
+
+@pytest.mark.parametrize("ativo", [True, False])
+def test_informes_estruturados_sem_dados(cvm, ativo):
+    configurar_cache(ativo=ativo)
+    with pytest.raises(ValueError, match="Não há dados para esta data"):
+        get_fidc(2022, 6)
+    with pytest.raises(ValueError, match="Não há dados para esta data"):
+        get_fip(2022)
+
+def _mes_recente():
+    '''Mês dentro da janela de 12 meses que a CVM reprocessa, sempre revalidado no cache.'''
+    hoje = date.today()
+    indice = hoje.year * 12 + hoje.month - 1 - 2
+    return indice // 12, indice % 12 + 1
+
+def test_revalidacao_reaproveita_o_cache(cvm):
+    ano, mes = _mes_recente()
+    cvm.registrar_informe(ano, mes, num_fundos=2)
+    primeiro = fundosbr(ano, mes, output_format='polars')
+    #mesmo ETag: 304 e o arquivo do cache
+    assert_frame_equal(fundosbr(ano, mes, output_format='polars'), primeiro)
+    assert cvm.respostas == [200, 304]
+    #arquivo republicado pela CVM: novo download
+    cvm.registrar_informe(ano, mes, num_fundos=3, etag='"v2"')
+    assert fundosbr(ano, mes, output_format='polars')["CNPJ_FUNDO"].n_unique() == 3
+    assert cvm.respostas == [200, 304, 200]
+
+def test_mes_fechado_nao_e_revalidado(cvm):
+    cvm.registrar_informe(2021, 3)
+    primeiro = fundosbr(2021, 3, output_format='polars')
+    assert_frame_equal(fundosbr(2021, 3, output_format='polars'), primeiro)
+    assert cvm.respostas == [200]
+
+def test_snapshot_do_cadastro_dentro_da_validade(cvm, cache_temporario):
+    cvm.registrar_cadastro()
+    primeiro = get_cadastro_fundos(output_format='polars')
+    assert len(cvm.chamadas) == 2
+    assert_frame_equal(get_cadastro_fundos(output_format='polars', validade_cadastro=1), primeiro)
+    assert len(cvm.chamadas) == 2
+    #snapshot gravado há mais de validade_cadastro horas: o cadastro é montado de novo
+    snapshots = os.listdir(cache_temporario / "cadastro")
+    duas_horas_atras = time.time() - 2 * 3600
+    os.utime(cache_temporario / "cadastro" / snapshots[0], (duas_horas_atras, duas_horas_atras))
+    cvm.registrar_cadastro(num_fundos=4, etag='"v2"')
+    assert get_cadastro_fundos(output_format='polars', validade_cadastro=1).height == 4
+    assert len(cvm.chamadas) == 4
+
+def test_snapshots_antigos_do_cadastro_sao_removidos(cvm, cache_temporario):
+    cvm.registrar_cadastro()
+    pasta = cache_temporario / "cadastro"
+    pasta.mkdir(parents=True)
+    for dia in ("20240102", "20240103"):
+        (pasta / f"cadastro_{dia}.parquet").write_bytes(b"")
+        os.utime(pasta / f"cadastro_{dia}.parquet", (0, 0))
+    get_cadastro_fundos(output_format='polars')
+    assert os.listdir(pasta) == [f"cadastro_{date.today():%Y%m%d}.parquet"]
@@ -0,0 +1,192 @@
+import numpy as np
+import pandas as pd
+import polars as pl
+import pytest
+from comparar_fundos_br.comparador import (_matriz_janelas_moveis, calcula_rentabilidade_periodo,
+                                          calcula_retorno_janelas_moveis, calcula_retorno_multiplas_janelas,
+                                          calcula_risco_retorno_fundos, qto_supera_benchmark, supera_benchmark)
+
+def _cotas_com_lacunas():
+    rng = np.random.default_rng(0)
+    datas = pd.bdate_range("2024-01-01", periods=120, name="DT_COMPTC")
+    cotas = pd.DataFrame(np.cumprod(1 + rng.normal(0, 0.01, (120, 4)), axis=0), index=datas, columns=list("ABCD"))
+    cotas[rng.random((120, 4)) < 0.2] = np.nan
+    cotas.iloc[:10, 1] = np.nan
+    cotas.iloc[-15:, 2] = np.nan
+    return cotas
+
+def test_risco_retorno_formato_longo_igual_ao_largo():
+    largo = _cotas_com_lacunas()
+    longo = pl.from_pandas(largo.reset_index().melt(id_vars="DT_COMPTC", var_name="CNPJ_FUNDO", value_name="VL_QUOTA"))
+    esperado = calcula_risco_retorno_fundos(largo, saidas=["risco_retorno"])[0].sort_index()
+    for dados in (longo, longo.drop_nulls("VL_QUOTA")):
+        obtido = calcula_risco_retorno_fundos(dados, saidas=["risco_retorno"])[0].sort_index()
+        pd.testing.assert_frame_equal(obtido, esperado, check_exact=False, rtol=1e-10)
+
+def test_rentabilidade_por_ano_formato_longo_igual_ao_largo():
+    rng = np.random.default_rng(1)
+    datas = pd.bdate_range("2021-06-01", "2024-03-29", name="DT_COMPTC")
+    largo = pd.DataFrame(np.cumprod(1 + rng.normal(0.0003, 0.01, (len(datas), 4)), axis=0), index=datas, columns=list("ABCD"))
+    #B encerra antes da virada de 2022, C começa em 2023 e D não tem cotas em 2022
+    largo.loc["2022-09-01":, "B"] = np.nan
+    largo.loc[:"2022-12-31", "C"] = np.nan
+    largo.loc["2022", "D"] = np.nan
+    longo = pl.from_pandas(largo.reset_index().melt(id_vars="DT_COMPTC", var_name="CNPJ_FUNDO", value_name="VL_QUOTA"))
+    esperado = calcula_risco_retorno_fundos(largo, saidas=["rentabilidade_acumulada_por_ano"])[0]
+    assert esperado.loc["B", "2024"] == esperado.loc["B", "2022"]
+    for dados in (longo, longo.drop_nulls("VL_QUOTA")):
+        obtido = calcula_risco_retorno_fundos(dados, saidas=["rentabilidade_acumulada_por_ano"])[0].sort_index()
+        pd.testing.assert_frame_equal(obtido, esperado, check_exact=False, rtol=1e-10)
+
+#versões anteriores, fundo a fundo, usadas como referência para as versões vetorizadas
+def _supera_benchmark_laco(dados, benchmarks, HP, limit=0.6, janela_analise=252):
+    percentuais = pd.DataFrame()
+    lista_benchmarks = [x for x in benchmarks.columns if 'Retorno' not in x]
+    for fundo in dados.columns.tolist():
+        df1 = pd.DataFrame()
+        for bench in lista_benchmarks:
+            retorno = calcula_retorno_janelas_moveis(dados[[fundo]], HP, benchmarks[[bench]]).sort_index().dropna()
+            if retorno.empty: break
+            elif retorno.shape[0] < janela_analise: continue
+            eventos = (retorno[fundo] - retorno[bench])
+            percentual_sobre_bench = len(eventos[eventos>0])/len(eventos)
+            if percentual_sobre_bench >= limit:
+                df = pd.DataFrame([fundo, percentual_sobre_bench*100], index=["Fundo", f"Supera {bench} (%)"]).T.set_index("Fundo")
+                df1 = pd.concat([df1, df], axis=1)
+        percentuais = pd.concat([percentuais, df1], axis=0)
+    return percentuais[(percentuais>=limit*100)].dropna().sort_values(percentuais.columns.tolist(), ascending=False)
+
+def _qto_supera_benchmark_laco(dados, benchmarks, HP, corte_bench=100, bench_corte='CDI'):
+    percentuais = pd.DataFrame()
+    lista_benchmarks = [x for x in benchmarks.columns if 'Retorno' not in x]
+    for fundo in dados.columns.tolist():
+        df1 = pd.DataFrame()
+        for bench in lista_benchmarks:
+            retorno = calcula_retorno_janelas_moveis(dados[[fundo]], HP, benchmarks[[bench]]).sort_index().dropna()
+            if retorno.empty: break
+            eventos = (retorno[fundo] - retorno[bench])
+            df = pd.DataFrame([fundo, len(eventos[eventos>0])/len(eventos), len(eventos[eventos<=0])/len(eventos),
+                               retorno[fundo].mean()/retorno[bench].mean()],
+                              index=["Fundo", f"% de vezes acima {bench} (%)", f"% de vezes abaixo {bench} (%)",
+                                     f'% do {bench}, em média']).T.set_index("Fundo")
+            df1 = pd.concat([df1, df], axis=1)
+        percentuais = pd.concat([percentuais, df1], axis=0)
+    cols1 = [x for x in percentuais.columns if 'acima' not in x and 'abaixo' not in x]
+    percentuais = (percentuais.sort_values(cols1, ascending=False)*100).fillna(0)
+    return percentuais[percentuais[f'% do {bench_corte}, em média']>=corte_bench]
+
+def _rentabilidade_periodo_laco(dados_diarios, freq="M"):
+    if freq.lower()=="sem":
+        freq = "Q"
+        inicio = dados_diarios.resample(f"{freq}S").first()
+        fim = dados_diarios.resample(f"{freq}E").last()
+        inicio = inicio[inicio.index.month.isin([1,7])]
+        fim = fim[fim.index.month.isin([6,12])]
+    else:
+        inicio = dados_diarios.resample(f"{freq}S").first()
+        fim = dados_diarios.resample(f"{freq}E").last()
+    rentabilidade_periodo_total = pd.DataFrame()
+    for (init, end) in zip(inicio.index, fim.index):
+        df = dados_diarios[(dados_diarios.index>=init) & (dados_diarios.index<=end)].ffill().pct_change()
+        rentabilidade_periodo = ((1 + df).cumprod() - 1).tail(1)
+        rentabilidade_periodo.index = [end]
+        rentabilidade_periodo_total = pd.concat([rentabilidade_periodo_total, rentabilidade_periodo])
+    return rentabilidade_periodo_total.asfreq(f"{freq}E")
+
+def _fundos_e_benchmarks():
+    rng = np.random.default_rng(3)
+    datas = pd.bdate_range("2021-01-01", periods=700)
+    fundos = pd.DataFrame(np.cumprod(1 + rng.normal(0.0005, 0.008, (700, 5)), axis=0),
+                          index=datas, columns=[f"F{i}" for i in range(5)])
+    fundos.iloc[:400, 1] = np.nan
+    fundos.iloc[650:, 2] = np.nan
+    fundos.iloc[:, 4] = np.nan
+    fundos.iloc[:20, 4] = 1.0
+    benchmarks = pd.DataFrame({"CDI": np.cumprod(np.full(700, 1.0004)),
+                               "IBOV": np.cumprod(1 + rng.normal(0.0003, 0.012, 700))}, index=datas)
+    benchmarks["Retorno CDI"] = benchmarks["CDI"].pct_change()
+    return fundos, benchmarks
+
+def test_supera_benchmark_igual_ao_laco():
+    fundos, benchmarks = _fundos_e_benchmarks()
+    for limit, janela in ((0.6, 252), (0.3, 100)):
+        pd.testing.assert_frame_equal(supera_benchmark(fundos, benchmarks, 21, limit, janela),
+                                      _supera_benchmark_laco(fundos, benchmarks, 21, limit, janela),
+                                      check_dtype=False, check_index_type=False)
+
+def test_qto_supera_benchmark_igual_ao_laco():
+    fundos, benchmarks = _fundos_e_benchmarks()
+    for corte in (0, 100):
+        pd.testing.assert_frame_equal(qto_supera_benchmark(fundos, benchmarks, 21, corte),
+                                      _qto_supera_benchmark_laco(fundos, benchmarks, 21, corte),
+                                      check_dtype=False, check_index_type=False)
+
+def test_rentabilidade_periodo_igual_ao_laco():
+    fundos, _ = _fundos_e_benchmarks()
+    fundos.iloc[[30, 31, 250], 0] = np.nan
+    for freq in ("M", "Q", "sem", "Y"):
+        rentabilidade, esperado = calcula_rentabilidade_periodo(fundos, freq), _rentabilidade_periodo_laco(fundos, freq)
+        if freq == "sem":
+            #o laço descartava o semestre incompleto do fim da série; os demais períodos sempre o incluíram
+            parcial = fundos.loc["2023-07-01":].ffill()
+            assert rentabilidade.loc["2023-12-31"].to_numpy() == pytest.approx((parcial.iloc[-1] / parcial.iloc[0] - 1).to_numpy(),
+                                                                               nan_ok=True)
+            rentabilidade = rentabilidade.loc[esperado.index]
+        pd.testing.assert_frame_equal(rentabilidade, esperado, check_freq=False)
+
+def test_multiplas_janelas_sem_lacunas_igual_a_janela_unica():
+    fundos, benchmarks = _fundos_e_benchmarks()
+    fundos, benchmarks = fundos.iloc[:, [0, 3]], benchmarks[["CDI", "IBOV"]]
+    retornos = calcula_retorno_multiplas_janelas(fundos, [1, 21, 252], benchmarks)
+    assert list(retornos) == [1, 21, 252]
+    for HP, retorno in retornos.items():
+        pd.testing.assert_frame_equal(retorno, calcula_retorno_janelas_moveis(fundos, HP, benchmarks),
+                                      check_exact=False, rtol=1e-10, check_freq=False)
+
+def test_multiplas_janelas_usam_o_historico_de_cada_coluna():
+    cotas = _cotas_com_lacunas()
+    retornos = calcula_retorno_multiplas_janelas(cotas, [5, 21])
+    for HP, retorno in retornos.items():
+        assert retorno.index.equals(cotas.index[cotas.index.isin(retorno.index)])
+        for coluna in cotas.columns:
+            esperado = cotas[coluna].dropna().pct_change(HP).dropna()
+            pd.testing.assert_series_equal(retorno[coluna].dropna(), esperado, check_exact=False, rtol=1e-10,
+                                           check_freq=False)
+
+def test_multiplas_janelas_maiores_que_o_historico():
+    datas = pd.bdate_range("2024-01-01", periods=120, name="DT_COMPTC")
+    cotas = pd.DataFrame({"A": np.linspace(1, 2, 120), "B": np.linspace(1, 2, 120)}, index=datas)
+    cotas.iloc[:40, 1] = np.nan
+    retornos = calcula_retorno_multiplas_janelas(cotas, [100, len(cotas), len(cotas) + 10])
+    for HP in (len(cotas), len(cotas) + 10):
+        assert retornos[HP].empty
+        assert list(retornos[HP].columns) == ["A", "B"]
+    #B só tem 80 pregões: a janela de 100 não cabe no seu histórico, mas não trunca a coluna A
+    assert len(retornos[100]) == 20
+    assert retornos[100]["B"].isna().all()
+    pd.testing.assert_series_equal(retornos[100]["A"], cotas["A"].pct_change(100).dropna(), check_freq=False)
+
+def test_matriz_janelas_moveis_descarta_lacunas_por_par():
+    fundos, benchmarks = _fundos_e_benchmarks()
+    benchmarks = benchmarks[["CDI", "IBOV"]].copy()
+    benchmarks.iloc[100:130, 1] = np.nan
+    fundos.iloc[[5, 50, 500], 0] = np.nan
+    HP = 21
+    num_janelas, acima, abaixo, media_fundos, media_bench = _matriz_janelas_moveis(fundos, benchmarks, HP)
+    for i, fundo in enumerate(fundos.columns):
+        for j, bench in enumerate(benchmarks.columns):
+            par = pd.concat([fundos[fundo], benchmarks[bench]], axis=1).dropna()
+            retorno = calcula_retorno_janelas_moveis(par[[fundo]], HP, par[[bench]])
+            eventos = retorno[fundo] - retorno[bench]
+            assert num_janelas[i, j] == len(retorno)
+            assert acima[i, j] == (eventos > 0).sum()
+            assert abaixo[i, j] == (eventos <= 0).sum()
+            assert media_fundos[i, j] == pytest.approx(retorno[fundo].mean(), nan_ok=True)
+            assert media_bench[i, j] == pytest.approx(retorno[bench].mean(), nan_ok=True)
+
+def test_matriz_janelas_moveis_maior_que_o_historico():
+    fundos, benchmarks = _fundos_e_benchmarks()
+    num_janelas, acima, abaixo, media_fundos, _ = _matriz_janelas_moveis(fundos, benchmarks[["CDI"]], len(fundos))
+    assert num_janelas.shape == (fundos.shape[1], 1)
+    assert (num_janelas == 0).all() and (acima == 0).all() and (abaixo == 0).all()
+    assert np.isnan(media_fundos).all()
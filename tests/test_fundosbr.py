@@ -0,0 +1,252 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pytest
+from polars.testing import assert_frame_equal
+from comparar_fundos_br.fundosbr import (_caminho_particao, _formata_saida, _ler_zip_files, atualizar_base, expr_chave_cnpj,
+                                        expr_cnpj_valido, expr_pontua_cnpj, fundosbr, iter_informes, mesclar_bases,
+                                        monta_serie_temporal,                                         pontua_cnpj)
+from conftest import COLUNAS_INFORME, cnpj_teste, csv_texto, zip_arquivos
+
+def test_ler_zip_files_transcodifica_o_membro(tmp_path):
+    caminho = tmp_path / "cadastro.zip"
+    caminho.write_bytes(zip_arquivos({"cad.csv": "CNPJ;NOME\r\n1;Fundo Ação\r\n2;\r\n".encode("latin1")}))
+    assert _ler_zip_files(str(caminho), "cad.csv")["NOME"].to_list() == ["Fundo Ação", ""]
+
+def test_ler_zip_files_nao_descarta_bytes_finais(tmp_path):
+    #caractere multibyte incompleto no fim do arquivo: erro em vez de perda silenciosa
+    caminho = tmp_path / "cadastro.zip"
+    caminho.write_bytes(zip_arquivos({"cad.csv": "CNPJ;NOME\r\n1;Fundo Aç".encode("utf-8")[:-1]}))
+    with pytest.raises(UnicodeDecodeError):
+        _ler_zip_files(str(caminho), "cad.csv", encoding="utf-8")
+
+def test_lazy_igual_a_leitura_direta(cvm):
+    cvm.registrar_informe_anual(2003)
+    for mes in (1, 2):
+        cvm.registrar_informe(2021, mes)
+    cnpj = [cnpj_teste(2)]
+    direto = fundosbr([2003, 2021], [1, 2], cnpj=cnpj, output_format='polars')
+    chamadas = len(cvm.chamadas)
+    consulta = fundosbr([2003, 2021], [1, 2], cnpj=cnpj, lazy=True)
+    assert isinstance(consulta, pl.LazyFrame)
+    assert len(cvm.chamadas) == chamadas
+    assert_frame_equal(consulta.collect(), direto)
+    assert direto["CNPJ_FUNDO"].unique().to_list() == cnpj
+    #a leitura dentro de um concat ou join não pode ficar esperando pelo pool de threads do polars
+    assert_frame_equal(pl.concat([consulta, consulta]).collect(), pl.concat([direto, direto]))
+
+def test_lazy_leva_filtros_e_colunas_ao_leitor(cvm):
+    cvm.registrar_informe_anual(2003)
+    for mes in (2, 1):
+        cvm.registrar_informe(2021, mes)
+    consulta = fundosbr([2021, 2003], [2, 1], lazy=True, max_workers=4, chave_cnpj=True)
+    assert cvm.chamadas == []
+    filtro = pl.col("CNPJ_FUNDO") == cnpj_teste(3)
+    plano = consulta.filter(filtro).select("DT_COMPTC", "VL_QUOTA").explain()
+    assert "PROJECT 3/9 COLUMNS" in plano and "SELECTION" in plano
+    direto = fundosbr([2021, 2003], [2, 1], output_format='polars', chave_cnpj=True)
+    assert_frame_equal(consulta.filter(filtro).select("DT_COMPTC", "VL_QUOTA", "CHAVE_CNPJ").collect(),
+                       direto.filter(filtro).select("DT_COMPTC", "VL_QUOTA", "CHAVE_CNPJ"))
+    assert_frame_equal(consulta.head(5).collect(), direto.head(5))
+    #o erro de download só aparece no collect
+    with pytest.raises(pl.exceptions.ComputeError, match="Não foi possível baixar"):
+        fundosbr(2021, 3, lazy=True).collect()
+    assert_frame_equal(fundosbr(2099, 1, lazy=True).collect(), fundosbr(2099, 1, output_format='polars'))
+
+def test_subclasses_nao_sao_descartadas(cvm):
+    #a classe e duas subclasses na mesma data, e uma republicação da linha da classe
+    linhas = ["CLASSES - FIF;11.111.111/0001-11;;2025-01-02;1000.00;1.10;1000000.00;0.00;0.00;10",
+              "CLASSES - FIF;11.111.111/0001-11;SUB01;2025-01-02;1000.00;1.20;500000.00;0.00;0.00;5",
+              "CLASSES - FIF;11.111.111/0001-11;SUB02;2025-01-02;1000.00;1.30;500000.00;0.00;0.00;5",
+              "CLASSES - FIF;11.111.111/0001-11;;2025-01-02;1000.00;1.15;1000000.00;0.00;0.00;10"]
+    cvm.registrar("inf_diario_fi_202501.zip", zip_arquivos({"inf_diario_fi_202501.csv": csv_texto(COLUNAS_INFORME, linhas)}))
+    informe = fundosbr(2025, 1, output_format='polars')
+    informe = informe.sort("VL_QUOTA")
+    assert informe["ID_SUBCLASSE"].to_list() == [None, "SUB01", "SUB02"]
+    assert informe["VL_QUOTA"].to_list() == pytest.approx([1.15, 1.2, 1.3])
+
+def test_base_local_regrava_particao_sem_subclasse(cvm, tmp_path):
+    cvm.registrar_informe(2021, 1)
+    diretorio = str(tmp_path / "base")
+    assert atualizar_base(2021, 1, diretorio) == [(2021, 1)]
+    assert atualizar_base(2021, 1, diretorio) == []
+    caminho = _caminho_particao(diretorio, 2021, 1)
+    pl.read_parquet(caminho).drop("ID_SUBCLASSE").write_parquet(caminho)
+    assert_frame_equal(fundosbr(2021, 1, diretorio_base=diretorio, output_format='polars'),
+                       fundosbr(2021, 1, output_format='polars'))
+    assert atualizar_base(2021, 1, diretorio) == [(2021, 1)]
+    assert "ID_SUBCLASSE" in pl.read_parquet_schema(caminho)
+
+def test_expressoes_cnpj():
+    cnpjs = pl.DataFrame({"CNPJ": ["11.222.333/0001-81", "11222333000181", "11.222.333/0001-82", "00.000.000/0000-00",
+                                   "123", None, "00.000.000/0001-91"]})
+    resultado = cnpjs.select(expr_cnpj_valido("CNPJ").alias("valido"), expr_chave_cnpj("CNPJ").alias("chave"))
+    assert resultado["valido"].to_list() == [True, True, False, False, False, False, True]
+    assert resultado["chave"].to_list() == [11222333000181, 11222333000181, 11222333000182, 0, 123, None, 191]
+    assert pl.select(expr_pontua_cnpj(pl.lit(191))).item() == pontua_cnpj("191") == "00.000.000/0001-91"
+
+def test_ate_2004_o_csv_anual_e_separado_por_mes(cvm):
+    cvm.registrar_informe_anual(2003)
+    informe = fundosbr(2003, [2, 5], output_format='polars')
+    assert informe["DT_COMPTC"].dt.month().unique().sort().to_list() == [2, 5]
+    assert len(cvm.chamadas) == 1
+    ano_todo = fundosbr(2003, range(1, 13), output_format='polars')
+    assert_frame_equal(informe, ano_todo.filter(pl.col("DT_COMPTC").dt.month().is_in([2, 5])))
+    meses = [x["DT_COMPTC"].dt.month().unique().to_list() for x in iter_informes(2003, [1, 2])]
+    assert meses == [[1], [2]]
+
+def test_base_local_so_regrava_meses_alterados(cvm, tmp_path):
+    hoje = date.today()
+    indice = hoje.year * 12 + hoje.month - 1 - 2
+    ano, mes = indice // 12, indice % 12 + 1
+    cvm.registrar_informe(ano, mes, num_fundos=2)
+    cvm.registrar_informe(2021, 5)
+    diretorio = str(tmp_path / "base")
+    def sincronizar():
+        return atualizar_base(2021, 5, diretorio) + atualizar_base(ano, mes, diretorio)
+    assert sincronizar() == [(2021, 5), (ano, mes)]
+    chamadas = len(cvm.chamadas)
+    #mês fechado já gravado não é consultado; o recente é revalidado e não mudou
+    assert sincronizar() == []
+    assert len(cvm.chamadas) == chamadas + 1 and cvm.respostas[-1] == 304
+    cvm.registrar_informe(ano, mes, num_fundos=3, etag='"v2"')
+    assert sincronizar() == [(ano, mes)]
+    assert_frame_equal(fundosbr(ano, mes, diretorio_base=diretorio, output_format='polars'),
+                       fundosbr(ano, mes, output_format='polars'))
+
+def _informe_longo():
+    #F0 e F1 com 10 datas, F2 só nas 4 últimas e F3 só nas 3 primeiras; F1 também tem linhas de subclasse
+    datas = [date(2024, 1, 1) + timedelta(days=i) for i in range(10)]
+    linhas = []
+    for i, fundo in enumerate(["F0", "F1", "F2", "F3"]):
+        dias = {"F2": datas[6:], "F3": datas[:3]}.get(fundo, datas)
+        linhas += [(dia, fundo, None, 1.0 + i + 0.01 * j) for j, dia in enumerate(dias)]
+    linhas += [(dia, "F1", "SUB01", 99.0) for dia in datas]
+    return pl.DataFrame(linhas, schema={"DT_COMPTC": pl.Date, "CNPJ_FUNDO": pl.String, "ID_SUBCLASSE": pl.String,
+                                        "VL_QUOTA": pl.Float64}, orient="row")
+
+def test_serie_temporal_descarta_subclasses_e_usa_float32():
+    informe = _informe_longo()
+    serie = monta_serie_temporal(informe, colunas="CNPJ_FUNDO")
+    assert isinstance(serie, pd.DataFrame) and serie.index.name == "DT_COMPTC"
+    assert list(serie.columns) == ["F0", "F1", "F2", "F3"]
+    assert (serie.dtypes == np.float32).all()
+    assert serie["F1"].to_numpy() == pytest.approx([2.0 + 0.01 * j for j in range(10)])
+    assert serie["F2"].isna().sum() == 6 and serie["F3"].isna().sum() == 7
+    polars = monta_serie_temporal(informe.lazy(), colunas="CNPJ_FUNDO", dtype=pl.Float64, output_format="polars")
+    assert polars.schema == pl.Schema({"DT_COMPTC": pl.Date, **{f"F{i}": pl.Float64 for i in range(4)}})
+    assert polars["DT_COMPTC"].is_sorted()
+
+def test_serie_temporal_historico_minimo():
+    serie = monta_serie_temporal(_informe_longo(), colunas="CNPJ_FUNDO", historico_minimo=4)
+    assert list(serie.columns) == ["F0", "F1", "F2"]
+    #as linhas de subclasse não contam para o histórico: F1 tem 10 dias, não 20
+    assert list(monta_serie_temporal(_informe_longo(), colunas="CNPJ_FUNDO", historico_minimo=11).columns) == []
+
+def test_serie_temporal_aceita_pandas_com_data_no_indice():
+    informe = _informe_longo()
+    esperado = monta_serie_temporal(informe, colunas="CNPJ_FUNDO")
+    no_indice = informe.to_pandas().set_index("DT_COMPTC")
+    pd.testing.assert_frame_equal(monta_serie_temporal(no_indice, colunas="CNPJ_FUNDO"), esperado)
+    pd.testing.assert_frame_equal(monta_serie_temporal(no_indice.reset_index(), colunas="CNPJ_FUNDO"), esperado)
+
+def test_serie_temporal_em_blocos():
+    informe = _informe_longo()
+    completa = monta_serie_temporal(informe, colunas="CNPJ_FUNDO")
+    blocos = monta_serie_temporal(informe, colunas="CNPJ_FUNDO", tamanho_bloco=3)
+    assert not isinstance(blocos, pd.DataFrame)
+    blocos = list(blocos)
+    assert [list(bloco.columns) for bloco in blocos] == [["F0", "F1", "F2"], ["F3"]]
+    for bloco in blocos:
+        #cada bloco só tem as datas em que algum dos seus fundos tem valor
+        pd.testing.assert_frame_equal(bloco, completa[bloco.columns].dropna(how="all"))
+    assert len(blocos[1]) == 3
+
+def test_serie_temporal_vazia():
+    vazio = _informe_longo().clear()
+    assert monta_serie_temporal(vazio, colunas="CNPJ_FUNDO").empty
+    assert monta_serie_temporal(vazio, colunas="CNPJ_FUNDO", output_format="polars").columns == ["DT_COMPTC"]
+    assert list(monta_serie_temporal(vazio, colunas="CNPJ_FUNDO", tamanho_bloco=2)) == []
+
+def _cadastro(chave_cnpj=False):
+    #o fundo 3 não está no cadastro e o 4 não tem informe
+    cadastro = pl.DataFrame({"CNPJ_FUNDO": [cnpj_teste(i) for i in (4, 2, 1)],
+                             "Denominacao_Social": ["Fundo D", "Fundo B", "Fundo A"],
+                             "CLASSE": ["Ações", "Renda Fixa", "Multimercado"]})
+    return cadastro.with_columns(expr_chave_cnpj("CNPJ_FUNDO").alias("CHAVE_CNPJ")) if chave_cnpj else cadastro
+
+def test_mesclar_bases(cvm):
+    for mes in (1, 2):
+        cvm.registrar_informe(2021, mes)
+    informe = fundosbr(2021, [1, 2], output_format='polars')
+    mesclado = mesclar_bases(_cadastro(), informe, output_format='polars')
+    assert mesclado.columns == informe.columns + ["Denominacao_Social", "CLASSE", "CNPJ - Nome"]
+    assert mesclado["CNPJ - Nome"].dtype == pl.Categorical
+    assert sorted(mesclado["CNPJ - Nome"].unique().cast(pl.String)) == [f"{cnpj_teste(1)} // Fundo A",
+                                                                        f"{cnpj_teste(2)} // Fundo B"]
+    #mesma ordem do informe (por data e, na data, a do arquivo), só sem o fundo fora do cadastro
+    assert_frame_equal(mesclado.select(informe.columns), informe.filter(pl.col("CNPJ_FUNDO") != cnpj_teste(3)))
+    assert mesclado.filter(pl.col("CNPJ_FUNDO") == cnpj_teste(1))["CLASSE"].unique().to_list() == ["Multimercado"]
+    pandas = mesclar_bases(_cadastro().to_pandas(), informe.to_pandas().set_index("DT_COMPTC"))
+    assert pandas.index.name == "DT_COMPTC" and len(pandas) == len(mesclado)
+
+def test_mesclar_bases_por_chave_e_compactado(cvm):
+    for mes in (1, 2):
+        cvm.registrar_informe(2021, mes)
+    esperado = mesclar_bases(_cadastro(), fundosbr(2021, [1, 2], output_format='polars'), output_format='polars')
+    #cruzamento pelo CNPJ inteiro: o CNPJ_FUNDO do cadastro não é levado ao informe
+    por_chave = mesclar_bases(_cadastro(chave_cnpj=True), fundosbr(2021, [1, 2], chave_cnpj=True, output_format='polars'),
+                              output_format='polars')
+    assert_frame_equal(por_chave.drop("CHAVE_CNPJ"), esperado)
+    #informe compactado: CNPJ categórico vindo de meses lidos separadamente
+    compactado = mesclar_bases(_cadastro(), fundosbr(2021, [2, 1], compactar=True, output_format='polars'), output_format='polars')
+    assert compactado["CNPJ_FUNDO"].dtype == pl.Categorical
+    assert_frame_equal(compactado.select("DT_COMPTC", pl.col("CNPJ_FUNDO").cast(pl.String), "VL_QUOTA", "CNPJ - Nome"),
+                       esperado.select("DT_COMPTC", "CNPJ_FUNDO", "VL_QUOTA", "CNPJ - Nome"), check_dtypes=False)
+
+def test_mesclar_bases_lazy(cvm):
+    for mes in (1, 2):
+        cvm.registrar_informe(2021, mes)
+    esperado = mesclar_bases(_cadastro(chave_cnpj=True), fundosbr(2021, [1, 2], chave_cnpj=True, output_format='polars'),
+                             output_format='polars')
+    chamadas = len(cvm.chamadas)
+    consulta = mesclar_bases(_cadastro(chave_cnpj=True).lazy(), fundosbr(2021, [1, 2], chave_cnpj=True, lazy=True), lazy=True)
+    assert isinstance(consulta, pl.LazyFrame) and len(cvm.chamadas) == chamadas
+    assert_frame_equal(consulta.collect(), esperado)
+
+def _saida_desordenada():
+    return pl.DataFrame({"DT_COMPTC": [date(2024, 1, 2), date(2024, 1, 1), date(2024, 1, 1)],
+                         "CNPJ_FUNDO": ["B", "C", "A"], "VL_QUOTA": [1.5, 2.5, None]},
+                        schema_overrides={"CNPJ_FUNDO": pl.Categorical, "VL_QUOTA": pl.Float32})
+
+def test_formata_saida_tipos():
+    df = _saida_desordenada()
+    pandas = _formata_saida(df, "pandas", indice="DT_COMPTC")
+    assert isinstance(pandas, pd.DataFrame) and isinstance(pandas.index, pd.DatetimeIndex)
+    assert pandas["VL_QUOTA"].dtype == np.float32 and isinstance(pandas["CNPJ_FUNDO"].dtype, pd.CategoricalDtype)
+    assert pandas["VL_QUOTA"].isna().tolist() == [False, True, False]
+    pandas_arrow = _formata_saida(df, "pandas_arrow", indice="DT_COMPTC")
+    assert pandas_arrow.index.name == "DT_COMPTC"
+    assert all(isinstance(tipo, pd.ArrowDtype) for tipo in [pandas_arrow.index.dtype, *pandas_arrow.dtypes])
+    assert pandas_arrow["VL_QUOTA"].dtype.pyarrow_dtype == pa.float32()
+    assert pandas_arrow["VL_QUOTA"].isna().tolist() == [False, True, False]
+    arrow = _formata_saida(df, "arrow", indice="DT_COMPTC")
+    assert isinstance(arrow, pa.Table) and arrow.column_names == df.columns
+    assert arrow.schema.field("DT_COMPTC").type == pa.date32() and arrow.schema.field("VL_QUOTA").type == pa.float32()
+    polars = _formata_saida(df, "polars")
+    assert polars is df
+    #formatos desconhecidos e maiúsculas seguem a regra do pandas/polars
+    assert isinstance(_formata_saida(df, "PANDAS"), pd.DataFrame)
+    assert _formata_saida(df, "outro") is df
+
+def test_formata_saida_ordena_so_quando_preciso():
+    df = _saida_desordenada()
+    #ordenação estável: na mesma data, a ordem original
+    assert _formata_saida(df, "polars", indice="DT_COMPTC")["CNPJ_FUNDO"].cast(pl.String).to_list() == ["C", "A", "B"]
+    assert _formata_saida(df, "pandas")["CNPJ_FUNDO"].tolist() == ["B", "C", "A"]
+    ordenado = df.sort("DT_COMPTC", maintain_order=True)
+    assert _formata_saida(ordenado, "polars", indice="DT_COMPTC") is ordenado
+    assert _formata_saida(ordenado, "arrow", indice="DT_COMPTC").column("CNPJ_FUNDO").to_pylist() == ["C", "A", "B"]
@@ -0,0 +1,28 @@
+import json
+import os
+import subprocess
+import sys
+
+#tempo máximo do import da biblioteca, em segundos. Medido em ~0,9 s, praticamente o tempo de pandas e polars;
+#antes de adiar matplotlib, seaborn, yfinance e tesouro_direto_br o import levava ~3 s
+ORCAMENTO_IMPORT = 2.0
+
+MODULOS_ADIADOS = ["matplotlib", "seaborn", "yfinance", "tesouro_direto_br", "pyettj", "tqdm"]
+
+def _importar_em_processo_novo():
+    codigo = ("import json, sys, time; inicio = time.perf_counter(); import comparar_fundos_br; "
+              "print(json.dumps({'tempo': time.perf_counter() - inicio, 'modulos': list(sys.modules)}))")
+    ambiente = dict(os.environ)
+    ambiente["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.join(os.path.dirname(__file__), "..", "src"),
+                                                           ambiente.get("PYTHONPATH")]))
+    saida = subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True, env=ambiente, check=True)
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+def test_import_nao_carrega_dependencias_pesadas():
+    resultado = _importar_em_processo_novo()
+    carregados = [modulo for modulo in MODULOS_ADIADOS if modulo in resultado["modulos"]]
+    assert carregados == []
+
+def test_orcamento_tempo_import():
+    resultado = _importar_em_processo_novo()
+    assert resultado["tempo"] < ORCAMENTO_IMPORT
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+from comparar_fundos_br.metricas import calcula_drawdown, calcula_metricas_desempenho
+
+def _dados():
+    rng = np.random.default_rng(1)
+    datas = pd.bdate_range("2021-01-01", periods=400)
+    cotas = pd.DataFrame(np.cumprod(1 + rng.normal(0.0004, 0.01, (400, 6)), axis=0),
+                         index=datas, columns=[f"F{i}" for i in range(6)])
+    cotas.iloc[:120, 1] = np.nan
+    cotas.iloc[300:, 2] = np.nan
+    cotas.iloc[[50, 51, 200], 3] = np.nan
+    cdi = pd.DataFrame({"CDI": np.full(400, 0.0004)}, index=datas)
+    cdi["Retorno CDI"] = cdi["CDI"]
+    ibov = pd.DataFrame({"IBOV": np.cumprod(1 + rng.normal(0.0003, 0.012, 400)) * 100}, index=datas)
+    ibov["Retorno IBOV"] = ibov["IBOV"].pct_change()
+    return cotas, cdi, ibov
+
+def test_metricas_iguais_ao_calculo_por_fundo():
+    cotas, cdi, ibov = _dados()
+    metricas = calcula_metricas_desempenho(cotas, cdi=cdi, benchmarks=ibov)
+    for fundo in cotas.columns:
+        serie = cotas[fundo]
+        serie = serie.loc[serie.first_valid_index():serie.last_valid_index()].ffill()
+        retorno = serie.pct_change()
+        excesso = (retorno - cdi["Retorno CDI"]).dropna()
+        ativo = (retorno - ibov["Retorno IBOV"]).dropna()
+        excesso_ibov = (ibov["Retorno IBOV"] - cdi["Retorno CDI"]).reindex(excesso.index).dropna()
+        beta = excesso.reindex(excesso_ibov.index).cov(excesso_ibov) / excesso_ibov.var()
+        esperado = {"volatilidade": retorno.std() * np.sqrt(252),
+                    "max_drawdown": (serie / serie.cummax() - 1).min(),
+                    "sharpe": excesso.mean() / excesso.std() * np.sqrt(252),
+                    "sortino": excesso.mean() / np.sqrt((np.minimum(excesso, 0)**2).mean()) * np.sqrt(252),
+                    "beta IBOV": beta,
+                    "tracking_error IBOV": ativo.std() * np.sqrt(252)}
+        for coluna, valor in esperado.items():
+            assert np.isclose(metricas.loc[fundo, coluna], valor), (fundo, coluna)
+
+def test_duracao_drawdown():
+    cotas = pd.DataFrame({"A": [1.0, 2.0, 1.5, 1.8, 2.1, 1.9, np.nan, 2.0]},
+                         index=pd.bdate_range("2024-01-01", periods=8))
+    metricas = calcula_metricas_desempenho(cotas)
+    assert metricas.loc["A", "max_drawdown"] == -0.25
+    assert metricas.loc["A", "duracao_max_drawdown"] == 3
+    assert not np.isnan(calcula_drawdown(cotas).iloc[6, 0])